@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.core.metrics import CONTENT_TYPE_LATEST, render_metrics
+
+router = APIRouter(tags=["Monitoring"])
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus Metrics",
+    description="Exposes request, redirect, cache and database metrics in the Prometheus text format.",
+    response_class=Response,
+)
+async def metrics():
+    """
+    Metrics of all workers when PROMETHEUS_MULTIPROC_DIR is set, otherwise of the serving worker.
+    """
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,52 @@
+"""
+Redirect modes and the HTTP caching headers that go with them.
+
+Every link redirects with its own `redirect_status` or, if it has none, the
+global ``REDIRECT_STATUS``:
+
+- 301 and 308 are cacheable: they carry ``Cache-Control: public, max-age=...``
+  (the link's `redirect_max_age` or ``REDIRECT_MAX_AGE``) and an ETag, so
+  browsers and CDNs answer repeat clicks themselves. Visit counts of these
+  links only include the clicks that reach us.
+- 302 and 307 carry ``Cache-Control: no-store``, so every click is served, and
+  counted, here.
+"""
+import hashlib
+from functools import lru_cache
+from typing import Optional
+
+from app.core.setting import settings
+from app.db.cache import CachedURL
+
+__all__ = ["CACHEABLE_STATUSES", "REDIRECT_STATUSES", "etag_matches", "redirect_headers", "redirect_mode"]
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+CACHEABLE_STATUSES = frozenset({301, 308})
+
+
+# Status code and Cache-Control max-age a redirect to `url` is served with
+def redirect_mode(url: CachedURL) -> tuple[int, int]:
+    status = url.redirect_status or settings.REDIRECT_STATUS
+    max_age = url.redirect_max_age if url.redirect_max_age is not None else settings.REDIRECT_MAX_AGE
+    return status, max_age
+
+
+# Caching headers of a redirect to `original_url`, computed once per distinct link;
+# the ETag changes whenever the target or the status does
+@lru_cache(maxsize=max(settings.REDIRECT_CACHE_MAX_SIZE, 1))
+def redirect_headers(original_url: str, status: int, max_age: int) -> tuple[tuple[str, str], ...]:
+    if status not in CACHEABLE_STATUSES:
+        return ("cache-control", "no-store"),
+    digest = hashlib.blake2b(f"{status} {original_url}".encode("utf-8"), digest_size=8).hexdigest()
+    return ("cache-control", f"public, max-age={max_age}"), ("etag", f'"{digest}"')
+
+
+# Whether an If-None-Match header value matches `etag` (weak comparison, as for GET)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
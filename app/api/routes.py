@@ -1,16 +1,55 @@
-from fastapi import APIRouter, HTTPException, Request, Depends, status, Body, Path
-from fastapi.responses import RedirectResponse
+import json
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Depends, status, Body, Path, Query
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.redirects import etag_matches, redirect_headers, redirect_mode
+from app.api.streaming import (
+    NDJSONStreamingResponse,
+    StreamParseError,
+    iter_json_array,
+    iter_ndjson,
+)
+from app.core.metrics import redirects
+from app.core.rate_limit import RateLimit
+from app.core.setting import settings
 from app.db import crud
-from app.db.session import get_session
+from app.db.rollups import Granularity, bucket_start
+from app.db.health import ReadinessCheck
+from app.db.models import as_naive_utc, utcnow
+from app.db.session import LazySession, get_lazy_session, get_session, get_session_factory, pool_stats
 from app.schemas.routes import (
     HealthCheckResponse,
+    PoolStatsResponse,
+    StatsBatchRequestBody,
+    StatsBatchResponse,
     URLResponse,
     URLCreateRequestBody,
     URLStatsResponse,
+    URLTimeseriesResponse,
 )
 
+# Range covered by the timeseries endpoint when no start is given
+DEFAULT_TIMESERIES_SPAN = {
+    Granularity.minute: timedelta(hours=1),
+    Granularity.hour: timedelta(days=7),
+    Granularity.day: timedelta(days=30),
+}
+
+# Shared by all readiness probes of this worker
+readiness_check = ReadinessCheck(settings.READINESS_CACHE_TTL, settings.READINESS_TIMEOUT)
+
+# Entries encoded per chunk of a streamed batch stats response
+STATS_BATCH_CHUNK_SIZE = 200
+
+# Per-IP token buckets; the bulk endpoint draws from the same bucket as single shortens
+shorten_rate_limit = RateLimit("shorten", settings.RATE_LIMIT_SHORTEN_RATE, settings.RATE_LIMIT_SHORTEN_BURST)
+redirect_rate_limit = RateLimit("redirect", settings.RATE_LIMIT_REDIRECT_RATE, settings.RATE_LIMIT_REDIRECT_BURST)
+
 router = APIRouter(
     prefix="/api/v1",
     tags=["URL Shortener"],
@@ -24,16 +63,94 @@ router = APIRouter(
     summary="Health Check",
     description="Check if the service is running and reachable.",
 )
-def ping(
-        request: Request,
-        session: AsyncSession = Depends(get_session),
-):
+async def ping():
     """
     Simple health check endpoint to verify the service is up.
     """
     return {"status": "ok"}
 
 
+@router.get(
+    "/health/live/",
+    response_model=HealthCheckResponse,
+    summary="Liveness Probe",
+    description="Reports that the process is up and serving requests, without touching the database.",
+)
+async def liveness():
+    """
+    Liveness probe; never checks dependencies, so a database outage doesn't restart the app.
+    """
+    return {"status": "ok"}
+
+
+@router.get(
+    "/health/ready/",
+    response_model=HealthCheckResponse,
+    summary="Readiness Probe",
+    description="Reports whether the database answers, reusing the result for a short time.",
+    responses={
+        503: {"description": "Database unavailable"},
+    },
+)
+async def readiness(
+        session_factory=Depends(get_session_factory),
+):
+    """
+    Readiness probe backed by a pooled `SELECT 1` with a timeout, cached for READINESS_CACHE_TTL seconds.
+    """
+    if not await readiness_check.check(session_factory):
+        return JSONResponse({"status": "unavailable"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ok"}
+
+
+@router.get(
+    "/stats/pool/",
+    response_model=PoolStatsResponse,
+    summary="Database Pool Statistics",
+    description="Returns the connection pool usage of the worker serving the request.",
+)
+async def database_pool_stats():
+    """
+    Reports pool size, idle and in-use connections, to spot pool exhaustion.
+    """
+    return pool_stats()
+
+
+@router.post(
+    "/stats/batch/",
+    summary="Get Statistics for Many URLs",
+    description="Returns the number of visits for each of a list of short codes, with one query.",
+    responses={
+        200: {"description": "Visit counts per short code, in request order", "model": StatsBatchResponse},
+        422: {"description": "Invalid body or too many short codes"},
+    },
+)
+async def stats_batch(
+        data: StatsBatchRequestBody = Body(..., description="The short codes to get statistics for."),
+        session: AsyncSession = Depends(get_session),
+):
+    """
+    Reads the visit counters of all requested codes at once; unknown codes are
+    reported with status 404 in their entry. The JSON is encoded in chunks as it streams.
+    """
+    codes = list(dict.fromkeys(data.short_codes))
+    visits = await crud.count_visits_by_codes(codes, session)
+
+    def entry(code: str) -> dict:
+        if code in visits:
+            return {"short_code": code, "visits": visits[code], "status": 200}
+        return {"short_code": code, "visits": None, "status": 404, "error": "URL not found"}
+
+    async def body():
+        yield '{"stats":['
+        for start in range(0, len(codes), STATS_BATCH_CHUNK_SIZE):
+            chunk = ",".join(json.dumps(entry(code)) for code in codes[start:start + STATS_BATCH_CHUNK_SIZE])
+            yield chunk if start == 0 else "," + chunk
+        yield "]}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
 @router.post(
     "/shorten/",
     response_model=URLResponse,
@@ -44,7 +161,10 @@ def ping(
     responses={
         201: {"description": "Successfully shortened the URL"},
         422: {"description": "Validation Error"},
+        429: {"description": "Too many requests from this client"},
+        503: {"description": "No unique short code could be allocated"},
     },
+    dependencies=[Depends(shorten_rate_limit)],
 )
 async def shorten_url(
         data: URLCreateRequestBody = Body(..., description="The original URL to shorten."),
@@ -53,33 +173,138 @@ async def shorten_url(
     """
     Accepts a long URL and generates a shortened version.
     """
-    return await crud.create_short_url(data.original_url, session)
+    try:
+        return await crud.create_short_url(
+            data.original_url, session, data.redirect_status, data.redirect_max_age, data.expires_at, data.max_clicks
+        )
+    except crud.ShortCodeAllocationError as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc))
+
+
+@router.post(
+    "/shorten/bulk/",
+    summary="Shorten many URLs",
+    description=(
+        "Takes a JSON array or an NDJSON stream (`Content-Type: application/x-ndjson`) of URLs, "
+        "each either a string or an object with `original_url`, and streams back one NDJSON line "
+        "per input: `{index, original_url, short_code, created}` or `{index, error}`."
+    ),
+    response_description="NDJSON stream of results, in input order",
+    responses={
+        200: {"description": "Results streamed as NDJSON", "content": {"application/x-ndjson": {}}},
+        429: {"description": "Too many requests from this client"},
+    },
+    dependencies=[Depends(shorten_rate_limit)],
+)
+async def shorten_bulk(
+        request: Request,
+        session_factory=Depends(get_session_factory),
+):
+    """
+    Shortens URLs in batches while the upload is still streaming in, so memory stays flat
+    regardless of its size. A malformed body ends the stream with a final error line.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = iter_ndjson(request.stream(), settings.BULK_SHORTEN_MAX_ITEM_BYTES)
+    else:
+        items = iter_json_array(request.stream(), settings.BULK_SHORTEN_MAX_ITEM_BYTES)
+
+    async def process(batch: list, first_index: int, session: AsyncSession) -> str:
+        lines = []
+        valid = []
+        for index, item in enumerate(batch, first_index):
+            try:
+                data = URLCreateRequestBody.model_validate(
+                    item if isinstance(item, dict) else {"original_url": item}
+                )
+            except ValidationError as exc:
+                lines.append({"index": index, "error": exc.errors(include_url=False)[0]["msg"]})
+            else:
+                original_url = str(data.original_url)
+                valid.append(original_url)
+                lines.append({"index": index, "original_url": original_url})
+
+        try:
+            created = await crud.create_short_urls(valid, session) if valid else {}
+        except crud.ShortCodeAllocationError as exc:
+            # Reported per item; the stream goes on with the next batch
+            await session.rollback()
+            created = {}
+            lines = [line if "error" in line else {"index": line["index"], "error": str(exc)} for line in lines]
+        for line in lines:
+            if "original_url" in line:
+                line["short_code"], line["created"] = created[line["original_url"]]
+        return "".join(json.dumps(line) + "\n" for line in lines)
+
+    async def results():
+        index = 0
+        batch = []
+        async with session_factory() as session:
+            try:
+                async for item in items:
+                    batch.append(item)
+                    if len(batch) >= settings.BULK_SHORTEN_BATCH_SIZE:
+                        yield await process(batch, index, session)
+                        index += len(batch)
+                        batch = []
+            except StreamParseError as exc:
+                # Results for the items parsed so far, then the error
+                if batch:
+                    yield await process(batch, index, session)
+                    index += len(batch)
+                yield json.dumps({"index": index, "error": str(exc)}) + "\n"
+                return
+            if batch:
+                yield await process(batch, index, session)
+
+    return NDJSONStreamingResponse(results())
 
 
 @router.get(
     "/{short_code}/",
     summary="Redirect to Original URL",
-    description="Redirects the user to the original long URL using the short code.",
+    description=(
+        "Redirects the user to the original long URL using the short code, with the link's "
+        "redirect status (307 by default) and matching Cache-Control and ETag headers."
+    ),
     responses={
-        302: {"description": "Redirected successfully"},
+        301: {"description": "Redirected permanently (cacheable)"},
+        302: {"description": "Redirected temporarily (not cached)"},
+        304: {"description": "The client's cached redirect is still valid"},
+        307: {"description": "Redirected temporarily (not cached)"},
+        308: {"description": "Redirected permanently (cacheable)"},
         404: {"description": "Short code not found"},
+        410: {"description": "The link has expired"},
+        429: {"description": "Too many requests from this client"},
     },
+    dependencies=[Depends(redirect_rate_limit)],
 )
 async def redirect(
         short_code: str = Path(..., description="The short code to redirect to the original URL."),
         request: Request = None,
-        session: AsyncSession = Depends(get_session),
+        session: LazySession = Depends(get_lazy_session),
 ):
     """
     Redirect to the original URL if the short code exists.
-    Also logs the visit with client's IP.
+    Also logs the visit with client's IP. A conditional request whose ETag
+    still matches a cacheable redirect is answered with 304 Not Modified.
     """
-    url = await crud.get_url_by_code(short_code, session)
+    url = await crud.get_cached_url_by_code(short_code, session)
     if not url:
+        redirects.labels("not_found").inc()
         raise HTTPException(status_code=404, detail="URL not found")
+    if url.expired():
+        redirects.labels("expired").inc()
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="URL expired")
 
-    await crud.create_visit(url.id, request.client.host, session)
-    return RedirectResponse(url.original_url)
+    redirects.labels("hit").inc()
+    await crud.record_visit(url.id, request.client.host, session)
+    status_code, max_age = redirect_mode(url)
+    headers = dict(redirect_headers(url.original_url, status_code, max_age))
+    if "etag" in headers and etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return RedirectResponse(url.original_url, status_code=status_code, headers=headers)
 
 
 @router.get(
@@ -94,7 +319,7 @@ async def redirect(
 )
 async def stats(
         short_code: str = Path(..., description="The short code to get statistics for."),
-        session: AsyncSession = Depends(get_session),
+        session: LazySession = Depends(get_lazy_session),
 ):
     """
     Retrieves the number of visits for the given short URL code.
@@ -103,3 +328,51 @@ async def stats(
     if visits is None:
         raise HTTPException(status_code=404, detail="URL not found")
     return {"visits": visits}
+
+
+@router.get(
+    "/{short_code}/stats/timeseries/",
+    response_model=URLTimeseriesResponse,
+    summary="Get URL Visit Timeseries",
+    description="Returns visit counts per minute, hour or day for a given short URL.",
+    responses={
+        200: {"description": "Returns visits per time bucket for the short URL"},
+        404: {"description": "Short code not found"},
+        422: {"description": "Invalid or too large time range"},
+    },
+)
+async def stats_timeseries(
+        short_code: str = Path(..., description="The short code to get statistics for."),
+        granularity: Granularity = Query(Granularity.hour, description="Bucket size."),
+        start: Optional[datetime] = Query(None, description="Start of the range (defaults depend on granularity)."),
+        end: Optional[datetime] = Query(None, description="End of the range, exclusive (defaults to now)."),
+        session: LazySession = Depends(get_lazy_session),
+):
+    """
+    Retrieves visits per time bucket from the rollup table, oldest bucket first.
+    """
+    end = as_naive_utc(end or utcnow())
+    start = as_naive_utc(start) if start else end - DEFAULT_TIMESERIES_SPAN[granularity]
+    start = bucket_start(start, granularity)
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end")
+    if (end - start) / granularity.step > settings.TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(status_code=422, detail="Requested range contains too many buckets")
+
+    url = await crud.get_cached_url_by_code(short_code, session)
+    if not url:
+        raise HTTPException(status_code=404, detail="URL not found")
+
+    counts = await crud.get_visit_timeseries(url.id, granularity, start, end, session)
+    buckets = []
+    current = start
+    while current < end:
+        buckets.append({"start": current.replace(tzinfo=UTC), "visits": counts.get(current, 0)})
+        current += granularity.step
+
+    return {
+        "granularity": granularity,
+        "start": start.replace(tzinfo=UTC),
+        "end": end.replace(tzinfo=UTC),
+        "buckets": buckets,
+    }
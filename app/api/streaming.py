@@ -0,0 +1,108 @@
+import codecs
+import json
+from typing import Any, AsyncIterable, AsyncIterator
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+__all__ = ["NDJSONStreamingResponse", "StreamParseError", "iter_json_array", "iter_ndjson"]
+
+_WHITESPACE = " \t\r\n"
+
+
+class StreamParseError(ValueError):
+    """
+    Raised when a streamed request body is not valid NDJSON or a JSON array.
+    """
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streams NDJSON produced while the request body is still being read.
+
+    StreamingResponse normally polls `receive` for a client disconnect while
+    streaming, which would swallow the request body chunks the body iterator is
+    reading; here the iterator itself sees the disconnect via ClientDisconnect.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# Yields one decoded JSON value per non-empty line of an NDJSON byte stream
+async def iter_ndjson(chunks: AsyncIterable[bytes], max_line_bytes: int) -> AsyncIterator[Any]:
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _loads(line)
+        if len(pending) > max_line_bytes:
+            raise StreamParseError(f"Line longer than {max_line_bytes} bytes")
+    if pending.strip():
+        yield _loads(pending)
+
+
+def _loads(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        raise StreamParseError(f"Invalid JSON line: {exc}") from None
+
+
+# Yields the elements of a top-level JSON array as they arrive, holding at most
+# one element (of up to `max_item_bytes`) in memory
+async def iter_json_array(chunks: AsyncIterable[bytes], max_item_bytes: int) -> AsyncIterator[Any]:
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    state = "start"  # start -> first -> (value -> separator)* -> done
+
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise StreamParseError("Expected a JSON array")
+                pos += 1
+                state = "first"
+            elif state in ("first", "separator") and char == "]":
+                pos += 1
+                state = "done"
+            elif state == "separator":
+                if char != ",":
+                    raise StreamParseError("Expected ',' or ']' between array elements")
+                pos += 1
+                state = "value"
+            elif state in ("first", "value"):
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    break  # Element is incomplete; wait for more data
+                if end == len(buffer) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    break  # A number may go on in the next chunk; a valid array can't end with it
+                pos = end
+                yield value
+                state = "separator"
+            else:
+                raise StreamParseError("Unexpected data after the JSON array")
+
+        buffer = buffer[pos:]
+        if len(buffer) > max_item_bytes:
+            raise StreamParseError(f"Array element longer than {max_item_bytes} bytes")
+
+    buffer += text.decode(b"", final=True)
+    if state != "done" or buffer.strip():
+        raise StreamParseError("Incomplete or invalid JSON array")
+
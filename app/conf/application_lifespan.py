@@ -1,19 +1,29 @@
+import asyncio
+import contextlib
 import logging
-import logging.config
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from sqlmodel import SQLModel
 
-from app.db.session import engine
-from .logging import configure_logging
+from app.core.metrics import mark_process_dead
+from app.core.rate_limit import rate_limiter
+from app.core.setting import settings
+from app.db.cache import redirect_cache
+from app.db.cache_backends import run_invalidation_listener
+from app.db.code_filter import short_code_filter
+from app.db.maintenance import run_link_sweeper
+from app.db.partitions import run_partition_maintenance
+from app.db.replicas import replicas
+from app.db.session import async_session_maker, check_connection_limits, engine
+from app.db.visits import visit_recorder
+from .logging import flush_logging
 
 
 # --- Application Lifespan ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup phase
-    configure_logging()
+    # Startup phase (logging is configured once, in app.main)
     logger = logging.getLogger(__name__)
     logger.info("Initializing database...")
 
@@ -21,13 +31,97 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
 
+    # Warn early if the configured pools can exhaust the database's connections
+    await check_connection_limits()
+
+    # Start the background visit writer
+    if settings.VISIT_QUEUE_ENABLED:
+        await visit_recorder.start()
+
+    # Follow redirect cache invalidations published by other workers; they also
+    # announce the codes those workers create, for the short code filter
+    def on_invalidation(codes):
+        redirect_cache.on_remote_invalidation(codes)
+        short_code_filter.add_many(codes)
+
+    invalidation_task = None
+    if redirect_cache.backend is not None:
+        invalidation_task = asyncio.create_task(
+            run_invalidation_listener(redirect_cache.backend, on_invalidation)
+        )
+
+    # Send unknown short codes straight to the primary. Without a shared cache, other workers'
+    # new codes only arrive with the next sync, each costing a primary lookup until then, and
+    # the worker count can't be known (`uvicorn --workers` doesn't tell the app), so it must
+    # be enabled explicitly then.
+    filter_task = None
+    filter_enabled = settings.SHORT_CODE_FILTER_ENABLED
+    if filter_enabled is None:
+        filter_enabled = redirect_cache.backend is not None
+    if filter_enabled:
+        if redirect_cache.backend is None and settings.WEB_CONCURRENCY > 1:
+            logger.warning("Short code filter disabled: several workers need REDIS_URL to share new codes")
+        else:
+            await short_code_filter.build(async_session_maker)
+            filter_task = asyncio.create_task(short_code_filter.run(
+                async_session_maker,
+                sync_interval=settings.SHORT_CODE_FILTER_SYNC_INTERVAL,
+                rebuild_interval=settings.SHORT_CODE_FILTER_REBUILD_INTERVAL,
+            ))
+
+    # Keep track of which read replicas can take queries
+    replica_health_task = None
+    if replicas.enabled:
+        replica_health_task = asyncio.create_task(replicas.run_health_checks())
+
+    # Create upcoming url_visit partitions now and then periodically, and expire old ones
+    partition_task = None
+    if engine.dialect.name == "postgresql":
+        partition_task = asyncio.create_task(run_partition_maintenance(
+            async_session_maker,
+            interval=settings.VISIT_PARTITION_MAINTENANCE_INTERVAL,
+            months_ahead=settings.VISIT_PARTITION_PREMAKE_MONTHS,
+            retention_days=settings.VISIT_RAW_RETENTION_DAYS,
+            archive_schema=settings.VISIT_PARTITION_ARCHIVE_SCHEMA,
+        ))
+
+    # Delete links past their expiry (plus the retention) in the background
+    sweeper_task = None
+    if settings.LINK_SWEEP_INTERVAL > 0:
+        sweeper_task = asyncio.create_task(run_link_sweeper(
+            async_session_maker,
+            interval=settings.LINK_SWEEP_INTERVAL,
+            retention_days=settings.LINK_EXPIRED_RETENTION_DAYS,
+            batch_size=settings.LINK_SWEEP_BATCH_SIZE,
+        ))
+
     logger.info("Application startup complete")
     yield
 
     # Shutdown phase
     logger.info("Shutting down...")
 
-    # Properly dispose the database engine
+    for task in (invalidation_task, filter_task, replica_health_task, partition_task, sweeper_task):
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    # Flush queued visits before the engine goes away, and before the redirect cache
+    # closes: the flush invalidates links that reach their click limit
+    await visit_recorder.stop()
+
+    await redirect_cache.close()
+    await rate_limiter.close()
+
+    # Properly dispose the database engines
+    await replicas.close()
     await engine.dispose()
 
+    # Stop counting this worker's live gauges (multiprocess metrics)
+    mark_process_dead()
+
     logger.info("Application shutdown complete")
+
+    # Write out queued log records before the process exits
+    await asyncio.to_thread(flush_logging)
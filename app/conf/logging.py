@@ -1,6 +1,13 @@
+import atexit
+import copy
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
+from collections import Counter
+from typing import Optional
 
 # --- Configuration ---
 # Default log directory is "logs"
@@ -9,19 +16,150 @@ LOG_DIR = os.getenv("LOG_DIR", "logs")
 # Logging level (e.g., INFO, DEBUG, WARNING)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+# Output format: "text" (human-readable lines) or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
 # Maximum size of a log file in bytes before it gets rotated
 LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # 10MB
 
 # Number of backup log files to keep
 LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
 
+# Maximum number of records waiting to be written; further records are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+
+# Maximum number of records written between two flushes of the log handlers
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 100))
+
+# Background thread writing queued records, set once logging is configured
+_listener: Optional["BatchingQueueListener"] = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without blocking: when the bounded queue
+    is full the record is dropped and counted per level.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = Counter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, since they may change before the record is
+        # written; all other formatting happens on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped[record.levelname] += 1
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Writes queued records in batches of up to `batch_size`, flushing the handlers
+    once per batch instead of once per record. Reports records dropped by
+    `queue_handler` as a warning.
+    """
+
+    def __init__(self, q: queue.Queue, queue_handler: DroppingQueueHandler, *handlers: logging.Handler,
+                 batch_size: int = 100):
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.batch_size = batch_size
+        self._reported_drops = 0
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than failing on a full queue
+        self.queue.put(self._sentinel)
+
+    def _monitor(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    stopping = True
+                else:
+                    self.handle(record)
+            self._report_drops()
+            for handler in self.handlers:
+                handler.acquire()
+                try:
+                    _flush(handler)
+                finally:
+                    handler.release()
+            for _ in batch:
+                self.queue.task_done()
+
+    def _report_drops(self) -> None:
+        dropped = sum(self.queue_handler.dropped.values())
+        if dropped > self._reported_drops:
+            record = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "Dropped %d log records because the log queue was full (%d in total)",
+                (dropped - self._reported_drops, dropped), None,
+            )
+            self._reported_drops = dropped
+            self.handle(record)
+
+
+class _DeferredFlushMixin:
+    # Flushing is left to the listener, which flushes once per batch
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+    def close(self) -> None:
+        self.flush_batch()
+        super().close()
+
+
+class BatchedStreamHandler(_DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchedRotatingFileHandler(_DeferredFlushMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+def _flush(handler: logging.Handler) -> None:
+    try:
+        if isinstance(handler, _DeferredFlushMixin):
+            handler.flush_batch()
+        else:
+            handler.flush()
+    except (OSError, ValueError):
+        pass  # Stream already closed, as tolerated by logging.shutdown()
+
 
 # --- Logging Setup ---
+# Configures the root logger once per process; later calls are no-ops.
+# Records are queued by the logging call and written by a background thread, so
+# formatting and file I/O (including rotation) stay off the event loop.
 def configure_logging():
+    global _listener
+    if _listener is not None:
+        return
+
     # Ensure the log directory exists
     os.makedirs(LOG_DIR, exist_ok=True)
 
     # Define the logging configuration
+    formatter = "json" if LOG_FORMAT == "json" else "standard"
     log_config = {
         "version": 1,
         "disable_existing_loggers": False,  # Allow other loggers to function
@@ -29,21 +167,27 @@ def configure_logging():
             "standard": {
                 "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
                 "datefmt": "%Y-%m-%d %H:%M:%S"
+            },
+            # Structured output; `extra` fields (e.g. the access log's `http`) become keys
+            "json": {
+                "()": "pythonjsonlogger.json.JsonFormatter",
+                "fmt": "%(asctime)s %(levelname)s %(name)s %(message)s",
+                "rename_fields": {"asctime": "time", "levelname": "level", "name": "logger"},
             }
         },
         "handlers": {
             # Write logs to a rotating file
             "file": {
-                "class": "logging.handlers.RotatingFileHandler",
+                "class": "app.conf.logging.BatchedRotatingFileHandler",
                 "filename": f"{LOG_DIR}/access.log",
                 "maxBytes": LOG_MAX_BYTES,
                 "backupCount": LOG_BACKUP_COUNT,
-                "formatter": "standard"
+                "formatter": formatter
             },
             # Output logs to the console
             "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "standard"
+                "class": "app.conf.logging.BatchedStreamHandler",
+                "formatter": formatter
             }
         },
         # Root logger configuration
@@ -55,3 +199,36 @@ def configure_logging():
 
     # Apply the logging configuration
     logging.config.dictConfig(log_config)
+
+    # Move the configured handlers behind the queue
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    root.handlers = [queue_handler]
+    _listener = BatchingQueueListener(log_queue, queue_handler, *handlers, batch_size=LOG_BATCH_SIZE)
+    _listener.start()
+    atexit.register(_stop_listener)
+
+
+# Blocks until every record queued so far has been written and flushed
+def flush_logging():
+    if _listener is not None and _listener._thread is not None \
+            and _listener._thread is not threading.current_thread():
+        _listener.queue.join()
+
+
+# Returns the log queue depth and the number of dropped records per level
+def logging_stats() -> dict:
+    if _listener is None:
+        return {"queue_size": 0, "queue_max_size": LOG_QUEUE_SIZE, "dropped": {}}
+    return {
+        "queue_size": _listener.queue.qsize(),
+        "queue_max_size": _listener.queue.maxsize,
+        "dropped": dict(_listener.queue_handler.dropped),
+    }
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
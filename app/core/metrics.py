@@ -0,0 +1,133 @@
+"""
+Prometheus metrics for the URL shortener.
+
+With several worker processes, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory shared by the workers (and cleared before they start); every worker
+then writes its samples there and ``/metrics`` aggregates them across workers.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+__all__ = [
+    "CONTENT_TYPE_LATEST",
+    "db_pool_connections",
+    "db_query_duration",
+    "http_request_duration",
+    "instrument_engine",
+    "mark_process_dead",
+    "rate_limited",
+    "redirect_cache_lookups",
+    "redirects",
+    "render_metrics",
+]
+
+# Latency buckets in seconds, fine-grained at the low end where redirects live
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving HTTP requests",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+redirects = Counter(
+    "redirects_total",
+    "Redirect requests by outcome",
+    ["result"],  # hit, not_found, expired
+)
+
+redirect_cache_lookups = Counter(
+    "redirect_cache_lookups_total",
+    "Short code lookups by the level that answered them",
+    ["source"],  # l1, l2, database, coalesced, filtered (rejected by the short code filter)
+)
+
+rate_limited = Counter(
+    "rate_limited_total",
+    "Requests rejected by the rate limiter",
+    ["route"],  # shorten, redirect
+)
+
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements",
+    ["engine", "statement"],
+    buckets=LATENCY_BUCKETS,
+)
+
+db_pool_connections = Gauge(
+    "db_pool_connections",
+    "Database connections per state, summed over live workers",
+    ["engine", "state"],  # in_use, open
+    multiprocess_mode="livesum",
+)
+
+
+# Records statement timings and pool usage of `engine` under the label `name`
+def instrument_engine(engine: AsyncEngine, name: str = "primary") -> None:
+    sync_engine = engine.sync_engine
+    in_use = db_pool_connections.labels(name, "in_use")
+    opened = db_pool_connections.labels(name, "open")
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        # Label by statement kind only, to keep the number of series bounded
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        db_query_duration.labels(name, kind).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None:
+            started = context.connection.info.get("query_started")
+            if started:
+                started.pop()
+
+    @event.listens_for(sync_engine.pool, "connect")
+    def connect(dbapi_connection, connection_record):
+        opened.inc()
+
+    @event.listens_for(sync_engine.pool, "close")
+    def close(dbapi_connection, connection_record):
+        opened.dec()
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use.inc()
+
+    @event.listens_for(sync_engine.pool, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        in_use.dec()
+
+
+# Returns the exposition body for /metrics, aggregated over workers in multiprocess mode
+def render_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+# Drops the live gauges of this worker when it shuts down (multiprocess mode only)
+def mark_process_dead() -> None:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,224 @@
+"""
+Token-bucket rate limiting per client IP and route.
+
+Each (route, client) pair owns a bucket holding up to `burst` tokens that refills
+at `rate` tokens per second; a request takes one token or is rejected with 429
+and a Retry-After header. Decisions are O(1) and never touch the database.
+
+Buckets live in the worker by default, so every worker enforces the limits on
+its own. With ``RATE_LIMIT_REDIS_URL`` set they are kept in Redis and shared by
+all workers; if Redis fails, the worker falls back to its local buckets.
+"""
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request, status
+from starlette.types import Scope
+
+from app.core.metrics import rate_limited
+from app.core.setting import settings
+
+__all__ = [
+    "InMemoryRateLimitBackend",
+    "RateLimit",
+    "RateLimitBackend",
+    "RateLimiter",
+    "RedisRateLimitBackend",
+    "create_rate_limit_backend",
+    "rate_limiter",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage for token buckets. Implementations must update a bucket atomically.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from bucket `key`. Returns 0 if they were available,
+        otherwise the seconds until they will be (nothing is taken then).
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Buckets in a dict of the worker, at most `max_keys` of them; the least
+    recently used bucket is forgotten first, which only ever lets a client
+    start over with a full bucket. Also stands in for Redis in tests.
+    """
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, updated)
+
+    async def acquire(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        now = self.clock()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = float(burst)
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            tokens = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+
+        retry_after = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        return retry_after
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+# Refills and takes from a bucket in one step; uses the Redis clock so all workers agree
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Buckets shared by all workers, as Redis hashes that expire once they would
+    be full again. Each decision is a single script call.
+    """
+
+    def __init__(self, client, prefix: str = "url-shortener:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisRateLimitBackend":
+        import redis.asyncio as redis
+
+        return cls(redis.from_url(url), **kwargs)
+
+    async def acquire(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        return float(await self._script(keys=[self.prefix + key], args=[rate, burst, cost]))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+# Builds the configured shared backend, or None when buckets stay in the worker
+def create_rate_limit_backend(redis_url: Optional[str]) -> Optional[RateLimitBackend]:
+    if not redis_url:
+        return None
+    if redis_url == "memory://":
+        return InMemoryRateLimitBackend()
+    return RedisRateLimitBackend.from_url(redis_url)
+
+
+class RateLimiter:
+    """
+    Takes tokens from the shared `backend` if there is one, else (or when it
+    fails) from the worker's `local` buckets.
+    """
+
+    def __init__(self, backend: Optional[RateLimitBackend] = None,
+                 local: Optional[InMemoryRateLimitBackend] = None):
+        self.backend = backend
+        self.local = local or InMemoryRateLimitBackend()
+        self.backend_errors = 0
+
+    async def acquire(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        if self.backend is not None:
+            try:
+                return await self.backend.acquire(key, rate, burst, cost)
+            except Exception:
+                self.backend_errors += 1
+                logger.warning("Rate limit backend failed, using local buckets", exc_info=True)
+        return await self.local.acquire(key, rate, burst, cost)
+
+    def clear(self) -> None:
+        self.local.clear()
+        if isinstance(self.backend, InMemoryRateLimitBackend):
+            self.backend.clear()
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+
+# Process-wide limiter shared by all rate-limited routes of this worker
+rate_limiter = RateLimiter(backend=create_rate_limit_backend(settings.RATE_LIMIT_REDIS_URL))
+
+
+class RateLimit:
+    """
+    Route dependency allowing each client IP `rate` requests per second, with
+    bursts of up to `burst`, in the bucket `name`. Routes using the same name
+    share their buckets; a rate of 0 disables the limit.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, limiter: RateLimiter = rate_limiter):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.limiter = limiter
+
+    async def acquire(self, client: str) -> float:
+        """Takes a token for `client`; returns 0, or the seconds until one is available."""
+        if not settings.RATE_LIMIT_ENABLED or self.rate <= 0:
+            return 0.0
+        return await self.limiter.acquire(f"{self.name}:{client}", self.rate, self.burst)
+
+    def mark_charged(self, scope: Scope) -> None:
+        """
+        Records that the request of `scope` already took its token (e.g. in a
+        middleware that then passed it on), so this dependency doesn't take another.
+        """
+        scope.setdefault("state", {})[self._charged_key] = True
+
+    @property
+    def _charged_key(self) -> str:
+        return f"rate_limit_charged:{self.name}"
+
+    async def __call__(self, request: Request) -> None:
+        if request.scope.get("state", {}).get(self._charged_key):
+            return
+        retry_after = await self.acquire(request.client.host if request.client else "unknown")
+        if retry_after > 0:
+            rate_limited.labels(self.name).inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -1,3 +1,3 @@
-from .models import URL, URLVisit
+from .models import URL, URLVisit, URLVisitRollup
 
-__all__ = [URL, URLVisit]
+__all__ = [URL, URLVisit, URLVisitRollup]
@@ -1,5 +1,11 @@
 from sqladmin import ModelView
+from starlette.requests import Request
+from wtforms.validators import AnyOf, NumberRange, Optional
 
+from app.api.redirects import REDIRECT_STATUSES
+
+from .cache import redirect_cache
+from .code_filter import short_code_filter
 from .models import URLVisit, URL
 
 
@@ -9,7 +15,30 @@ class URLAdmin(ModelView, model=URL):
     column_list = [URL.id, URL.original_url, URL.short_code]
 
     # Fields to include in the admin form
-    form_columns = [URL.original_url, URL.short_code]
+    form_columns = [
+        URL.original_url, URL.short_code, URL.redirect_status, URL.redirect_max_age, URL.expires_at, URL.max_clicks,
+    ]
+
+    # Same limits as the shorten API; the redirect mode is also checked by the database
+    form_args = {
+        "redirect_status": {"validators": [Optional(), AnyOf(REDIRECT_STATUSES)]},
+        "redirect_max_age": {"validators": [Optional(), NumberRange(min=0)]},
+        "max_clicks": {"validators": [Optional(), NumberRange(min=1)]},
+    }
+
+    # Drop cached redirects for the code being edited, before and after the change,
+    # so a renamed code stops resolving and a new one isn't shadowed by a cached 404
+    async def on_model_change(self, data: dict, model: URL, is_created: bool, request: Request) -> None:
+        request.state.previous_short_code = model.short_code
+        await redirect_cache.invalidate(model.short_code, data.get("short_code"))
+
+    async def after_model_change(self, data: dict, model: URL, is_created: bool, request: Request) -> None:
+        previous = getattr(request.state, "previous_short_code", None)
+        short_code_filter.add(model.short_code)
+        await redirect_cache.invalidate(previous, model.short_code)
+
+    async def after_model_delete(self, model: URL, request: Request) -> None:
+        await redirect_cache.invalidate(model.short_code)
 
 
 # Admin view for the URLVisit model
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import UTC
+from typing import Awaitable, Callable, Iterable, Optional, Sequence
+
+from app.core.metrics import redirect_cache_lookups
+from app.core.setting import settings
+from app.db.cache_backends import CacheBackend, create_cache_backend
+
+__all__ = ["MISSING", "CachedURL", "RedirectCache", "TieredRedirectCache", "redirect_cache"]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class CachedURL:
+    """
+    The subset of a URL row needed to serve a redirect.
+    """
+    id: int
+    original_url: str
+    redirect_status: Optional[int] = None
+    redirect_max_age: Optional[int] = None
+    expires_at: Optional[float] = None  # Unix time, so the entry stays JSON-serializable
+    max_clicks: Optional[int] = None
+
+    # Accepts URL models and Core rows with the same column names
+    @classmethod
+    def from_model(cls, url) -> "CachedURL":
+        expires_at = url.expires_at
+        if expires_at is not None:
+            expires_at = (expires_at if expires_at.tzinfo else expires_at.replace(tzinfo=UTC)).timestamp()
+        return cls(id=url.id, original_url=url.original_url, redirect_status=url.redirect_status,
+                   redirect_max_age=url.redirect_max_age, expires_at=expires_at, max_clicks=url.max_clicks)
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> Optional["CachedURL"]:
+        data = json.loads(raw)
+        return cls(**data) if data is not None else None
+
+    @staticmethod
+    def to_bytes(entry: Optional["CachedURL"]) -> bytes:
+        return json.dumps(asdict(entry) if entry is not None else None).encode("utf-8")
+
+
+# Sentinel distinguishing a cached "not found" from a cache miss
+MISSING = object()
+
+
+class RedirectCache:
+    """
+    Bounded in-process LRU cache of short_code -> CachedURL with per-entry TTL.
+
+    Unknown codes are cached as negative entries (with their own, usually
+    shorter, TTL) so repeated lookups of a missing code skip the database too.
+
+    Links with a click limit are never kept: the visit writer of any worker may
+    exhaust them, and only the shared L2 hears of it without a pub/sub channel.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # code -> (expires_at, CachedURL | None)
+        self._entries: OrderedDict[str, tuple[float, Optional[CachedURL]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, code: str):
+        """
+        Returns the cached entry for `code`, ``None`` for a cached 404,
+        or ``MISSING`` on a cache miss.
+        """
+        entry = self._entries.get(code)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[code]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(code)
+        self.hits += 1
+        return value
+
+    def peek(self, code: str):
+        """
+        Like `get`, but leaves the hit/miss counters and the LRU order alone.
+        """
+        entry = self._entries.get(code)
+        if entry is None or entry[0] <= time.monotonic():
+            return MISSING
+        return entry[1]
+
+    def set(self, code: str, value: Optional[CachedURL]) -> None:
+        if not self.enabled or (value is not None and value.max_clicks is not None):
+            return
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+
+        self._entries[code] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(code)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *codes: Optional[str]) -> None:
+        for code in codes:
+            if code is not None:
+                self._entries.pop(code, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TieredRedirectCache:
+    """
+    Two-level redirect cache: a per-process RedirectCache (L1) over an optional
+    shared CacheBackend (L2) such as Redis.
+
+    Concurrent misses for the same code are coalesced so only one of them reaches
+    L2 or the database. L2 failures are logged and treated as misses.
+    """
+
+    def __init__(self, local: RedirectCache, backend: Optional[CacheBackend] = None,
+                 key_prefix: str = "url:code:"):
+        self.local = local
+        self.backend = backend
+        self.key_prefix = key_prefix
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self.coalesced = 0
+
+    def _key(self, code: str) -> str:
+        return self.key_prefix + code
+
+    async def get_cached(self, code: str):
+        """
+        L1, then L2 lookup that never loads nor caches a miss; returns ``MISSING``
+        when neither level knows the code.
+        """
+        cached = self.local.get(code)
+        if cached is not MISSING:
+            redirect_cache_lookups.labels("l1").inc()
+            return cached
+        found = await self._get_remote([code])
+        if code in found:
+            redirect_cache_lookups.labels("l2").inc()
+            self.local.set(code, found[code])
+            return found[code]
+        return MISSING
+
+    async def get(self, code: str, loader: Callable[[], Awaitable[Optional[CachedURL]]]):
+        """
+        Returns the entry for `code` (``None`` if it does not exist), calling
+        `loader` only when neither cache level knows the code.
+        """
+        cached = self.local.get(code)
+        if cached is not MISSING:
+            redirect_cache_lookups.labels("l1").inc()
+            return cached
+
+        while (inflight := self._inflight.get(code)) is not None:
+            self.coalesced += 1
+            redirect_cache_lookups.labels("coalesced").inc()
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The request loading the code was cancelled, not this one: load it ourselves
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[code] = future
+        try:
+            entry = await self._load(code, loader)
+        except Exception as exc:
+            future.set_exception(exc)
+            # Waiters see the exception; don't warn when nobody was waiting
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(entry)
+            return entry
+        finally:
+            del self._inflight[code]
+
+    async def _load(self, code: str, loader):
+        found = await self._get_remote([code])
+        if code in found:
+            redirect_cache_lookups.labels("l2").inc()
+            self.local.set(code, found[code])
+            return found[code]
+
+        redirect_cache_lookups.labels("database").inc()
+        entry = await loader()
+        await self.set(code, entry, publish=False)
+        return entry
+
+    async def get_many(self, codes: Sequence[str],
+                       loader: Callable[[Sequence[str]], Awaitable[dict[str, CachedURL]]]) -> dict:
+        """
+        Resolves many codes at once: L1 first, then a single L2 multi-get, then
+        one `loader` call for whatever is left. Unknown codes map to ``None``.
+        """
+        result = {}
+        pending = []
+        for code in dict.fromkeys(codes):
+            cached = self.local.get(code)
+            if cached is MISSING:
+                pending.append(code)
+            else:
+                result[code] = cached
+        redirect_cache_lookups.labels("l1").inc(len(result))
+
+        if pending:
+            found = await self._get_remote(pending)
+            redirect_cache_lookups.labels("l2").inc(len(found))
+            for code, entry in found.items():
+                self.local.set(code, entry)
+            result.update(found)
+            pending = [code for code in pending if code not in found]
+
+        if pending:
+            redirect_cache_lookups.labels("database").inc(len(pending))
+            loaded = await loader(pending)
+            entries = {code: loaded.get(code) for code in pending}
+            for code, entry in entries.items():
+                self.local.set(code, entry)
+            await self._set_remote(entries)
+            result.update(entries)
+
+        return result
+
+    async def set(self, code: str, entry: Optional[CachedURL], publish: bool = True) -> None:
+        """
+        Stores `entry` in both levels. With `publish`, other workers drop their
+        stale L1 copy (e.g. a cached 404 for a freshly created code).
+        """
+        await self.set_many({code: entry}, publish)
+
+    async def set_many(self, entries: dict[str, Optional[CachedURL]], publish: bool = True) -> None:
+        """Like `set`, for many codes with one L2 write and one invalidation message."""
+        for code, entry in entries.items():
+            self.local.set(code, entry)
+        await self._set_remote(entries)
+        if publish:
+            await self._publish(list(entries))
+
+    async def invalidate(self, *codes: Optional[str]) -> None:
+        codes = [code for code in codes if code is not None]
+        self.local.invalidate(*codes)
+        if self.backend is None or not codes:
+            return
+        try:
+            await self.backend.delete(self._key(code) for code in codes)
+        except Exception:
+            self.l2_errors += 1
+            logger.warning("Failed to delete redirect cache entries from L2", exc_info=True)
+        await self._publish(codes)
+
+    def on_remote_invalidation(self, codes: Iterable[str]) -> None:
+        self.local.invalidate(*codes)
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self.local.stats(),
+            "l2_enabled": self.backend is not None,
+            "l2_hits": self.l2_hits,
+            "l2_misses": self.l2_misses,
+            "l2_errors": self.l2_errors,
+            "coalesced": self.coalesced,
+        }
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def _get_remote(self, codes: Sequence[str]) -> dict[str, Optional[CachedURL]]:
+        if self.backend is None:
+            return {}
+        try:
+            values = await self.backend.get_many([self._key(code) for code in codes])
+        except Exception:
+            self.l2_errors += 1
+            logger.warning("Redirect cache L2 read failed", exc_info=True)
+            return {}
+
+        found = {}
+        for code, raw in zip(codes, values):
+            if raw is None:
+                self.l2_misses += 1
+            else:
+                self.l2_hits += 1
+                found[code] = CachedURL.from_bytes(raw)
+        return found
+
+    async def _set_remote(self, entries: dict[str, Optional[CachedURL]]) -> None:
+        if self.backend is None:
+            return
+        items = {}
+        for code, entry in entries.items():
+            ttl = self.local.ttl if entry is not None else self.local.negative_ttl
+            if ttl > 0:
+                items[self._key(code)] = (CachedURL.to_bytes(entry), ttl)
+        try:
+            await self.backend.set_many(items)
+        except Exception:
+            self.l2_errors += 1
+            logger.warning("Redirect cache L2 write failed", exc_info=True)
+
+    async def _publish(self, codes: Sequence[str]) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.publish_invalidation(codes)
+        except Exception:
+            self.l2_errors += 1
+            logger.warning("Failed to publish redirect cache invalidation", exc_info=True)
+
+
+# Process-wide cache shared by all requests served by this worker
+redirect_cache = TieredRedirectCache(
+    local=RedirectCache(
+        max_size=settings.REDIRECT_CACHE_MAX_SIZE,
+        ttl=settings.REDIRECT_CACHE_TTL,
+        negative_ttl=settings.REDIRECT_CACHE_NEGATIVE_TTL,
+    ),
+    backend=create_cache_backend(settings.REDIS_URL),
+)
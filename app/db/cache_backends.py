@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional, Sequence
+
+__all__ = [
+    "CacheBackend",
+    "InMemoryCacheBackend",
+    "RedisCacheBackend",
+    "create_cache_backend",
+    "run_invalidation_listener",
+]
+
+logger = logging.getLogger(__name__)
+
+InvalidationCallback = Callable[[Sequence[str]], None]
+
+
+class CacheBackend(ABC):
+    """
+    Shared (L2) key/value store used behind the per-process redirect cache.
+
+    Values are opaque bytes; TTLs are in seconds. Implementations must be safe
+    to share between all requests of a worker.
+    """
+
+    @abstractmethod
+    async def get_many(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        """Returns the values for `keys` in order, ``None`` for missing keys."""
+
+    @abstractmethod
+    async def set_many(self, items: dict[str, tuple[bytes, float]]) -> None:
+        """Stores ``key -> (value, ttl)`` pairs."""
+
+    @abstractmethod
+    async def delete(self, keys: Iterable[str]) -> None:
+        """Removes `keys` if present."""
+
+    @abstractmethod
+    async def publish_invalidation(self, keys: Sequence[str]) -> None:
+        """Notifies every subscribed worker that `keys` changed."""
+
+    @abstractmethod
+    async def listen_invalidations(self, callback: InvalidationCallback) -> None:
+        """Calls `callback` with invalidated keys until cancelled."""
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """
+    In-process stand-in for Redis, used by tests and single-node setups.
+    """
+
+    def __init__(self):
+        self._data: dict[str, tuple[float, bytes]] = {}
+        self._listeners: list[asyncio.Queue] = []
+
+    async def get_many(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                entry = None
+            values.append(entry[1] if entry is not None else None)
+        return values
+
+    async def set_many(self, items: dict[str, tuple[bytes, float]]) -> None:
+        now = time.monotonic()
+        for key, (value, ttl) in items.items():
+            self._data[key] = (now + ttl, value)
+
+    async def delete(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def publish_invalidation(self, keys: Sequence[str]) -> None:
+        for queue in self._listeners:
+            queue.put_nowait(list(keys))
+
+    async def listen_invalidations(self, callback: InvalidationCallback) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._listeners.append(queue)
+        try:
+            while True:
+                callback(await queue.get())
+        finally:
+            self._listeners.remove(queue)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis-backed shared cache. Reads use a single MGET and writes a
+    non-transactional pipeline, so each operation is one round trip.
+    """
+
+    def __init__(self, client, channel: str = "url-shortener:invalidate"):
+        self.client = client
+        self.channel = channel
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisCacheBackend":
+        import redis.asyncio as redis
+
+        return cls(redis.from_url(url), **kwargs)
+
+    async def get_many(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        if not keys:
+            return []
+        return await self.client.mget(keys)
+
+    async def set_many(self, items: dict[str, tuple[bytes, float]]) -> None:
+        if not items:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, (value, ttl) in items.items():
+                pipe.set(key, value, px=max(int(ttl * 1000), 1))
+            await pipe.execute()
+
+    async def delete(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if keys:
+            await self.client.delete(*keys)
+
+    async def publish_invalidation(self, keys: Sequence[str]) -> None:
+        if keys:
+            await self.client.publish(self.channel, "\n".join(keys))
+
+    async def listen_invalidations(self, callback: InvalidationCallback) -> None:
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                data = message["data"]
+                if isinstance(data, bytes):
+                    data = data.decode("utf-8")
+                callback(data.split("\n"))
+        finally:
+            await pubsub.aclose()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+# Builds the configured shared backend, or None when no REDIS_URL is set
+def create_cache_backend(redis_url: Optional[str]) -> Optional[CacheBackend]:
+    if not redis_url:
+        return None
+    if redis_url == "memory://":
+        return InMemoryCacheBackend()
+    return RedisCacheBackend.from_url(redis_url)
+
+
+# Keeps a worker's L1 in sync with invalidations published by other workers
+async def run_invalidation_listener(backend: CacheBackend, callback: InvalidationCallback,
+                                    retry_delay: float = 1.0) -> None:
+    while True:
+        try:
+            await backend.listen_invalidations(callback)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Cache invalidation listener failed, retrying")
+            await asyncio.sleep(retry_delay)
@@ -0,0 +1,215 @@
+"""
+Bloom filter over all short codes, so redirects for codes that don't exist
+skip the read replicas and take a single primary lookup, whose 404 is then
+cached. Rejected codes are still looked up, so a stale filter never turns a
+real code into a 404.
+
+Each worker builds the filter from the url table at startup and keeps it
+current with:
+
+- codes it creates itself, added right away;
+- codes other workers create or rename, received with the redirect cache
+  invalidations they publish (only with a shared cache, i.e. REDIS_URL);
+- an incremental sync of rows past an id watermark every few seconds, which
+  re-reads a margin below the watermark to catch ids committed out of order;
+- a periodic full rebuild, which forgets deleted codes and resizes the filter.
+
+A Bloom filter never misses a code it was given, but reports a small fraction
+of unknown codes as present; those take the usual lookup.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import func, select
+
+from app.core.setting import settings
+from app.db.models import URL
+
+__all__ = ["BloomFilter", "ShortCodeFilter", "short_code_filter"]
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter in a bytearray, sized for `capacity` items at a
+    false positive rate of `error_rate`.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    # Double hashing: k bit positions from the two halves of one 128-bit digest
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    # Returns False if every bit was already set, i.e. the item was (probably) present;
+    # only new items are counted, so re-adding codes doesn't inflate the count
+    def add(self, item: str) -> bool:
+        bits = self.bits
+        new = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.bits)
+
+
+class ShortCodeFilter:
+    """
+    The Bloom filter of a worker plus the bookkeeping to keep it current.
+    Until `build` has run, no code is rejected.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01,
+                 chunk_size: int = 10_000, sync_overlap: int = 1000):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.sync_overlap = sync_overlap
+        self._filter: Optional[BloomFilter] = None
+        self._watermark = 0
+        self._added_during_build: Optional[list[str]] = None
+        self.rejected = 0
+        self.builds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def rejects(self, code: str) -> bool:
+        """True if `code` is certainly not a known short code."""
+        if self.may_exist(code):
+            return False
+        self.rejected += 1
+        return True
+
+    def may_exist(self, code: str) -> bool:
+        """Like `not rejects(code)`, without counting a rejection."""
+        return self._filter is None or code in self._filter
+
+    def add(self, *codes: Optional[str]) -> None:
+        codes = [code for code in codes if code is not None]
+        if self._added_during_build is not None:
+            self._added_during_build.extend(codes)
+        if self._filter is not None:
+            for code in codes:
+                self._filter.add(code)
+
+    def add_many(self, codes: Iterable[str]) -> None:
+        self.add(*codes)
+
+    def clear(self) -> None:
+        self._filter = None
+        self._watermark = 0
+        self._added_during_build = None
+
+    async def build(self, session_factory: Callable) -> None:
+        """
+        Scans all short codes into a new filter, sized for twice the current
+        count (and at least `capacity`), then swaps it in.
+        """
+        self._added_during_build = []
+        try:
+            async with session_factory() as session:
+                conn = await session.connection()
+                count = await conn.scalar(select(func.count()).select_from(URL))
+            bloom = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+            watermark = await self._scan(session_factory, bloom, 0)
+
+            # Codes created here or announced by other workers while scanning may have
+            # been committed behind the scan; carry them over
+            for code in self._added_during_build:
+                bloom.add(code)
+            self._filter = bloom
+            self._watermark = watermark
+        finally:
+            self._added_during_build = None
+        self.builds += 1
+        logger.info("Short code filter built: %d codes, %d KiB", bloom.count, bloom.size_bytes // 1024)
+
+    async def sync(self, session_factory: Callable) -> None:
+        """
+        Adds codes of rows created since the last build or sync.
+        """
+        if self._filter is None:
+            return
+        bloom = self._filter
+        watermark = await self._scan(session_factory, bloom, max(0, self._watermark - self.sync_overlap))
+        if bloom is self._filter:
+            self._watermark = max(self._watermark, watermark)
+        if bloom.count > bloom.capacity:
+            await self.build(session_factory)
+
+    # Adds the codes of rows with id > after_id; returns the highest id seen
+    async def _scan(self, session_factory: Callable, bloom: BloomFilter, after_id: int) -> int:
+        last_id = after_id
+        while True:
+            async with session_factory() as session:
+                conn = await session.connection()
+                rows = (await conn.execute(
+                    select(URL.id, URL.short_code).where(URL.id > last_id).order_by(URL.id).limit(self.chunk_size)
+                )).all()
+            for _, code in rows:
+                bloom.add(code)
+            if len(rows) < self.chunk_size:
+                return rows[-1][0] if rows else last_id
+            last_id = rows[-1][0]
+
+    async def run(self, session_factory: Callable, sync_interval: float, rebuild_interval: float) -> None:
+        """
+        Syncs every `sync_interval` seconds and rebuilds every `rebuild_interval` seconds until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        next_rebuild = loop.time() + rebuild_interval
+        while True:
+            await asyncio.sleep(sync_interval)
+            try:
+                if loop.time() >= next_rebuild:
+                    await self.build(session_factory)
+                    next_rebuild = loop.time() + rebuild_interval
+                else:
+                    await self.sync(session_factory)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Short code filter update failed")
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            "ready": bloom is not None,
+            "codes": bloom.count if bloom else 0,
+            "capacity": bloom.capacity if bloom else 0,
+            "size_bytes": bloom.size_bytes if bloom else 0,
+            "rejected": self.rejected,
+            "builds": self.builds,
+        }
+
+
+# Process-wide filter consulted by the redirect path of this worker
+short_code_filter = ShortCodeFilter(
+    capacity=settings.SHORT_CODE_FILTER_CAPACITY,
+    error_rate=settings.SHORT_CODE_FILTER_ERROR_RATE,
+)
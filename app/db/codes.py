@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import random
+import string
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.setting import settings
+from app.db.models import ShortCodePool, ShortCodeSequence, utcnow
+
+__all__ = [
+    "ALPHABET",
+    "CodeGenerator",
+    "RandomCodeGenerator",
+    "SequenceCodeGenerator",
+    "PermutedCodeGenerator",
+    "PoolCodeGenerator",
+    "create_code_generator",
+    "code_generator",
+    "generate_code",
+]
+
+# Short codes have always been lowercase alphanumeric
+ALPHABET = string.ascii_lowercase + string.digits
+
+
+# Generates a random alphanumeric short code with the specified length
+def generate_code(length=6):
+    return ''.join(random.choices(ALPHABET, k=length))
+
+
+# Encodes a non-negative integer with `alphabet`, left-padded to `length` digits
+def encode(number: int, alphabet: str = ALPHABET, length: int = 1) -> str:
+    base = len(alphabet)
+    digits = []
+    while number or len(digits) < length:
+        number, remainder = divmod(number, base)
+        digits.append(alphabet[remainder])
+    return "".join(reversed(digits))
+
+
+# A session of its own on the engine of `session`, for reservations that commit on their own
+def _own_session(session: AsyncSession) -> AsyncSession:
+    return AsyncSession(session.bind, expire_on_commit=False)
+
+
+class CodeGenerator(ABC):
+    """
+    Produces candidate short codes for new URLs.
+
+    Generators never query the url table; uniqueness comes from the strategy
+    itself, with the unique index on url.short_code as the last line of defence
+    (see crud.create_short_url). Strategies that reserve ids or codes in blocks
+    do so in a session of their own on the engine of the caller's `session`,
+    committed right away, so they never touch the caller's transaction.
+    """
+
+    @abstractmethod
+    async def next_code(self, session: AsyncSession) -> str:
+        ...
+
+
+class RandomCodeGenerator(CodeGenerator):
+    """
+    Random codes of 6-15 characters. Collisions are rare and surface as a
+    unique-constraint violation on insert.
+    """
+
+    async def next_code(self, session: AsyncSession) -> str:
+        return generate_code(length=random.randint(6, 15))
+
+
+class _BlockAllocator:
+    """
+    Hands out consecutive integers from a named row in short_code_sequence,
+    reserving `block_size` of them per database round trip (hi/lo allocation).
+    Every worker reserves its own blocks, so ids never repeat across workers.
+    """
+
+    def __init__(self, name: str, block_size: int):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def next_id(self, session: AsyncSession) -> int:
+        async with self._lock:
+            if self._next >= self._end:
+                self._end = await self._reserve(session)
+                self._next = self._end - self.block_size
+            value = self._next
+            self._next += 1
+            return value
+
+    async def _reserve(self, caller_session: AsyncSession) -> int:
+        stmt = (
+            update(ShortCodeSequence)
+            .where(ShortCodeSequence.name == self.name)
+            .values(next_value=ShortCodeSequence.next_value + self.block_size)
+            .returning(ShortCodeSequence.next_value)
+        )
+        async with _own_session(caller_session) as session:
+            end = (await session.exec(stmt)).scalar_one_or_none()
+            if end is None:
+                # First use of this sequence; a concurrent creator may win the insert
+                try:
+                    await session.exec(insert(ShortCodeSequence).values(name=self.name, next_value=0))
+                    await session.commit()
+                except IntegrityError:
+                    await session.rollback()
+                end = (await session.exec(stmt)).scalar_one()
+            await session.commit()
+        return end
+
+
+class SequenceCodeGenerator(CodeGenerator):
+    """
+    Encodes ids from a block-reserved sequence. Codes are at least `min_length`
+    characters long, short and dense, but predictable.
+    """
+
+    def __init__(self, block_size: int, min_length: int = 6):
+        self.allocator = _BlockAllocator("sequence", block_size)
+        self.offset = len(ALPHABET) ** (min_length - 1)
+
+    async def next_code(self, session: AsyncSession) -> str:
+        return encode(await self.allocator.next_id(session) + self.offset)
+
+
+class PermutedCodeGenerator(CodeGenerator):
+    """
+    Ids from a block-reserved sequence, encrypted with a keyed Feistel network
+    (a format-preserving permutation of all codes of a given length), so codes
+    can't be told from random ones, nor the next one computed from those seen,
+    without the salt, and still never collide. The first len(ALPHABET) **
+    min_length ids get `min_length` characters, the next block one more, and so on.
+
+    The salt is a secret and must not change once codes have been issued.
+    """
+
+    def __init__(self, block_size: int, salt: str, min_length: int = 6, rounds: int = 8):
+        if not salt:
+            raise ValueError("The permuted short code strategy needs a secret salt")
+        self.allocator = _BlockAllocator("permuted", block_size)
+        self.min_length = min_length
+        self.rounds = rounds
+        self._key = hashlib.sha256(salt.encode("utf-8")).digest()
+
+    # Round function of the Feistel network; `space` keys each code length separately
+    def _round(self, space: int, index: int, half: int, bits: int) -> int:
+        digest = hashlib.blake2b(f"{space}:{index}:{half}".encode("ascii"), key=self._key, digest_size=16).digest()
+        return int.from_bytes(digest, "big") & ((1 << bits) - 1)
+
+    # Encrypts `number` with a balanced Feistel network over 2 * `bits`-bit integers
+    def _feistel(self, number: int, space: int, bits: int) -> int:
+        left, right = number >> bits, number & ((1 << bits) - 1)
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(space, index, right, bits)
+        return (left << bits) | right
+
+    # A permutation of range(space): cycle-walks the Feistel network, which covers up
+    # to 4 * space integers, until it lands back in range (a few rounds on average)
+    def permute(self, number: int, space: int) -> int:
+        bits = ((space - 1).bit_length() + 1) // 2
+        number = self._feistel(number, space, bits)
+        while number >= space:
+            number = self._feistel(number, space, bits)
+        return number
+
+    def code_for(self, number: int) -> str:
+        length = self.min_length
+        space = len(ALPHABET) ** length
+        while number >= space:
+            number -= space
+            length += 1
+            space = len(ALPHABET) ** length
+        return encode(self.permute(number, space), ALPHABET, length)
+
+    async def next_code(self, session: AsyncSession) -> str:
+        return self.code_for(await self.allocator.next_id(session))
+
+
+class PoolCodeGenerator(CodeGenerator):
+    """
+    Serves codes from short_code_pool, pre-generated by the ``fill-code-pool``
+    maintenance job. Each worker reserves `block_size` unused codes at a time.
+    Falls back to random codes if the pool runs dry.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._codes: deque[str] = deque()
+        self._lock = asyncio.Lock()
+        self._fallback = RandomCodeGenerator()
+
+    async def next_code(self, session: AsyncSession) -> str:
+        async with self._lock:
+            if not self._codes:
+                self._codes.extend(await self._reserve(session))
+            if self._codes:
+                return self._codes.popleft()
+        return await self._fallback.next_code(session)
+
+    async def _reserve(self, caller_session: AsyncSession) -> list[str]:
+        free = (
+            select(ShortCodePool.code)
+            .where(ShortCodePool.reserved_at.is_(None))
+            .limit(self.block_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(ShortCodePool)
+            .where(ShortCodePool.code.in_(free.scalar_subquery()))
+            .values(reserved_at=utcnow())
+            .returning(ShortCodePool.code)
+        )
+        async with _own_session(caller_session) as session:
+            codes = (await session.exec(stmt)).scalars().all()
+            await session.commit()
+        return list(codes)
+
+
+# Builds the generator for a SHORT_CODE_STRATEGY value
+def create_code_generator(strategy: str, block_size: int, salt: Optional[str] = "") -> CodeGenerator:
+    if strategy == "random":
+        return RandomCodeGenerator()
+    if strategy == "sequence":
+        return SequenceCodeGenerator(block_size)
+    if strategy == "permuted":
+        return PermutedCodeGenerator(block_size, salt or "")
+    if strategy == "pool":
+        return PoolCodeGenerator(block_size)
+    raise ValueError(f"Unknown short code strategy: {strategy!r}")
+
+
+# Process-wide generator used by crud.create_short_url
+code_generator = create_code_generator(
+    settings.SHORT_CODE_STRATEGY,
+    settings.SHORT_CODE_BLOCK_SIZE,
+    settings.SHORT_CODE_SALT,
+)
@@ -1,51 +1,197 @@
-import random
-import string
+from datetime import datetime
+from typing import Optional
 
 from pydantic import HttpUrl
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
-from sqlalchemy import func
+from sqlalchemy import bindparam, update
+from sqlalchemy import select as core_select
+from sqlalchemy.exc import IntegrityError
 
-from app.db.models import URL, URLVisit
+from app.core.setting import settings
+from app.core.metrics import redirect_cache_lookups
+from app.db.cache import MISSING, CachedURL, redirect_cache
+from app.db.code_filter import short_code_filter
+from app.db.codes import code_generator
+from app.db.replicas import replicas
+from app.db.models import URL, URLVisit, URLVisitRollup, as_naive_utc, url_digest, utcnow
+from app.db.rollups import Granularity, count_buckets, upsert_rollups
+from app.db.sql import dialect_insert
+from app.db.visits import anonymize_ip, expire_exhausted_links, visit_recorder
 
 
-# Generates a random alphanumeric short code with the specified length
-def generate_code(length=6):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length)).lower()
+# Number of codes tried before giving up on creating a short URL
+MAX_CREATE_ATTEMPTS = 5
 
 
-# Creates a short URL if it does not already exist
-async def create_short_url(original_url: HttpUrl, session: AsyncSession):
+class ShortCodeAllocationError(RuntimeError):
+    """
+    Raised when no unique short code could be allocated within MAX_CREATE_ATTEMPTS.
+    """
+
+
+# Redirect lookup: only the columns a redirect needs, as a plain row (no ORM
+# entity, validation or identity map). Built once so SQLAlchemy's compiled-statement
+# cache is hit on every call.
+_redirect_columns = (URL.id, URL.original_url, URL.redirect_status, URL.redirect_max_age, URL.expires_at,
+                     URL.max_clicks)
+_redirect_target_by_code = (
+    core_select(*_redirect_columns)
+    .where(URL.short_code == bindparam("code"))
+    .limit(1)
+)
+
+
+# Creates a short URL if it does not already exist; an existing one keeps its redirect mode.
+# Links with an expiry or click limit are never shared: they always get a new code, and
+# are not returned for other requests of the same URL (see URL.original_url_digest).
+async def create_short_url(original_url: HttpUrl, session: AsyncSession,
+                           redirect_status: Optional[int] = None, redirect_max_age: Optional[int] = None,
+                           expires_at: Optional[datetime] = None, max_clicks: Optional[int] = None):
+    if expires_at is not None:
+        expires_at = as_naive_utc(expires_at)
+    limited = expires_at is not None or max_clicks is not None
+
     # Check if the URL already exists in the database
-    url = await get_url(original_url, session)
+    url = await get_url(original_url, session) if not limited else None
     if url:
         return url
 
-    # Generate a unique short code
-    while True:
-        code = generate_code(length=random.randint(6, 15))
-        existing = await get_url_by_code(code, session)
-        if not existing:
-            break
+    # Codes come from the configured generator without probing the table; the unique
+    # indexes catch the rare collision and concurrent creates of the same URL
+    for _ in range(MAX_CREATE_ATTEMPTS):
+        code = await code_generator.next_code(session)
+        short_url = URL(original_url=str(original_url), short_code=code,
+                        redirect_status=redirect_status, redirect_max_age=redirect_max_age,
+                        expires_at=expires_at, max_clicks=max_clicks)
+        session.add(short_url)
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            existing = await get_url(original_url, session) if not limited else None
+            if existing:
+                return existing
+            continue
+
+        # Replace any cached "not found" for this code with the new mapping
+        short_code_filter.add(code)
+        await redirect_cache.set(code, CachedURL.from_model(short_url))
+        return short_url
+
+    raise ShortCodeAllocationError(f"Could not allocate a unique short code after {MAX_CREATE_ATTEMPTS} attempts")
+
+
+# Creates short URLs for many original URLs with set-based queries: one SELECT to find
+# existing rows and one multi-row INSERT for the rest (repeated only for rows lost to
+# code collisions or concurrent creates). Returns {original_url: (short_code, created)}.
+async def create_short_urls(original_urls: list[str], session: AsyncSession):
+    pending = list(dict.fromkeys(original_urls))
+    results = {}
+    for _ in range(MAX_CREATE_ATTEMPTS):
+        digests = {url_digest(url): url for url in pending}
+        stmt = select(URL.original_url_digest, URL.short_code).where(URL.original_url_digest.in_(digests))
+        for digest, short_code in (await session.exec(stmt)).all():
+            results.setdefault(digests[digest], (short_code, False))
+        pending = [url for url in pending if url not in results]
+        if not pending:
+            return results
 
-    # Store the new short URL in the database
-    short_url = URL(original_url=str(original_url), short_code=code)
-    session.add(short_url)
-    await session.commit()
-    await session.refresh(short_url)
-    return short_url
+        now = utcnow()
+        rows = [
+            {
+                "original_url": url,
+                "original_url_digest": url_digest(url),
+                "short_code": await code_generator.next_code(session),
+                "created_at": now,
+                "visit_count": 0,
+            }
+            for url in pending
+        ]
+        conn = await session.connection()
+        stmt = (
+            dialect_insert(conn, URL)
+            .on_conflict_do_nothing()
+            .returning(URL.short_code, *_redirect_columns)
+        )
+        inserted = (await conn.execute(stmt, rows)).all()
+        await session.commit()
 
+        # Replace any cached "not found" for the new codes with the new mappings
+        short_code_filter.add(*(row.short_code for row in inserted))
+        await redirect_cache.set_many({row.short_code: CachedURL.from_model(row) for row in inserted})
+        for row in inserted:
+            results[row.original_url] = (row.short_code, True)
+        pending = [url for url in pending if url not in results]
+        if not pending:
+            return results
 
-# Retrieves the URL record by its short code
+    raise ShortCodeAllocationError(f"Could not allocate unique short codes after {MAX_CREATE_ATTEMPTS} attempts")
+
+
+# Retrieves the URL record by its short code, from a read replica when one is healthy
+# (codes a lagging replica doesn't know yet are looked up on the primary `session`)
 async def get_url_by_code(code: str, session: AsyncSession):
-    stmt = select(URL).where(URL.short_code == code)
-    result = await session.exec(stmt)
-    return result.first()  # Returns Row or None
+    async def query(s: AsyncSession):
+        result = await s.exec(select(URL).where(URL.short_code == code))
+        return result.first()  # Returns Row or None
+
+    return await replicas.read(query, session)
+
+
+# Resolves a short code to the id, original URL, redirect mode and expiry needed for a redirect with Core SQL
+async def _load_redirect_target(code: str, session: AsyncSession) -> Optional[CachedURL]:
+    conn = await session.connection()
+    row = (await conn.execute(_redirect_target_by_code, {"code": code})).first()
+    return CachedURL.from_model(row) if row else None
+
+
+# Resolves a short code like _load_redirect_target, read like get_url_by_code, except
+# that a replica miss is only retried on the primary for codes the filter may know
+async def get_redirect_target(code: str, session: AsyncSession):
+    return await replicas.read(  # CachedURL or None
+        lambda s: _load_redirect_target(code, s), session,
+        use_primary_if=lambda entry: entry is None and short_code_filter.may_exist(code),
+    )
 
 
-# Retrieves the URL record by its original full URL
+# Resolves a short code for redirection, consulting the redirect cache first. Codes
+# the short code filter rejects are almost always unknown: after the cache (where a
+# code just created by another worker would be) they are looked up on the primary
+# only, skipping the replicas, and a miss is cached like any other.
+async def get_cached_url_by_code(code: str, session: AsyncSession):
+    async def load():
+        return await get_redirect_target(code, session)
+
+    if short_code_filter.rejects(code):
+        cached = await redirect_cache.get_cached(code)
+        if cached is not MISSING:
+            return cached
+        redirect_cache_lookups.labels("filtered").inc()
+        # The filter is stale when the code's cache write was missed (e.g. during an L2 outage)
+        entry = await _load_redirect_target(code, session)
+        if entry is not None:
+            short_code_filter.add(code)
+        await redirect_cache.set(code, entry, publish=False)
+        return entry
+
+    return await redirect_cache.get(code, load)  # CachedURL, or None if unknown
+
+
+# Resolves many short codes at once through the redirect cache
+async def get_cached_urls_by_codes(codes: list[str], session: AsyncSession):
+    async def load(missing):
+        stmt = core_select(URL.short_code, *_redirect_columns).where(URL.short_code.in_(missing))
+        conn = await session.connection()
+        result = await conn.execute(stmt)
+        return {row.short_code: CachedURL.from_model(row) for row in result}
+
+    return await redirect_cache.get_many(codes, load)  # code -> CachedURL or None
+
+
+# Retrieves the URL record by its original full URL, looked up by digest
 async def get_url(url: HttpUrl, session: AsyncSession):
-    stmt = select(URL).where(URL.original_url == str(url))
+    stmt = select(URL).where(URL.original_url_digest == url_digest(str(url)))
     result = await session.exec(stmt)
     return result.first()  # Returns URL model or None
 
@@ -54,15 +200,68 @@ async def get_url(url: HttpUrl, session: AsyncSession):
 async def create_visit(url_id: int, ip: str, session: AsyncSession):
     visit = URLVisit(url_id=url_id, ip_address=ip)
     session.add(visit)
-    await session.commit()
+    await session.exec(
+        update(URL).where(URL.id == url_id).values(visit_count=URL.visit_count + 1)
+    )
+    conn = await session.connection()
+    await upsert_rollups(conn, count_buckets([(url_id, visit.timestamp)]))
+    exhausted = await expire_exhausted_links(conn, [url_id])
+    try:
+        await session.commit()
+    except IntegrityError:
+        # The link was deleted (e.g. swept after expiring) since it was resolved
+        await session.rollback()
+        return
+    if exhausted:
+        await redirect_cache.invalidate(*exhausted)
+
 
+# Records a visit through the background batch writer, or inserts it right away
+# when the writer isn't running (e.g. disabled, or outside the app lifespan)
+async def record_visit(url_id: int, ip: str, session: AsyncSession):
+    ip = anonymize_ip(ip, settings.VISIT_IP_MODE, settings.VISIT_IP_HASH_KEY)
+    if not await visit_recorder.submit(url_id, ip):
+        await create_visit(url_id, ip, session)
 
-# Counts the number of visits to a short URL based on its code
+
+# Returns the number of visits to a short URL from its maintained counter, read like
+# get_url_by_code
 async def count_visits(short_code: str, session: AsyncSession):
+    async def query(s: AsyncSession):
+        result = await s.exec(select(URL.visit_count).where(URL.short_code == short_code))
+        return result.first()
+
+    visits = await replicas.read(
+        query, session, use_primary_if=lambda count: count is None and short_code_filter.may_exist(short_code),
+    )
+    return visits or 0  # Unknown codes count as 0 visits, like the old COUNT join
+
+
+# Returns {short_code: visits} for many codes with a single query; unknown codes are left out
+async def count_visits_by_codes(codes: list[str], session: AsyncSession) -> dict[str, int]:
+    async def query(s: AsyncSession, codes: list[str]):
+        conn = await s.connection()
+        result = await conn.execute(core_select(URL.short_code, URL.visit_count).where(URL.short_code.in_(codes)))
+        return dict(result.all())
+
+    # Codes a lagging replica doesn't know yet may have just been created; only those
+    # the filter may know are looked up again on the primary
+    return await replicas.read_many(query, list(dict.fromkeys(codes)), session,
+                                    retry_if=short_code_filter.may_exist)
+
+
+# Returns {bucket_start: visits} from the rollup table for buckets in [start, end)
+async def get_visit_timeseries(url_id: int, granularity: Granularity, start: datetime, end: datetime,
+                               session: AsyncSession):
     stmt = (
-        select(func.count(URLVisit.id))
-        .join(URLVisit.url)
-        .where(URL.short_code == short_code)
+        select(URLVisitRollup.bucket_start, URLVisitRollup.visits)
+        .where(
+            URLVisitRollup.url_id == url_id,
+            URLVisitRollup.granularity == granularity.value,
+            URLVisitRollup.bucket_start >= start,
+            URLVisitRollup.bucket_start < end,
+        )
+        .order_by(URLVisitRollup.bucket_start)
     )
     result = await session.exec(stmt)
-    return result.first()  # Returns total visit count as integer
+    return dict(result.all())
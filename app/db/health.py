@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+from sqlalchemy import text
+
+__all__ = ["ReadinessCheck"]
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessCheck:
+    """
+    Checks that the database answers a `SELECT 1` within `timeout` seconds.
+
+    The outcome is reused for `ttl` seconds and concurrent callers share a single
+    check, so frequent orchestrator probes cost at most one pooled query per
+    `ttl` per worker.
+    """
+
+    def __init__(self, ttl: float = 1.0, timeout: float = 1.0):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._checked_at = float("-inf")
+        self._ready = False
+        self._lock = asyncio.Lock()
+
+    async def check(self, session_factory: Callable) -> bool:
+        if time.monotonic() - self._checked_at < self.ttl:
+            return self._ready
+        async with self._lock:
+            if time.monotonic() - self._checked_at >= self.ttl:
+                self._ready = await self._query(session_factory)
+                self._checked_at = time.monotonic()
+        return self._ready
+
+    async def _query(self, session_factory: Callable) -> bool:
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with session_factory() as session:
+                    conn = await session.connection()
+                    await conn.execute(text("SELECT 1"))
+        except Exception as exc:
+            logger.warning("Readiness check failed: %r", exc)
+            return False
+        return True
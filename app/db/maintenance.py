@@ -0,0 +1,352 @@
+"""
+Offline maintenance jobs for the URL shortener database.
+
+Run with ``python -m app.db.maintenance <job>``; see ``--help`` for the list.
+"""
+import argparse
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Literal, Optional
+
+from sqlalchemy import delete, func, text, tuple_, update
+from sqlmodel import select
+
+from app.db.cache import redirect_cache
+from app.db.codes import generate_code
+from app.db.models import URL, URLVisit, URLVisitRollup, ShortCodePool, as_naive_utc, utcnow
+from app.db.partitions import expire_visit_partitions, is_partitioned, maintain_visit_partitions
+from app.db.rollups import Granularity
+from app.db.sql import dialect_insert
+
+__all__ = ["compact_visits", "fill_code_pool", "reconcile_visit_counts", "run_link_sweeper", "sweep_expired_links"]
+
+logger = logging.getLogger(__name__)
+
+# Session-level advisory lock letting a single worker sweep expired links at a time
+SWEEP_LOCK_ID = 7_265_718_002
+
+
+# Visit totals per URL, either from the raw url_visit rows or from the day rollups
+# (which outlive raw rows once VISIT_RAW_RETENTION_DAYS is set)
+def _visit_totals(source: Literal["raw", "rollup"]):
+    if source == "raw":
+        return URLVisit.url_id, func.count(URLVisit.id)
+    return URLVisitRollup.url_id, func.sum(URLVisitRollup.visits)
+
+
+# Compares url.visit_count with the recorded visits, one id range at a time.
+# Returns {url_id: (counter, actual)} for every mismatch; with `fix`, the counter
+# is reset to the actual count.
+async def reconcile_visit_counts(session_factory: Callable, fix: bool = False,
+                                 chunk_size: int = 1000,
+                                 source: Literal["raw", "rollup"] = "raw") -> dict[int, tuple[int, int]]:
+    url_id_column, total = _visit_totals(source)
+    mismatches = {}
+    last_id = 0
+    while True:
+        async with session_factory() as session:
+            stmt = (
+                select(URL.id, URL.visit_count)
+                .where(URL.id > last_id)
+                .order_by(URL.id)
+                .limit(chunk_size)
+            )
+            counters = (await session.exec(stmt)).all()
+            if not counters:
+                break
+
+            # Count the visits for just this id range (served by the url_id indexes)
+            stmt = (
+                select(url_id_column, total)
+                .where(url_id_column > last_id, url_id_column <= counters[-1][0])
+                .group_by(url_id_column)
+            )
+            if source == "rollup":
+                stmt = stmt.where(URLVisitRollup.granularity == Granularity.day.value)
+            actual = dict((await session.exec(stmt)).all())
+
+            chunk = {
+                url_id: (counter, actual.get(url_id, 0))
+                for url_id, counter in counters
+                if counter != actual.get(url_id, 0)
+            }
+            if fix and chunk:
+                # Recount inside the UPDATE so visits recorded meanwhile aren't lost
+                recount = select(func.coalesce(total, 0)).where(url_id_column == URL.id)
+                if source == "rollup":
+                    recount = recount.where(URLVisitRollup.granularity == Granularity.day.value)
+                await session.exec(
+                    update(URL).where(URL.id.in_(chunk)).values(visit_count=recount.scalar_subquery())
+                )
+                await session.commit()
+
+            mismatches.update(chunk)
+            last_id = counters[-1][0]
+
+    return mismatches
+
+
+# Ages visit data: drops minute and hour rollups past their retention (the coarser
+# buckets already hold those visits) and, if `raw_retention_days` is set, raw
+# url_visit rows past it. Deletes run in bounded, separately committed batches;
+# a partitioned url_visit loses whole expired months instead (dropped, or moved
+# to `archive_schema`). Returns the number of deleted rows (or partitions) per kind.
+async def compact_visits(session_factory: Callable, minute_retention_days: int, hour_retention_days: int,
+                         raw_retention_days: Optional[int] = None, batch_size: int = 10_000,
+                         now: Optional[datetime] = None,
+                         archive_schema: Optional[str] = None) -> dict[str, int]:
+    now = as_naive_utc(now or utcnow())
+    deleted = {}
+
+    rollup_key = tuple_(URLVisitRollup.url_id, URLVisitRollup.granularity, URLVisitRollup.bucket_start)
+    for granularity, days in ((Granularity.minute, minute_retention_days),
+                              (Granularity.hour, hour_retention_days)):
+        expired = (
+            select(URLVisitRollup.url_id, URLVisitRollup.granularity, URLVisitRollup.bucket_start)
+            .where(
+                URLVisitRollup.granularity == granularity.value,
+                URLVisitRollup.bucket_start < now - timedelta(days=days),
+            )
+            .limit(batch_size)
+        )
+        deleted[f"{granularity.value}_rollups"] = await _delete_in_batches(
+            session_factory, delete(URLVisitRollup).where(rollup_key.in_(expired))
+        )
+
+    if raw_retention_days is not None:
+        async with session_factory() as session:
+            conn = await session.connection()
+            if await is_partitioned(conn):
+                expired_partitions = await expire_visit_partitions(conn, raw_retention_days, archive_schema, now)
+                await session.commit()
+                deleted["raw_partitions"] = len(expired_partitions)
+                return deleted
+
+        expired = (
+            select(URLVisit.id)
+            .where(URLVisit.timestamp < now - timedelta(days=raw_retention_days))
+            .order_by(URLVisit.id)
+            .limit(batch_size)
+        )
+        deleted["raw_visits"] = await _delete_in_batches(
+            session_factory, delete(URLVisit).where(URLVisit.id.in_(expired))
+        )
+
+    return deleted
+
+
+# Holds a session-level advisory lock for the duration of a sweep, so that only one worker
+# sweeps at a time (PostgreSQL); yields False if another session holds it
+@asynccontextmanager
+async def _sweep_lock(session_factory: Callable):
+    async with session_factory() as session:
+        # Autocommit, so holding the lock doesn't keep a transaction open
+        conn = await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        if conn.dialect.name != "postgresql":
+            yield True
+            return
+        acquired = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": SWEEP_LOCK_ID})
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": SWEEP_LOCK_ID})
+
+
+# Deletes links that expired more than `retention_days` ago, with their visits and
+# rollups. Works through `batch_size` links at a time, deleting their dependent rows
+# in separately committed batches of the same size so no transaction holds many locks
+# or produces a large burst of WAL. Returns the number of deleted rows per kind (all
+# zero if another worker is sweeping).
+async def sweep_expired_links(session_factory: Callable, retention_days: int = 0, batch_size: int = 500,
+                              now: Optional[datetime] = None) -> dict[str, int]:
+    deleted = {"urls": 0, "visits": 0, "rollups": 0}
+    async with _sweep_lock(session_factory) as acquired:
+        if acquired:
+            await _sweep_expired_links(session_factory, retention_days, batch_size, now, deleted)
+    return deleted
+
+
+async def _sweep_expired_links(session_factory: Callable, retention_days: int, batch_size: int,
+                               now: Optional[datetime], deleted: dict[str, int]) -> None:
+    now = as_naive_utc(now or utcnow())
+    cutoff = now - timedelta(days=retention_days)
+    rollup_key = tuple_(URLVisitRollup.url_id, URLVisitRollup.granularity, URLVisitRollup.bucket_start)
+    while True:
+        async with session_factory() as session:
+            expired = (await session.exec(
+                select(URL.id, URL.short_code).where(URL.expires_at < cutoff).order_by(URL.id).limit(batch_size)
+            )).all()
+        if not expired:
+            return
+        url_ids = [url_id for url_id, _ in expired]
+
+        deleted["visits"] += await _delete_in_batches(session_factory, delete(URLVisit).where(URLVisit.id.in_(
+            select(URLVisit.id).where(URLVisit.url_id.in_(url_ids)).limit(batch_size)
+        )))
+        deleted["rollups"] += await _delete_in_batches(session_factory, delete(URLVisitRollup).where(rollup_key.in_(
+            select(URLVisitRollup.url_id, URLVisitRollup.granularity, URLVisitRollup.bucket_start)
+            .where(URLVisitRollup.url_id.in_(url_ids))
+            .limit(batch_size)
+        )))
+        async with session_factory() as session:
+            # Visits written since their batch deletes went out would block the link's delete
+            gone = select(URL.id).where(URL.id.in_(url_ids), URL.expires_at < cutoff)
+            deleted["visits"] += (await session.exec(delete(URLVisit).where(URLVisit.url_id.in_(gone)))).rowcount
+            deleted["rollups"] += (await session.exec(
+                delete(URLVisitRollup).where(URLVisitRollup.url_id.in_(gone))
+            )).rowcount
+            removed = set((await session.exec(
+                delete(URL).where(URL.id.in_(url_ids), URL.expires_at < cutoff).returning(URL.id)
+            )).scalars().all())
+
+            # Links renewed in the meantime stay, minus their old visits: recount them
+            renewed = [url_id for url_id in url_ids if url_id not in removed]
+            if renewed:
+                recount = select(func.count(URLVisit.id)).where(URLVisit.url_id == URL.id).scalar_subquery()
+                await session.exec(update(URL).where(URL.id.in_(renewed)).values(visit_count=recount))
+            await session.commit()
+        deleted["urls"] += len(removed)
+
+        # Cached entries would keep answering 410 instead of 404 until their TTL
+        await redirect_cache.invalidate(*(code for _, code in expired))
+        if len(expired) < batch_size:
+            return
+
+
+# Sweeps expired links every `interval` seconds until cancelled
+async def run_link_sweeper(session_factory: Callable, interval: float, retention_days: int,
+                           batch_size: int) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            deleted = await sweep_expired_links(session_factory, retention_days, batch_size)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Expired link sweep failed")
+            continue
+        if deleted["urls"]:
+            logger.info("Expired link sweep deleted %s", deleted)
+
+
+# Tops short_code_pool up to `size` free codes of `length` characters, skipping codes
+# already used in url. Reserved entries older than `reserved_ttl_days` are removed
+# first: by then they have either been used or were lost with a worker.
+# Returns the number of codes added.
+async def fill_code_pool(session_factory: Callable, size: int, length: int = 7,
+                         batch_size: int = 10_000, reserved_ttl_days: int = 1) -> int:
+    await _delete_in_batches(session_factory, delete(ShortCodePool).where(ShortCodePool.code.in_(
+        select(ShortCodePool.code)
+        .where(ShortCodePool.reserved_at < utcnow() - timedelta(days=reserved_ttl_days))
+        .limit(batch_size)
+    )))
+
+    added = 0
+    while True:
+        async with session_factory() as session:
+            free = (await session.exec(
+                select(func.count()).select_from(ShortCodePool).where(ShortCodePool.reserved_at.is_(None))
+            )).one()
+            missing = min(size - free, batch_size)
+            if missing <= 0:
+                return added
+
+            candidates = {generate_code(length) for _ in range(missing)}
+            used = set((await session.exec(select(URL.short_code).where(URL.short_code.in_(candidates)))).all())
+            rows = [{"code": code} for code in candidates - used]
+
+            conn = await session.connection()
+            result = await conn.execute(dialect_insert(conn, ShortCodePool).on_conflict_do_nothing(), rows)
+            await session.commit()
+            if result.rowcount == 0:
+                return added  # Only collisions left to generate; give up for this run
+            added += max(result.rowcount, 0)
+
+
+async def _delete_in_batches(session_factory: Callable, stmt) -> int:
+    total = 0
+    while True:
+        async with session_factory() as session:
+            result = await session.exec(stmt)
+            await session.commit()
+        if not result.rowcount:
+            return total
+        total += result.rowcount
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from app.core.setting import settings
+    from app.db.session import async_session_maker
+
+    parser = argparse.ArgumentParser(prog="python -m app.db.maintenance")
+    jobs = parser.add_subparsers(dest="job", required=True)
+
+    reconcile = jobs.add_parser("reconcile", help="Check url.visit_count against recorded visits")
+    reconcile.add_argument("--fix", action="store_true", help="Overwrite counters that drifted")
+    reconcile.add_argument("--chunk-size", type=int, default=1000)
+    reconcile.add_argument(
+        "--source", choices=["raw", "rollup"],
+        default="rollup" if settings.VISIT_RAW_RETENTION_DAYS else "raw",
+        help="Count url_visit rows, or day rollups (default when raw visits are aged out)",
+    )
+
+    compact = jobs.add_parser("compact", help="Age out fine-grained rollups and old raw visits")
+    compact.add_argument("--batch-size", type=int, default=10_000)
+
+    partitions = jobs.add_parser("partitions", help="Create upcoming url_visit partitions, expire old ones")
+    partitions.add_argument("--months-ahead", type=int, default=settings.VISIT_PARTITION_PREMAKE_MONTHS)
+
+    sweep = jobs.add_parser("sweep-links", help="Delete expired links with their visits")
+    sweep.add_argument("--batch-size", type=int, default=settings.LINK_SWEEP_BATCH_SIZE)
+
+    fill_pool = jobs.add_parser("fill-code-pool", help="Pre-generate codes for the 'pool' strategy")
+    fill_pool.add_argument("--size", type=int, default=1_000_000, help="Number of free codes to keep")
+    fill_pool.add_argument("--length", type=int, default=7)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.job == "reconcile":
+        mismatches = asyncio.run(
+            reconcile_visit_counts(async_session_maker, args.fix, args.chunk_size, args.source)
+        )
+        for url_id, (counter, count) in mismatches.items():
+            logger.warning("url %s: visit_count=%s, recorded visits=%s", url_id, counter, count)
+        logger.info("%d mismatched counter(s)%s", len(mismatches), " fixed" if args.fix else "")
+
+    elif args.job == "compact":
+        deleted = asyncio.run(compact_visits(
+            async_session_maker,
+            minute_retention_days=settings.ROLLUP_MINUTE_RETENTION_DAYS,
+            hour_retention_days=settings.ROLLUP_HOUR_RETENTION_DAYS,
+            raw_retention_days=settings.VISIT_RAW_RETENTION_DAYS,
+            batch_size=args.batch_size,
+            archive_schema=settings.VISIT_PARTITION_ARCHIVE_SCHEMA,
+        ))
+        logger.info("Compaction deleted %s", deleted)
+
+    elif args.job == "partitions":
+        result = asyncio.run(maintain_visit_partitions(
+            async_session_maker,
+            months_ahead=args.months_ahead,
+            retention_days=settings.VISIT_RAW_RETENTION_DAYS,
+            archive_schema=settings.VISIT_PARTITION_ARCHIVE_SCHEMA,
+        ))
+        logger.info("Partition maintenance: %s", result)
+
+    elif args.job == "sweep-links":
+        deleted = asyncio.run(sweep_expired_links(
+            async_session_maker, settings.LINK_EXPIRED_RETENTION_DAYS, args.batch_size
+        ))
+        logger.info("Link sweep deleted %s", deleted)
+
+    elif args.job == "fill-code-pool":
+        added = asyncio.run(fill_code_pool(async_session_maker, args.size, args.length))
+        logger.info("Added %d code(s) to the pool", added)
+
+
+if __name__ == "__main__":
+    main()
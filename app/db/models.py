@@ -1,6 +1,10 @@
+import hashlib
+import ipaddress
 from typing import Optional, List
 from datetime import datetime, UTC
 
+from sqlalchemy import BigInteger, CheckConstraint, Index, LargeBinary, event
+from sqlalchemy.types import TypeDecorator
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -9,6 +13,43 @@ def utcnow() -> datetime:
     return datetime.now(tz=UTC)
 
 
+# Converts an aware datetime to the naive UTC the timestamp columns hold; naive values are taken as UTC
+def as_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(UTC).replace(tzinfo=None)
+
+
+# Fixed-width key for deduplicating original URLs, which can be arbitrarily long.
+# URLs are hashed as stored, i.e. already normalized by pydantic's HttpUrl.
+def url_digest(url: str) -> bytes:
+    return hashlib.sha256(url.encode("utf-8")).digest()
+
+
+# Stores IP addresses packed into 4 (IPv4) or 16 (IPv6) bytes instead of up to 45
+# characters of text. Anything else that reaches it is a hex string, e.g. a hashed
+# IP (see app.db.visits.anonymize_ip), and is stored as the bytes it encodes.
+class PackedIP(TypeDecorator):
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        try:
+            return ipaddress.ip_address(value).packed
+        except ValueError:
+            return bytes.fromhex(value)
+
+    def process_result_value(self, value: Optional[bytes], dialect) -> Optional[str]:
+        if value is None:
+            return None
+        value = bytes(value)
+        if len(value) in (4, 16):
+            return str(ipaddress.ip_address(value))
+        return value.hex()
+
+
 # -----------------------
 # Base model for all tables
 # -----------------------
@@ -29,11 +70,21 @@ class Base(SQLModel):
 # -----------------------
 class URL(Base, table=True):
     __tablename__ = "url"
+    __table_args__ = (
+        CheckConstraint("redirect_status IN (301, 302, 307, 308)", name="ck_url_redirect_status"),
+        CheckConstraint("redirect_max_age >= 0", name="ck_url_redirect_max_age"),
+    )
 
     original_url: str = Field(
+        description="The original long URL"
+    )
+    original_url_digest: Optional[bytes] = Field(
+        default=None,
+        sa_type=LargeBinary(32),
         index=True,
         unique=True,
-        description="The original long URL"
+        description="SHA-256 of original_url, used to deduplicate URLs; null for links with "
+                    "an expiry or click limit, which are never shared"
     )
     short_code: str = Field(
         index=True,
@@ -42,6 +93,28 @@ class URL(Base, table=True):
         max_length=32,
         description="Unique short code for redirection"
     )
+    visit_count: int = Field(
+        default=0,
+        sa_column_kwargs={"server_default": "0"},
+        description="Number of recorded visits, maintained by the visit-write path"
+    )
+    redirect_status: Optional[int] = Field(
+        default=None,
+        description="Redirect status code (301, 302, 307 or 308), or null for REDIRECT_STATUS"
+    )
+    redirect_max_age: Optional[int] = Field(
+        default=None,
+        description="Cache-Control max-age of cacheable redirects, or null for REDIRECT_MAX_AGE"
+    )
+    expires_at: Optional[datetime] = Field(
+        default=None,
+        index=True,
+        description="When the link stops redirecting (UTC), or null if it never expires"
+    )
+    max_clicks: Optional[int] = Field(
+        default=None,
+        description="Visits after which the link expires, or null for no limit"
+    )
 
     # All visit records associated with this URL
     visits: List["URLVisit"] = Relationship(
@@ -50,15 +123,34 @@ class URL(Base, table=True):
     )
 
 
+# Keeps the digest in step with original_url and the link's limits for ORM writes
+# (API, admin panel); Core inserts set it explicitly
+@event.listens_for(URL, "before_insert")
+@event.listens_for(URL, "before_update")
+def _set_original_url_digest(mapper, connection, target: URL) -> None:
+    limited = target.expires_at is not None or target.max_clicks is not None
+    target.original_url_digest = None if limited else url_digest(target.original_url)
+
+
 # -----------------------
 # URLVisit Table (tracks each visit)
 # -----------------------
-class URLVisit(Base, table=True):
+# Kept narrow, as it gets a row per click: no created_at besides the visit timestamp
+class URLVisit(SQLModel, table=True):
     __tablename__ = "url_visit"
+    __table_args__ = (
+        # Serves per-URL counts and time-range scans; on PostgreSQL the table is
+        # partitioned by month on timestamp (see app/db/partitions.py)
+        Index("ix_url_visit_url_id_timestamp", "url_id", "timestamp"),
+    )
 
+    id: Optional[int] = Field(
+        default=None,
+        primary_key=True,
+        description="Primary key"
+    )
     url_id: int = Field(
         foreign_key="url.id",
-        index=True,
         description="Foreign key referencing the URL table"
     )
     timestamp: datetime = Field(
@@ -67,11 +159,77 @@ class URLVisit(Base, table=True):
     )
     ip_address: Optional[str] = Field(
         default=None,
-        max_length=45,  # Enough to support IPv6
-        description="Visitor IP address"
+        sa_type=PackedIP,
+        description="Visitor IP address, truncated or hashed depending on VISIT_IP_MODE"
     )
 
     # Parent URL record
     url: Optional[URL] = Relationship(
         back_populates="visits",
     )
+
+
+# -----------------------
+# URLVisitRollup Table (pre-aggregated visit counts per time bucket)
+# -----------------------
+class URLVisitRollup(SQLModel, table=True):
+    __tablename__ = "url_visit_rollup"
+    __table_args__ = (
+        # Lets the compaction job find expired buckets without scanning every URL
+        Index("ix_url_visit_rollup_granularity_bucket_start", "granularity", "bucket_start"),
+    )
+
+    url_id: int = Field(
+        foreign_key="url.id",
+        primary_key=True,
+        description="Foreign key referencing the URL table"
+    )
+    granularity: str = Field(
+        primary_key=True,
+        max_length=8,
+        description="Bucket size: minute, hour or day"
+    )
+    bucket_start: datetime = Field(
+        primary_key=True,
+        description="Start of the bucket (UTC)"
+    )
+    visits: int = Field(
+        default=0,
+        description="Number of visits recorded in the bucket"
+    )
+
+
+# -----------------------
+# ShortCodeSequence Table (block-reserved counters for code generation)
+# -----------------------
+class ShortCodeSequence(SQLModel, table=True):
+    __tablename__ = "short_code_sequence"
+
+    name: str = Field(
+        primary_key=True,
+        max_length=32,
+        description="Name of the code generation strategy using the sequence"
+    )
+    next_value: int = Field(
+        default=0,
+        sa_type=BigInteger,
+        description="First value not yet reserved by any worker"
+    )
+
+
+# -----------------------
+# ShortCodePool Table (pre-generated short codes)
+# -----------------------
+class ShortCodePool(SQLModel, table=True):
+    __tablename__ = "short_code_pool"
+
+    code: str = Field(
+        primary_key=True,
+        max_length=32,
+        description="Pre-generated short code"
+    )
+    reserved_at: Optional[datetime] = Field(
+        default=None,
+        index=True,
+        description="When a worker reserved the code, or null while it is free"
+    )
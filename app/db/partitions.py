@@ -0,0 +1,176 @@
+"""
+Monthly range partitions of url_visit (PostgreSQL only).
+
+The partitioning migration turns url_visit into a table partitioned by
+``timestamp``, with one partition per calendar month (``url_visit_p2026_10``, ...)
+and a default partition catching rows that no monthly partition covers.
+
+Partitions are created ahead of time by `ensure_visit_partitions`. Months past
+the retention are detached and dropped (or moved to an archive schema) by
+`expire_visit_partitions`, which is far cheaper than deleting rows and leaves no
+dead tuples behind for autovacuum. On other databases, or a url_visit table
+that was not migrated, every function here does nothing.
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.models import as_naive_utc, utcnow
+
+__all__ = [
+    "ensure_visit_partitions",
+    "expire_visit_partitions",
+    "is_partitioned",
+    "maintain_visit_partitions",
+    "partition_name",
+    "run_partition_maintenance",
+]
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "url_visit"
+DEFAULT_PARTITION = "url_visit_default"
+
+# Transaction-level advisory lock serializing partition maintenance between workers
+ADVISORY_LOCK_ID = 7_265_718_001
+
+_PARTITION_NAME = re.compile(r"^url_visit_p(\d{4})_(\d{2})$")
+
+
+def month_start(value: datetime) -> datetime:
+    return as_naive_utc(value).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_p{month:%Y_%m}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid))"
+    ), {"table": PARENT_TABLE}))
+
+
+# Monthly partitions currently attached to url_visit, by name
+async def list_partitions(conn: AsyncConnection) -> dict[str, datetime]:
+    names = (await conn.scalars(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND pg_table_is_visible(p.oid)"
+    ), {"table": PARENT_TABLE})).all()
+    partitions = {}
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match[1]), int(match[2]), 1)
+    return partitions
+
+
+# Creates the partition for `month`, moving over any of its rows that landed in the default partition
+async def create_partition(conn: AsyncConnection, month: datetime) -> None:
+    name = partition_name(month)
+    bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    in_range = {"start": month, "end": add_months(month, 1)}
+    stranded = await conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end)"
+    ), in_range)
+    if not stranded:
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES {bounds}"))
+        return
+
+    # A new partition can't overlap rows of the default partition, so attach it once they moved
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ), in_range)
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+
+
+# Creates the partitions for the current month, the next `months_ahead` months and any
+# month with rows in the default partition. Returns the names of the created partitions.
+async def ensure_visit_partitions(conn: AsyncConnection, months_ahead: int,
+                                  now: Optional[datetime] = None) -> list[str]:
+    if not await is_partitioned(conn):
+        return []
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+    current = month_start(now or utcnow())
+    months = {add_months(current, offset) for offset in range(months_ahead + 1)}
+    months.update(await conn.scalars(text(
+        f"SELECT DISTINCT date_trunc('month', timestamp) FROM {DEFAULT_PARTITION}"
+    )))
+
+    existing = await list_partitions(conn)
+    created = []
+    for month in sorted(months):
+        if partition_name(month) not in existing:
+            await create_partition(conn, month)
+            created.append(partition_name(month))
+    return created
+
+
+# Detaches the monthly partitions that only hold visits older than `retention_days`, then
+# drops them or, with `archive_schema`, moves them there. Returns the affected partitions.
+async def expire_visit_partitions(conn: AsyncConnection, retention_days: int,
+                                  archive_schema: Optional[str] = None,
+                                  now: Optional[datetime] = None) -> list[str]:
+    if not await is_partitioned(conn):
+        return []
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+    cutoff = as_naive_utc(now or utcnow()) - timedelta(days=retention_days)
+    expired = sorted(name for name, month in (await list_partitions(conn)).items()
+                     if add_months(month, 1) <= cutoff)
+    if expired and archive_schema:
+        schema = conn.dialect.identifier_preparer.quote(archive_schema)
+        await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    for name in expired:
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        if archive_schema:
+            await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {schema}"))
+        else:
+            await conn.execute(text(f"DROP TABLE {name}"))
+    return expired
+
+
+# Creates upcoming partitions and, if `retention_days` is set, expires old ones, in one transaction
+async def maintain_visit_partitions(session_factory: Callable, months_ahead: int,
+                                    retention_days: Optional[int] = None,
+                                    archive_schema: Optional[str] = None) -> dict[str, list[str]]:
+    async with session_factory() as session:
+        conn = await session.connection()
+        result = {"created": await ensure_visit_partitions(conn, months_ahead)}
+        if retention_days is not None:
+            result["expired"] = await expire_visit_partitions(conn, retention_days, archive_schema)
+        await session.commit()
+    if result["created"] or result.get("expired"):
+        logger.info("Visit partition maintenance: %s", result)
+    return result
+
+
+# Runs partition maintenance every `interval` seconds until cancelled
+async def run_partition_maintenance(session_factory: Callable, interval: float, months_ahead: int,
+                                    retention_days: Optional[int] = None,
+                                    archive_schema: Optional[str] = None) -> None:
+    while True:
+        try:
+            await maintain_visit_partitions(session_factory, months_ahead, retention_days, archive_schema)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Visit partition maintenance failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,165 @@
+import asyncio
+import itertools
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.metrics import instrument_engine
+from app.core.setting import Settings, settings
+from app.db.session import engine_options
+
+__all__ = ["ReplicaSet", "replicas"]
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class ReplicaSet:
+    """
+    Routes read-only queries to read replicas, round-robin over the ones that
+    passed their last health check.
+
+    A query goes to the primary instead (through the caller's session) when no
+    replica is healthy, when the replica fails or takes longer than
+    `query_timeout` seconds (it then counts as down until its next health
+    check), or when the replica's answer is not good enough, by default when it
+    found nothing. The latter covers reads right after a write that the replica
+    hasn't replayed yet, such as a redirect right after a shorten. Batch reads
+    (`read_many`) send only the keys the replica didn't find to the primary.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], health_interval: float = 5.0, health_timeout: float = 1.0,
+                 query_timeout: float = 1.0):
+        self.engines = engines
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.query_timeout = query_timeout
+        self._session_makers = [
+            sessionmaker(bind=e, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+            for e in engines
+        ]
+        self._healthy = [True] * len(engines)
+        self._counter = itertools.count()
+
+        # Metrics
+        self.replica_reads = 0
+        self.primary_fallbacks = 0
+
+    @classmethod
+    def from_settings(cls, config: Settings) -> "ReplicaSet":
+        engines = [create_async_engine(dsn, **engine_options(config, dsn)) for dsn in config.DB_REPLICA_DSNS]
+        for index, replica in enumerate(engines):
+            instrument_engine(replica, f"replica{index}")
+        return cls(engines, config.DB_REPLICA_HEALTH_INTERVAL, config.DB_REPLICA_HEALTH_TIMEOUT,
+                   config.DB_REPLICA_QUERY_TIMEOUT)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def _pick(self) -> Optional[int]:
+        healthy = [i for i, ok in enumerate(self._healthy) if ok]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    # Runs `query` on a healthy replica; returns (False, None) when there is none or it fails
+    async def _read_replica(self, query: Callable[[AsyncSession], Awaitable[T]]) -> tuple[bool, Optional[T]]:
+        index = self._pick()
+        if index is None:
+            return False, None
+        try:
+            async with asyncio.timeout(self.query_timeout):
+                async with self._session_makers[index]() as session:
+                    result = await query(session)
+        except TimeoutError:
+            self._healthy[index] = False
+            logger.warning("Replica %d timed out, using the primary until it recovers", index)
+            return False, None
+        except (SQLAlchemyError, OSError) as exc:
+            self._healthy[index] = False
+            logger.warning("Replica %d failed, using the primary until it recovers: %s", index, exc)
+            return False, None
+        self.replica_reads += 1
+        return True, result
+
+    async def read(
+            self,
+            query: Callable[[AsyncSession], Awaitable[T]],
+            primary: AsyncSession,
+            use_primary_if: Callable[[T], bool] = lambda result: result is None,
+    ) -> T:
+        """
+        Runs `query` on a replica session, or on `primary` as described above.
+        """
+        answered, result = await self._read_replica(query)
+        if answered and not use_primary_if(result):
+            return result
+        if self.engines:
+            self.primary_fallbacks += 1
+        return await query(primary)
+
+    async def read_many(
+            self,
+            query: Callable[[AsyncSession, list[K]], Awaitable[dict[K, V]]],
+            keys: list[K],
+            primary: AsyncSession,
+            retry_if: Callable[[K], bool] = lambda key: True,
+    ) -> dict[K, V]:
+        """
+        Runs `query` for `keys` on a replica session, then on `primary` for only
+        the keys the replica found nothing for (those `retry_if` accepts), and
+        merges both answers. Without a replica, `query` runs on `primary` once.
+        """
+        answered, found = await self._read_replica(lambda session: query(session, keys))
+        if not answered:
+            if self.engines:
+                self.primary_fallbacks += 1
+            return await query(primary, keys)
+        missing = [key for key in keys if key not in found and retry_if(key)]
+        if missing:
+            self.primary_fallbacks += 1
+            found.update(await query(primary, missing))
+        return found
+
+    async def check_health(self) -> None:
+        for index, replica in enumerate(self.engines):
+            try:
+                async with asyncio.timeout(self.health_timeout):
+                    async with replica.connect() as conn:
+                        await conn.execute(text("SELECT 1"))
+                healthy = True
+            except Exception:
+                healthy = False
+            if healthy != self._healthy[index]:
+                logger.warning("Replica %d is %s", index, "back up" if healthy else "down")
+            self._healthy[index] = healthy
+
+    async def run_health_checks(self) -> None:
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.engines),
+            "healthy": sum(self._healthy),
+            "replica_reads": self.replica_reads,
+            "primary_fallbacks": self.primary_fallbacks,
+        }
+
+    async def close(self) -> None:
+        for replica in self.engines:
+            await replica.dispose()
+
+
+# Process-wide replica set; without DB_REPLICA_DSNS every read goes to the primary
+replicas = ReplicaSet.from_settings(settings)
@@ -0,0 +1,69 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.models import URLVisitRollup, as_naive_utc
+from app.db.sql import dialect_insert
+
+__all__ = ["Granularity", "bucket_start", "count_buckets", "upsert_rollups"]
+
+
+class Granularity(str, Enum):
+    """
+    Bucket sizes maintained in the url_visit_rollup table.
+    """
+    minute = "minute"
+    hour = "hour"
+    day = "day"
+
+    @property
+    def step(self) -> timedelta:
+        return _STEPS[self]
+
+
+_STEPS = {
+    Granularity.minute: timedelta(minutes=1),
+    Granularity.hour: timedelta(hours=1),
+    Granularity.day: timedelta(days=1),
+}
+
+
+# Truncates a timestamp to the start of its bucket, as naive UTC
+def bucket_start(ts: datetime, granularity: Granularity) -> datetime:
+    ts = as_naive_utc(ts)
+    if granularity is Granularity.minute:
+        return ts.replace(second=0, microsecond=0)
+    if granularity is Granularity.hour:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Aggregates (url_id, timestamp) pairs into per-bucket visit counts for every granularity
+def count_buckets(visits: Iterable[tuple[int, datetime]]) -> Counter:
+    counts = Counter()
+    for url_id, ts in visits:
+        for granularity in Granularity:
+            counts[(url_id, granularity.value, bucket_start(ts, granularity))] += 1
+    return counts
+
+
+# Adds bucket counts to the rollup table with a single INSERT ... ON CONFLICT DO UPDATE
+async def upsert_rollups(conn: AsyncConnection, counts: Counter) -> None:
+    if not counts:
+        return
+
+    table = URLVisitRollup.__table__
+    stmt = dialect_insert(conn, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.url_id, table.c.granularity, table.c.bucket_start],
+        set_={"visits": table.c.visits + stmt.excluded.visits},
+    )
+    # Sorted so concurrent writers lock rollup rows in the same order
+    rows = [
+        {"url_id": url_id, "granularity": granularity, "bucket_start": start, "visits": n}
+        for (url_id, granularity, start), n in sorted(counts.items())
+    ]
+    await conn.execute(stmt, rows)
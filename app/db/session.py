@@ -1,20 +1,48 @@
 import logging
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
-from sqlalchemy.ext.asyncio import create_async_engine
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.core.setting import settings
+from app.core.metrics import instrument_engine
+from app.core.setting import Settings, settings
 
 logger = logging.getLogger(__name__)
 
+
+# Keyword arguments for create_async_engine, built from the DB_* settings, for
+# `dsn` (PG_DSN by default)
+def engine_options(config: Settings, dsn: Optional[str] = None) -> dict:
+    options = {
+        "echo": config.DB_ECHO,  # Enables SQL echoing in logs (useful for debugging)
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+    }
+    url = make_url(dsn or config.PG_DSN)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options  # In-memory SQLite shares a single connection (StaticPool)
+
+    options.update(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+    )
+    if url.get_driver_name() == "asyncpg":
+        connect_args = {"statement_cache_size": config.DB_STATEMENT_CACHE_SIZE}
+        if config.DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(config.DB_STATEMENT_TIMEOUT_MS)}
+        options["connect_args"] = connect_args
+    return options
+
+
 # Create async SQLAlchemy engine
-engine = create_async_engine(
-    settings.PG_DSN,
-    echo=settings.DB_ECHO,  # Enables SQL echoing in logs (useful for debugging)
-)
+engine = create_async_engine(settings.PG_DSN, **engine_options(settings))
+instrument_engine(engine)
 
 # Create a session factory for async sessions
 async_session_maker = sessionmaker(
@@ -44,3 +72,96 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
             raise
         finally:
             await session.close()
+
+
+class LazySession:
+    """
+    Stands in for an AsyncSession that is only created when first used, so
+    requests answered without the database (e.g. from the redirect cache) skip
+    creating and closing a session altogether. AsyncSession itself already
+    defers checking out a connection until the first query.
+    """
+    __slots__ = ("_factory", "_session")
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def created(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._factory()
+        return getattr(self._session, name)
+
+
+def get_session_factory():
+    """
+    Dependency providing the session factory itself, for endpoints that manage
+    sessions on their own (e.g. while streaming a response, after request-scoped
+    dependencies have already been closed).
+    """
+    return async_session_maker
+
+
+async def get_lazy_session(
+        session_factory=Depends(get_session_factory),
+) -> AsyncGenerator[LazySession, None]:
+    """
+    Dependency like get_session, for read paths that often don't need the
+    database: the session is created on first use and only then cleaned up.
+    """
+    lazy = LazySession(session_factory)
+    try:
+        yield lazy
+    except Exception:
+        if lazy.created:
+            logger.exception("Error during DB session")
+            await lazy.rollback()
+        raise
+    finally:
+        if lazy.created:
+            await lazy.close()
+
+
+# Returns the current usage of an engine's connection pool
+def pool_stats(db_engine: AsyncEngine = engine) -> dict:
+    pool = db_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool_class": type(pool).__name__}  # e.g. StaticPool, NullPool
+    return {
+        "pool_class": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "timeout": pool.timeout(),
+    }
+
+
+# Warns when all workers together may open more connections than the database accepts
+async def check_connection_limits(db_engine: AsyncEngine = engine, config: Settings = settings) -> None:
+    if db_engine.dialect.name != "postgresql":
+        return
+
+    per_worker = config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW
+    total = per_worker * config.WEB_CONCURRENCY
+    try:
+        async with db_engine.connect() as conn:
+            max_connections = int((await conn.execute(text("SHOW max_connections"))).scalar())
+            reserved = int((await conn.execute(text("SHOW superuser_reserved_connections"))).scalar())
+    except Exception:
+        logger.warning("Could not read the database connection limits", exc_info=True)
+        return
+
+    available = max_connections - reserved
+    if total > available:
+        logger.warning(
+            "Connection pools may need %d connections (%d workers x (pool size %d + overflow %d)), "
+            "but the database accepts %d (max_connections %d - %d reserved)",
+            total, config.WEB_CONCURRENCY, config.DB_POOL_SIZE, config.DB_MAX_OVERFLOW,
+            available, max_connections, reserved,
+        )
@@ -0,0 +1,11 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+__all__ = ["dialect_insert"]
+
+
+# Returns an INSERT for `table` supporting ON CONFLICT clauses on the connection's
+# dialect (PostgreSQL in production, SQLite in development and tests)
+def dialect_insert(conn, table):
+    if conn.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -0,0 +1,401 @@
+import asyncio
+import contextlib
+import fcntl
+import glob
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from enum import Enum
+from typing import Callable, Optional
+
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.setting import settings
+from app.db.cache import redirect_cache
+from app.db.models import URL, URLVisit, as_naive_utc, utcnow
+from app.db.rollups import count_buckets, upsert_rollups
+
+__all__ = ["IPMode", "OverflowPolicy", "VisitRecorder", "anonymize_ip", "visit_recorder"]
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    """
+    What to do with a visit when the in-memory queue is full.
+    """
+    drop = "drop"    # Discard the visit and count it
+    block = "block"  # Make the request wait for queue space
+    spill = "spill"  # Append the visit to a file replayed on the next start
+
+
+class IPMode(str, Enum):
+    """
+    How much of the visitor IP is kept with a visit.
+    """
+    full = "full"            # The address as is
+    truncated = "truncated"  # Its /24 (IPv4) or /48 (IPv6) network address
+    hashed = "hashed"        # A keyed hash, telling visitors apart without storing their address
+    none = "none"            # Nothing
+
+
+# Applies the IP mode to a client address; addresses that don't parse are not stored
+def anonymize_ip(ip: Optional[str], mode: IPMode = IPMode.full, key: str = "") -> Optional[str]:
+    mode = IPMode(mode)
+    if ip is None or mode is IPMode.none:
+        return None
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if mode is IPMode.truncated:
+        prefix = 24 if address.version == 4 else 48
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False).network_address)
+    if mode is IPMode.hashed:
+        # 8 bytes, stored as such by the PackedIP column (distinct from 4- and 16-byte addresses)
+        return hmac.new(key.encode("utf-8"), address.packed, hashlib.sha256).digest()[:8].hex()
+    return str(address)
+
+
+_increment_visit_count = (
+    update(URL)
+    .where(URL.id == bindparam("url_pk"))
+    .values(visit_count=URL.visit_count + bindparam("increment"))
+)
+
+
+# Expires the links among `url_ids` whose visit count reached their max_clicks, returning
+# their short codes. Called where visits are counted, so redirects only need to check the
+# expiry of the link; the limit is soft by the visits still queued or in flight.
+async def expire_exhausted_links(conn: AsyncConnection, url_ids: list[int]) -> list[str]:
+    now = as_naive_utc(utcnow())
+    result = await conn.execute(
+        update(URL)
+        .where(
+            URL.id.in_(url_ids),
+            URL.max_clicks.is_not(None),
+            URL.visit_count >= URL.max_clicks,
+            or_(URL.expires_at.is_(None), URL.expires_at > now),
+        )
+        .values(expires_at=now)
+        .returning(URL.short_code)
+    )
+    return list(result.scalars())
+
+
+# Marks the end of the queue when the recorder is stopped
+_STOP = object()
+
+
+class VisitRecorder:
+    """
+    Buffers visits in a bounded asyncio queue and writes them with multi-row
+    inserts, flushing when `batch_size` visits are pending or `flush_interval`
+    seconds have passed since the first one, whichever comes first.
+
+    While the recorder is not running, `submit` returns False and callers are
+    expected to insert the visit themselves.
+    """
+
+    def __init__(
+            self,
+            session_factory: Optional[Callable] = None,
+            max_queue_size: int = 10_000,
+            batch_size: int = 500,
+            flush_interval: float = 1.0,
+            overflow_policy: OverflowPolicy = OverflowPolicy.drop,
+            spill_path: Optional[str] = None,
+    ):
+        self.session_factory = session_factory
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.spill_path = spill_path
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+        # Metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self, session_factory: Optional[Callable] = None) -> None:
+        if self._running:
+            return
+        if session_factory is not None:
+            self.session_factory = session_factory
+        if self.session_factory is None:
+            from app.db.session import async_session_maker
+            self.session_factory = async_session_maker
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        await self.replay_spill()
+        self._running = True
+        self._task = asyncio.create_task(self._run(), name="visit-recorder")
+
+    async def stop(self) -> None:
+        """
+        Stops accepting visits and flushes everything still queued.
+        """
+        if not self._running:
+            return
+        self._running = False
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+        # Visits that were blocked on a full queue while stopping
+        leftovers = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.batch_size):
+            await self._flush(leftovers[start:start + self.batch_size])
+
+    async def submit(self, url_id: int, ip: Optional[str], timestamp: Optional[datetime] = None) -> bool:
+        """
+        Queues a visit for the next batch. Returns False if the recorder is not
+        running and the visit was not taken.
+        """
+        if not self._running:
+            return False
+
+        row = {"url_id": url_id, "ip_address": ip, "timestamp": timestamp or utcnow()}
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            if self.overflow_policy is OverflowPolicy.block:
+                await self._queue.put(row)
+            elif self.overflow_policy is OverflowPolicy.spill and self.spill_path:
+                await self._spill([row])
+                return True
+            else:
+                self.dropped += 1
+                return True
+        self.enqueued += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queue_depth": self.queue_depth,
+            "queue_max_size": self.max_queue_size,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flush_count": self.flush_count,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            written = await self._write(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d visits", len(batch))
+            if self.spill_path:
+                await self._spill(batch)
+            return
+        finally:
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self.flushed += written
+        self.flush_count += 1
+
+    # Returns the number of visits written
+    async def _write(self, batch: list[dict]) -> int:
+        try:
+            await self._write_batch(batch)
+        except IntegrityError:
+            # Visits of links deleted (e.g. by the expired link sweeper) since they were
+            # queued would fail the batch on every retry; drop them and write the rest
+            batch = await self._drop_orphans(batch)
+            if batch:
+                await self._write_batch(batch)
+        return len(batch)
+
+    async def _drop_orphans(self, batch: list[dict]) -> list[dict]:
+        async with self.session_factory() as session:
+            conn = await session.connection()
+            existing = set((await conn.scalars(
+                select(URL.id).where(URL.id.in_({row["url_id"] for row in batch}))
+            )).all())
+        kept = [row for row in batch if row["url_id"] in existing]
+        if len(kept) < len(batch):
+            self.dropped += len(batch) - len(kept)
+            logger.warning("Dropped %d visits of deleted links", len(batch) - len(kept))
+        return kept
+
+    async def _write_batch(self, batch: list[dict]) -> None:
+        # One counter update per distinct URL in the batch, in the same transaction
+        increments = [
+            {"url_pk": url_id, "increment": n}
+            for url_id, n in sorted(Counter(row["url_id"] for row in batch).items())
+        ]
+        async with self.session_factory() as session:
+            # Core executemany, batched by SQLAlchemy into multi-row INSERT ... VALUES
+            conn = await session.connection()
+            await conn.execute(insert(URLVisit), batch)
+            await conn.execute(_increment_visit_count, increments)
+            await upsert_rollups(conn, count_buckets((row["url_id"], row["timestamp"]) for row in batch))
+            exhausted = await expire_exhausted_links(conn, [row["url_pk"] for row in increments])
+            await session.commit()
+        if exhausted:
+            await redirect_cache.invalidate(*exhausted)
+
+    async def _spill(self, batch: list[dict]) -> None:
+        try:
+            await asyncio.to_thread(_append_spill, self.spill_path, batch)
+        except OSError:
+            self.dropped += len(batch)
+            logger.exception("Failed to spill %d visits to %s", len(batch), self.spill_path)
+            return
+        self.spilled += len(batch)
+
+    async def replay_spill(self) -> None:
+        """
+        Writes visits spilled by previous runs and removes their files. The spill
+        file is claimed by renaming it, so only one worker takes it; claimed files
+        left behind by a replay that crashed are replayed too, each under a lock
+        so no two workers replay the same file.
+        """
+        if not self.spill_path:
+            return
+        claimed = f"{self.spill_path}.replay.{os.getpid()}"
+        with contextlib.suppress(FileNotFoundError):
+            await asyncio.to_thread(os.replace, self.spill_path, claimed)
+
+        for path in sorted(glob.glob(glob.escape(self.spill_path) + ".replay*")):
+            # Wait for writers still appending to the file we claimed; skip files
+            # another worker is replaying
+            f = await asyncio.to_thread(_open_locked, path, path == claimed)
+            if f is None:
+                continue
+            try:
+                while batch := await asyncio.to_thread(_read_spilled, f, self.batch_size):
+                    await self._flush(batch)
+                await asyncio.to_thread(os.remove, path)
+            finally:
+                f.close()
+            logger.info("Replayed spilled visits from %s", path)
+
+
+# Appends visits to the spill file under an exclusive lock; if the file was claimed
+# for replay between opening and locking it, appends to the new spill file instead
+def _append_spill(path: str, batch: list[dict]) -> None:
+    lines = "".join(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n" for row in batch)
+    while True:
+        with open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if _is_current(f, path):
+                f.write(lines)
+                return
+
+
+# Opens and locks a spill file for replay; returns None if it is gone, was replayed
+# meanwhile, or (without `wait`) is locked by another worker
+def _open_locked(path: str, wait: bool):
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    if not _is_current(f, path):
+        f.close()
+        return None
+    return f
+
+
+def _is_current(f, path: str) -> bool:
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+# Reads up to `limit` spilled visits
+def _read_spilled(f, limit: int) -> list[dict]:
+    batch = []
+    while len(batch) < limit:
+        line = f.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+        batch.append(row)
+    return batch
+
+
+# Process-wide recorder, started and stopped by the application lifespan
+visit_recorder = VisitRecorder(
+    max_queue_size=settings.VISIT_QUEUE_MAX_SIZE,
+    batch_size=settings.VISIT_BATCH_SIZE,
+    flush_interval=settings.VISIT_FLUSH_INTERVAL,
+    overflow_policy=settings.VISIT_OVERFLOW_POLICY,
+    spill_path=settings.VISIT_SPILL_PATH,
+)
@@ -4,10 +4,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqladmin import Admin
 
+from app.api.metrics import router as metrics_router
 from app.api.routes import router
 from app.db.admin import URLAdmin, URLVisitAdmin
 from app.db.session import engine
 from app.middleware.logging import add_logging_middleware
+from app.middleware.metrics import add_metrics_middleware
+from app.middleware.profiling import add_profiling_middleware
+from app.middleware.redirect import add_redirect_fast_path
 
 from app.conf.application_lifespan import lifespan
 from app.conf.logging import configure_logging
@@ -54,12 +58,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add custom request logging middleware
+# Record request latency per route for /metrics
+add_metrics_middleware(app)
+
+# Profile requests on demand (X-Profile header) or by sampling, if configured
+add_profiling_middleware(app, engine)
+
+# Answer cached redirects before any other middleware runs (added last = outermost)
+add_redirect_fast_path(app)
+
+# Add custom request logging middleware, around the fast path so its redirects are logged too
 add_logging_middleware(app)
 
 # --- Routes ---
 # Include all API routes
 app.include_router(router)
+app.include_router(metrics_router)
 
 # --- Admin Interface ---
 # SQLAdmin interface for managing URL and visit models
@@ -1,81 +1,143 @@
-import json
 import logging
+import random
 import time
+from typing import Iterable, Optional
 
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.setting import settings
 
 logger = logging.getLogger(__name__)
 
+# Headers never written to the log
+SENSITIVE_HEADERS = {"authorization", "cookie", "set-cookie"}
+
 
-class LoggingMiddleware(BaseHTTPMiddleware):
+class AccessLogMiddleware:
     """
-    Middleware for logging HTTP requests and responses with timing and filtering.
+    Pure ASGI access logger: records method, path, status, body sizes and timing
+    while passing request and response bodies through untouched.
+
+    Bodies (and request headers) are only captured, up to `body_max_bytes`, for
+    requests whose path starts with one of `body_paths` or whose response status
+    is at least `body_min_status`, and then only for a `body_sample_rate`
+    fraction of them.
     """
 
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+    def __init__(
+            self,
+            app: ASGIApp,
+            body_paths: Iterable[str] = (),
+            body_min_status: Optional[int] = None,
+            body_sample_rate: float = 1.0,
+            body_max_bytes: int = 1000,
+    ):
+        self.app = app
+        self.body_paths = tuple(body_paths)
+        self.body_min_status = body_min_status
+        self.body_sample_rate = body_sample_rate
+        self.body_max_bytes = body_max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        path = scope["path"]
+        path_match = bool(self.body_paths) and path.startswith(self.body_paths)
+        capture = (
+            (path_match or self.body_min_status is not None)
+            and (self.body_sample_rate >= 1 or random.random() < self.body_sample_rate)
+        )
+
+        status = 500  # Reported if the app fails before starting a response
+        content_type = ""
+        bytes_in = 0
+        bytes_out = 0
+        request_body = bytearray()
+        response_body = bytearray()
+
+        async def receive_wrapper() -> Message:
+            nonlocal bytes_in
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                bytes_in += len(body)
+                if capture and len(request_body) < self.body_max_bytes:
+                    request_body.extend(body[:self.body_max_bytes - len(request_body)])
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, content_type, bytes_out
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if capture:
+                    for name, value in message.get("headers", ()):
+                        if name.lower() == b"content-type":
+                            content_type = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                bytes_out += len(body)
+                if capture and len(response_body) < self.body_max_bytes:
+                    response_body.extend(body[:self.body_max_bytes - len(response_body)])
+            await send(message)
 
-        # Read the request body (must be buffered so downstream can read it again)
-        body_bytes = await request.body()
         try:
-            body_str = body_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            body_str = "<non-utf8 body>"
-
-        # Restore body for downstream (FastAPI only reads once)
-        async def receive():
-            return {"type": "http.request", "body": body_bytes, "more_body": False}
-
-        # Sanitize headers (avoid sensitive info)
-        headers = {k.lower(): v for k, v in dict(request.headers).items()}
-        filtered_headers = {
-            k: v for k, v in headers.items() if k not in {"authorization", "cookie", "set-cookie"}
-        }
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if logger.isEnabledFor(logging.INFO):
+                self._log(scope, started, status, content_type, bytes_in, bytes_out,
+                          capture, path_match, request_body, response_body)
 
-        # Get the response by passing the modified request downstream
-        response = await call_next(Request(request.scope, receive))
-        process_time = (time.time() - start_time) * 1000
-
-        # Read and buffer response body
-        response_body = b""
-        async for chunk in response.body_iterator:
-            response_body += chunk
-
-        # Decode response body (only if text or JSON)
-        content_type = response.headers.get("content-type", "")
-        if "application/json" in content_type or content_type.startswith("text/"):
-            try:
-                response_body_str = response_body.decode("utf-8")
-            except UnicodeDecodeError:
-                response_body_str = "<non-utf8 response body>"
+    def _log(self, scope: Scope, started: float, status: int, content_type: str, bytes_in: int,
+             bytes_out: int, capture: bool, path_match: bool, request_body: bytearray,
+             response_body: bytearray) -> None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        path = scope["path"]
+        fields = {
+            "method": scope["method"],
+            "path": path,
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status_code": status,
+            "duration_ms": round(duration_ms, 2),
+            "client": scope["client"][0] if scope.get("client") else None,
+            "request_bytes": bytes_in,
+            "response_bytes": bytes_out,
+        }
+        if capture and (path_match or (self.body_min_status is not None and status >= self.body_min_status)):
+            fields["headers"] = {
+                name.decode("latin-1").lower(): value.decode("latin-1")
+                for name, value in scope["headers"]
+                if name.decode("latin-1").lower() not in SENSITIVE_HEADERS
+            }
+            fields["request_body"] = _decode(bytes(request_body))
+            fields["response_body"] = (
+                _decode(bytes(response_body))
+                if "json" in content_type or content_type.startswith("text/")
+                else f"<{content_type} content>"
+            )
+            logger.info("%s %s %s %.2fms request_body=%r response_body=%r",
+                        fields["method"], path, status, duration_ms,
+                        fields["request_body"], fields["response_body"], extra={"http": fields})
         else:
-            response_body_str = f"<{content_type} content>"
-
-        # Log the HTTP interaction
-        logger.info(json.dumps({
-            "method": request.method,
-            "path": request.url.path,
-            "query": str(request.url.query),
-            "status_code": response.status_code,
-            "duration_ms": round(process_time, 2),
-            "headers": filtered_headers,
-            "request_body": body_str[:1000],          # Avoid overlogging
-            "response_body": response_body_str[:1000] # Limit response size
-        }))
-
-        # Reconstruct the response for the client
-        return StreamingResponse(
-            iter([response_body]),
-            status_code=response.status_code,
-            headers=dict(response.headers),
-            media_type=response.media_type
-        )
+            logger.info("%s %s %s %.2fms", fields["method"], path, status, duration_ms,
+                        extra={"http": fields})
+
+
+# Bodies are cut at body_max_bytes, possibly mid-character
+def _decode(body: bytes) -> str:
+    return body.decode("utf-8", errors="replace")
 
 
 def add_logging_middleware(app):
     """
-    Registers the custom LoggingMiddleware to FastAPI app.
+    Registers the AccessLogMiddleware to FastAPI app.
     """
-    app.add_middleware(LoggingMiddleware)
+    app.add_middleware(
+        AccessLogMiddleware,
+        body_paths=settings.ACCESS_LOG_BODY_PATHS,
+        body_min_status=settings.ACCESS_LOG_BODY_MIN_STATUS,
+        body_sample_rate=settings.ACCESS_LOG_BODY_SAMPLE_RATE,
+        body_max_bytes=settings.ACCESS_LOG_BODY_MAX_BYTES,
+    )
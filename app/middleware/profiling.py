@@ -0,0 +1,190 @@
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.setting import settings
+
+logger = logging.getLogger(__name__)
+
+# Request header carrying PROFILE_SECRET
+PROFILE_HEADER = b"x-profile"
+
+
+@dataclass
+class DBTimings:
+    """
+    Time spent in SQL statements during one request, per statement text.
+    """
+    queries: int = 0
+    seconds: float = 0.0
+    statements: dict = field(default_factory=dict)  # statement -> [count, seconds]
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.seconds += seconds
+        entry = self.statements.setdefault(statement, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+# Set while a profiled request runs; SQLAlchemy carries it into its greenlets
+_db_timings: ContextVar[Optional[DBTimings]] = ContextVar("db_timings", default=None)
+
+
+# Adds statement timings of `engine` to the DBTimings of the profiled request, if any
+def instrument_db_timings(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _db_timings.get() is not None:
+            conn.info["profile_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timings = _db_timings.get()
+        started = conn.info.pop("profile_started", None)
+        if timings is not None and started is not None:
+            timings.add(statement, time.perf_counter() - started)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests sent with the `secret` in the X-Profile header, plus a
+    `sample_rate` fraction of all requests, with cProfile. Each profile is saved
+    to `profile_dir` as a .prof file (for pstats or snakeviz) with a .json
+    summary of the time spent in SQL statements; profiled responses carry a
+    Server-Timing header with the same DB totals.
+
+    cProfile sees the whole event loop thread, so the profile also contains
+    whatever other requests ran concurrently. Only one request is profiled at a
+    time; others that would be profiled meanwhile are served normally.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            secret: Optional[str] = None,
+            sample_rate: float = 0.0,
+            profile_dir: str = "profiles",
+            max_files: int = 200,
+    ):
+        self.app = app
+        self.secret = secret.encode("utf-8") if secret else None
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.max_files = max_files
+        self._active = False
+
+    def _wants_profile(self, scope: Scope) -> bool:
+        if self.secret is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.secret):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self._active or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        timings = DBTimings()
+        token = _db_timings.set(timings)
+        profile = cProfile.Profile()
+        status = 500  # Reported if the app fails before starting a response
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                server_timing = (
+                    f'db;dur={timings.seconds * 1000:.2f};desc="{timings.queries} queries", '
+                    f"app;dur={(time.perf_counter() - started) * 1000:.2f}"
+                )
+                message = {**message, "headers": [*message.get("headers", []),
+                                                   (b"server-timing", server_timing.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profile.disable()
+        finally:
+            duration = time.perf_counter() - started
+            _db_timings.reset(token)
+            self._active = False
+            summary = {
+                "timestamp": datetime.now(tz=UTC).isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status_code": status,
+                "duration_ms": round(duration * 1000, 3),
+                "db_queries": timings.queries,
+                "db_ms": round(timings.seconds * 1000, 3),
+                "statements": sorted(
+                    ({"statement": statement, "count": count, "ms": round(seconds * 1000, 3)}
+                     for statement, (count, seconds) in timings.statements.items()),
+                    key=lambda entry: entry["ms"], reverse=True,
+                ),
+            }
+            try:
+                path = await asyncio.to_thread(self._save, profile, summary)
+            except OSError:
+                logger.exception("Failed to save request profile")
+            else:
+                logger.info("Profiled %s %s (%.1fms, %.1fms in %d queries): %s", scope["method"],
+                            scope["path"], duration * 1000, timings.seconds * 1000, timings.queries, path)
+
+    def _save(self, profile: cProfile.Profile, summary: dict) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", summary["path"]).strip("_")[:60] or "root"
+        name = f"{datetime.now(tz=UTC):%Y%m%dT%H%M%S%f}-{summary['method']}-{slug}-{uuid.uuid4().hex[:8]}"
+        base = os.path.join(self.profile_dir, name)
+        profile.dump_stats(f"{base}.prof")
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+        # Keep only the newest profiles (names start with their timestamp)
+        profiles = sorted(entry for entry in os.listdir(self.profile_dir) if entry.endswith(".prof"))
+        for old in profiles[:-self.max_files]:
+            for suffix in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, old[:-len(".prof")] + suffix))
+                except FileNotFoundError:
+                    pass
+        return f"{base}.prof"
+
+
+def add_profiling_middleware(app, engine: AsyncEngine):
+    """
+    Registers the ProfilingMiddleware to FastAPI app, if a profiling trigger is configured.
+    """
+    if not settings.PROFILE_SECRET and not settings.PROFILE_SAMPLE_RATE:
+        return
+    instrument_db_timings(engine)
+    app.add_middleware(
+        ProfilingMiddleware,
+        secret=settings.PROFILE_SECRET,
+        sample_rate=settings.PROFILE_SAMPLE_RATE,
+        profile_dir=settings.PROFILE_DIR,
+        max_files=settings.PROFILE_MAX_FILES,
+    )
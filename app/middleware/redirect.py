@@ -0,0 +1,131 @@
+import time
+from functools import lru_cache
+from urllib.parse import quote
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.api.redirects import redirect_headers, redirect_mode
+from app.api.routes import redirect_rate_limit, router
+from app.core.metrics import http_request_duration, redirect_cache_lookups, redirects
+from app.core.rate_limit import RateLimit
+from app.core.setting import settings
+from app.db.cache import MISSING, TieredRedirectCache, redirect_cache
+from app.db.visits import VisitRecorder, anonymize_ip, visit_recorder
+
+# Route template the fast path answers for, as labelled by the MetricsMiddleware
+REDIRECT_ROUTE = "/api/v1/{short_code}/"
+
+
+# Response headers of a redirect to `url`, encoded once per distinct link; the
+# Location value is quoted exactly like Starlette's RedirectResponse does
+@lru_cache(maxsize=max(settings.REDIRECT_CACHE_MAX_SIZE, 1))
+def encoded_redirect_headers(url: str, status: int, max_age: int) -> tuple[tuple[bytes, bytes], ...]:
+    location = quote(url, safe=":/%#?=@[]!$&'()*+,;")
+    return (
+        (b"content-length", b"0"),
+        (b"location", location.encode("latin-1")),
+        *((name.encode("latin-1"), value.encode("latin-1"))
+          for name, value in redirect_headers(url, status, max_age)),
+    )
+
+
+class RedirectFastPathMiddleware:
+    """
+    Serves redirects for short codes in the worker's redirect cache (L1) straight
+    from the ASGI scope, ahead of the router and every middleware but the access
+    logger: no dependency resolution, validation or Response object, and the
+    encoded headers are reused. The visit is queued with the background visit writer.
+
+    Everything else falls through to the app unchanged: cache misses, cached
+    404s and expired links, paths of other routes under `prefix` (`reserved`
+    first segments), requests with an Origin header (which need CORS headers)
+    or an If-None-Match header (which may be answered with 304), rate-limited
+    clients (which get the app's 429) and visits the writer doesn't take.
+    Fast-path redirects are counted in the metrics by the middleware itself.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            cache: TieredRedirectCache,
+            recorder: VisitRecorder,
+            rate_limit: RateLimit,
+            prefix: str = "/api/v1/",
+            reserved: frozenset[str] = frozenset(),
+    ):
+        self.app = app
+        self.cache = cache
+        self.recorder = recorder
+        self.rate_limit = rate_limit
+        self.prefix = prefix
+        self.reserved = reserved
+        self._hits = redirects.labels("hit")
+        self._l1_hits = redirect_cache_lookups.labels("l1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "GET" and await self._serve(scope, send):
+            return
+        await self.app(scope, receive, send)
+
+    async def _serve(self, scope: Scope, send: Send) -> bool:
+        started = time.perf_counter()
+        path = scope["path"]
+        if not path.startswith(self.prefix) or not path.endswith("/"):
+            return False
+        code = path[len(self.prefix):-1]
+        if not code or "/" in code or code in self.reserved:
+            return False
+
+        # Peek so that requests falling through aren't counted twice by the cache stats
+        url = self.cache.local.peek(code)  # CachedURL, None (cached 404) or MISSING
+        if url is None or url is MISSING or url.expired():
+            return False
+        for name, _ in scope["headers"]:
+            if name == b"origin" or name == b"if-none-match":
+                return False
+
+        if not self.recorder.running:
+            return False
+
+        client = scope.get("client")
+        ip = client[0] if client else None
+        if await self.rate_limit.acquire(ip or "unknown") > 0:
+            return False
+        if not await self.recorder.submit(url.id, anonymize_ip(ip, settings.VISIT_IP_MODE,
+                                                               settings.VISIT_IP_HASH_KEY)):
+            # Stopped meanwhile; the app serves the request on the token taken here
+            self.rate_limit.mark_charged(scope)
+            return False
+
+        status, max_age = redirect_mode(url)
+        headers = encoded_redirect_headers(url.original_url, status, max_age)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        self.cache.local.get(code)  # counts the hit and refreshes the LRU position
+        self._l1_hits.inc()
+        self._hits.inc()
+        http_request_duration.labels("GET", REDIRECT_ROUTE, str(status)).observe(time.perf_counter() - started)
+        return True
+
+
+def add_redirect_fast_path(app):
+    """
+    Registers the RedirectFastPathMiddleware to FastAPI app, outside all middleware
+    added before it, reserving the first path segments of the API's literal routes.
+    """
+    if not settings.REDIRECT_FAST_PATH_ENABLED:
+        return
+    prefix = router.prefix + "/"
+    reserved = frozenset(
+        segment
+        for route in router.routes
+        if (segment := route.path[len(prefix):].split("/", 1)[0]) and "{" not in segment
+    )
+    app.add_middleware(
+        RedirectFastPathMiddleware,
+        cache=redirect_cache,
+        recorder=visit_recorder,
+        rate_limit=redirect_rate_limit,
+        prefix=prefix,
+        reserved=reserved,
+    )
@@ -1,4 +1,10 @@
-from pydantic import BaseModel, HttpUrl, Field
+from datetime import datetime, UTC
+from typing import Literal, Optional
+
+from pydantic import BaseModel, HttpUrl, Field, field_validator
+
+from app.core.setting import settings
+from app.db.rollups import Granularity
 
 
 class HealthCheckResponse(BaseModel):
@@ -12,6 +18,41 @@ class HealthCheckResponse(BaseModel):
     )
 
 
+class PoolStatsResponse(BaseModel):
+    """
+    Response model for the database connection pool usage of this worker.
+    """
+    pool_class: str = Field(
+        ...,
+        json_schema_extra={"example": "AsyncAdaptedQueuePool", },
+        description="SQLAlchemy pool implementation; pools without sizing report nothing else."
+    )
+    size: Optional[int] = Field(
+        None,
+        description="Configured number of pooled connections."
+    )
+    max_overflow: Optional[int] = Field(
+        None,
+        description="Connections allowed beyond the pool size."
+    )
+    checked_in: Optional[int] = Field(
+        None,
+        description="Idle connections in the pool."
+    )
+    checked_out: Optional[int] = Field(
+        None,
+        description="Connections currently in use."
+    )
+    overflow: Optional[int] = Field(
+        None,
+        description="Overflow connections currently open."
+    )
+    timeout: Optional[float] = Field(
+        None,
+        description="Seconds a checkout waits for a free connection."
+    )
+
+
 class URLCreateRequestBody(BaseModel):
     """
     Request body for shortening a new URL.
@@ -21,6 +62,45 @@ class URLCreateRequestBody(BaseModel):
         json_schema_extra={"example": "https://example.com/long/url/to/be/shortened", },
         description="The original URL that needs to be shortened."
     )
+    redirect_status: Optional[Literal[301, 302, 307, 308]] = Field(
+        None,
+        json_schema_extra={"example": 308, },
+        description=(
+            "Redirect status for this link: 301 or 308 let browsers and CDNs cache the redirect, "
+            "so repeat clicks aren't counted; 302 or 307 count every click. Defaults to the "
+            "server's REDIRECT_STATUS. Ignored if the URL was already shortened."
+        )
+    )
+    redirect_max_age: Optional[int] = Field(
+        None,
+        ge=0,
+        json_schema_extra={"example": 86400, },
+        description="Seconds a cacheable (301/308) redirect may be reused; defaults to REDIRECT_MAX_AGE."
+    )
+    expires_at: Optional[datetime] = Field(
+        None,
+        json_schema_extra={"example": "2026-12-31T23:59:59Z", },
+        description=(
+            "When the link stops redirecting (answered with 410); defaults to never. Links with "
+            "an expiry or click limit always get their own short code."
+        )
+    )
+    max_clicks: Optional[int] = Field(
+        None,
+        ge=1,
+        json_schema_extra={"example": 1000, },
+        description=(
+            "Number of visits after which the link expires. Visits are counted when the visit writer "
+            "flushes, so the link may be followed for up to VISIT_FLUSH_INTERVAL seconds past the limit."
+        )
+    )
+
+    @field_validator("expires_at")
+    @classmethod
+    def expires_in_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is not None and (value if value.tzinfo else value.replace(tzinfo=UTC)) <= datetime.now(tz=UTC):
+            raise ValueError("expires_at must be in the future")
+        return value
 
 
 class URLResponse(BaseModel):
@@ -45,3 +125,88 @@ class URLStatsResponse(BaseModel):
         json_schema_extra={"example": 42, },
         description="Number of times this short URL has been visited."
     )
+
+
+class StatsBatchRequestBody(BaseModel):
+    """
+    Request body for the statistics of many short URLs at once.
+    """
+    short_codes: list[str] = Field(
+        ...,
+        min_length=1,
+        max_length=settings.STATS_BATCH_MAX_CODES,
+        json_schema_extra={"example": ["abc123", "wefwrwrf"], },
+        description="Short codes to get statistics for; duplicates are reported once."
+    )
+
+
+class StatsBatchEntry(BaseModel):
+    """
+    Statistics of one short URL in a batch, or why there are none.
+    """
+    short_code: str = Field(
+        ...,
+        description="The requested short code."
+    )
+    visits: Optional[int] = Field(
+        None,
+        json_schema_extra={"example": 42, },
+        description="Number of visits, if the short code exists."
+    )
+    status: int = Field(
+        ...,
+        json_schema_extra={"example": 200, },
+        description="200, or 404 if the short code doesn't exist."
+    )
+    error: Optional[str] = Field(
+        None,
+        description="Reason the short code has no statistics."
+    )
+
+
+class StatsBatchResponse(BaseModel):
+    """
+    Response model for batch statistics, in request order.
+    """
+    stats: list[StatsBatchEntry] = Field(
+        ...,
+        description="One entry per distinct requested short code."
+    )
+
+
+class VisitBucket(BaseModel):
+    """
+    Number of visits in a single time bucket.
+    """
+    start: datetime = Field(
+        ...,
+        json_schema_extra={"example": "2025-06-12T08:00:00Z", },
+        description="Start of the bucket (UTC)."
+    )
+    visits: int = Field(
+        ...,
+        json_schema_extra={"example": 17, },
+        description="Number of visits recorded in the bucket."
+    )
+
+
+class URLTimeseriesResponse(BaseModel):
+    """
+    Response model for time-bucketed visit statistics of a shortened URL.
+    """
+    granularity: Granularity = Field(
+        ...,
+        description="Bucket size used for the series."
+    )
+    start: datetime = Field(
+        ...,
+        description="Start of the first bucket (UTC, inclusive)."
+    )
+    end: datetime = Field(
+        ...,
+        description="End of the requested range (UTC, exclusive)."
+    )
+    buckets: list[VisitBucket] = Field(
+        ...,
+        description="Visits per bucket, oldest first, with empty buckets included."
+    )
@@ -0,0 +1,251 @@
+"""
+Load-testing harness for the redirect, shorten and stats endpoints.
+
+Drives the ASGI app either in-process (httpx ASGITransport, no network) or over
+HTTP against a real uvicorn server it starts itself, with a configurable number
+of concurrent clients. Short codes are picked from a Zipfian distribution (a few
+hot codes, a long cold tail) or uniformly.
+
+Reports requests/s and p50/p95/p99 latency per endpoint and writes them, along
+with the run configuration, to a JSON file that later runs can be compared with.
+
+    python -m benchmarks.load --mode inprocess --duration 10 --concurrency 32
+    python -m benchmarks.load --mode uvicorn --workers 4 --dsn postgresql+asyncpg://...
+    python -m benchmarks.load --output new.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import bisect
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, UTC
+from typing import Optional
+
+import httpx
+
+ENDPOINTS = ("redirect", "shorten", "stats")
+
+
+# Samples ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s
+class ZipfSampler:
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+
+
+class UniformSampler:
+    def __init__(self, n: int, rng: random.Random):
+        self.n = n
+        self.rng = rng
+
+    def sample(self) -> int:
+        return self.rng.randrange(self.n)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r} in --mix")
+        weights[name] = float(weight)
+    return weights
+
+
+# Creates the URLs whose short codes the run requests, through the bulk endpoint
+async def seed(client: httpx.AsyncClient, count: int) -> list[str]:
+    body = "".join(json.dumps(f"https://bench.example/seed/{i}") + "\n" for i in range(count))
+    response = await client.post(
+        "/api/v1/shorten/bulk/", content=body, headers={"Content-Type": "application/x-ndjson"}, timeout=300,
+    )
+    response.raise_for_status()
+    codes = [json.loads(line)["short_code"] for line in response.text.splitlines()]
+    if len(codes) != count:
+        raise RuntimeError(f"Seeding created {len(codes)} of {count} URLs")
+    return codes
+
+
+async def run_load(client: httpx.AsyncClient, codes: list[str], args) -> dict:
+    rng = random.Random(args.seed)
+    sampler = ZipfSampler(len(codes), args.zipf_s, rng) if args.distribution == "zipf" \
+        else UniformSampler(len(codes), rng)
+    endpoints, weights = zip(*args.mix.items())
+    latencies = {name: [] for name in endpoints}
+    errors = {name: 0 for name in endpoints}
+    deadline = time.perf_counter() + args.duration
+
+    async def one_request(endpoint: str) -> None:
+        if endpoint == "redirect":
+            request = client.get(f"/api/v1/{codes[sampler.sample()]}/", follow_redirects=False)
+            expected = (302, 307)
+        elif endpoint == "stats":
+            request = client.get(f"/api/v1/{codes[sampler.sample()]}/stats/")
+            expected = (200,)
+        else:
+            request = client.post("/api/v1/shorten/", json={"original_url": f"https://bench.example/{uuid.uuid4()}"})
+            expected = (201,)
+
+        started = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code in expected
+        except httpx.HTTPError:
+            ok = False
+        latencies[endpoint].append(time.perf_counter() - started)
+        if not ok:
+            errors[endpoint] += 1
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            await one_request(rng.choices(endpoints, weights)[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in endpoints:
+        values = sorted(latencies[name])
+        results[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    results["total"] = {
+        "requests": sum(len(v) for v in latencies.values()),
+        "errors": sum(errors.values()),
+        "rps": round(sum(len(v) for v in latencies.values()) / elapsed, 1),
+    }
+    return results
+
+
+@contextlib.asynccontextmanager
+async def inprocess_client():
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+@contextlib.asynccontextmanager
+async def uvicorn_client(args, env: dict):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            for _ in range(100):
+                with contextlib.suppress(httpx.HTTPError):
+                    if (await client.get("/api/v1/health/ready/")).status_code == 200:
+                        break
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not become ready")
+            yield client
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def git_revision() -> Optional[str]:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    return None
+
+
+def print_results(results: dict, baseline: Optional[dict]) -> None:
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results.items():
+        print(f"{name:<10} {row['requests']:>9} {row['errors']:>7} {row['rps']:>9}"
+              + "".join(f" {row[key]:>9}" for key in ("p50_ms", "p95_ms", "p99_ms") if key in row))
+        if baseline and name in baseline:
+            deltas = []
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+                if key in row and baseline[name].get(key):
+                    deltas.append(f"{key} {(row[key] / baseline[name][key] - 1) * 100:+.1f}%")
+            print(f"{'':<10} vs baseline: {', '.join(deltas)}")
+
+
+async def main(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="url-shortener-bench-")
+    dsn = args.dsn or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Settings are read at import time, by this process or the uvicorn workers
+    env = {**os.environ, "PG_DSN": dsn, "WEB_CONCURRENCY": str(args.workers), "LOG_DIR": os.path.join(workdir, "logs"), "LOG_LEVEL": "WARNING",
+           "DB_ECHO": "false", "RATE_LIMIT_ENABLED": "false", "VISIT_SPILL_PATH": os.path.join(workdir, "visits.spill.ndjson")}
+    os.environ.update(env)
+
+    client_context = inprocess_client() if args.mode == "inprocess" else uvicorn_client(args, env)
+    async with client_context as client:
+        codes = await seed(client, args.urls)
+        results = await run_load(client, codes, args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.now(tz=UTC).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+                      | {"dsn": dsn.split("@")[-1]},  # Without credentials
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--dsn", help="Database to run against (default: a temporary SQLite file)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--urls", type=int, default=10_000, help="Short codes created before the run")
+    parser.add_argument("--mix", type=parse_mix, default="redirect=90,shorten=5,stats=5",
+                        help="Relative weights per endpoint")
+    parser.add_argument("--distribution", choices=["zipf", "uniform"], default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent; higher means hotter keys")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Print differences against a previous results file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the redirect lookup: ORM entity loading versus the Core-SQL
+fast path in ``crud.get_redirect_target``.
+
+Runs against an in-memory SQLite database so the numbers are dominated by the
+Python-side cost per lookup (statement handling, row processing, hydration).
+
+    python -m benchmarks.redirect_lookup [--rows 10000] [--lookups 20000]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import crud
+from app.db.cache import CachedURL
+from app.db.models import URL, url_digest, utcnow
+
+
+# The lookup as it was before the fast path: a full URL entity per redirect
+async def orm_lookup(code: str, session: AsyncSession):
+    url = (await session.exec(select(URL).where(URL.short_code == code))).first()
+    return CachedURL.from_model(url) if url else None
+
+
+async def core_lookup(code: str, session: AsyncSession):
+    return await crud.get_redirect_target(code, session)
+
+
+async def measure(lookup, codes: list[str], session_maker) -> dict:
+    # One session per lookup, like one request per redirect
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for code in codes:
+        async with session_maker() as session:
+            assert await lookup(code, session) is not None
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    return {"cpu_us": cpu / len(codes) * 1e6, "wall_us": wall / len(codes) * 1e6}
+
+
+async def main(rows: int, lookups: int) -> None:
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        now = utcnow()
+        await conn.execute(URL.__table__.insert(), [
+            {
+                "original_url": f"https://example.com/{i}",
+                "original_url_digest": url_digest(f"https://example.com/{i}"),
+                "short_code": f"code{i:06d}",
+                "created_at": now,
+                "visit_count": 0,
+            }
+            for i in range(rows)
+        ])
+
+    session_maker = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    codes = [f"code{random.randrange(rows):06d}" for _ in range(lookups)]
+
+    # Warm up connections and statement caches
+    for lookup in (orm_lookup, core_lookup):
+        await measure(lookup, codes[:500], session_maker)
+
+    results = {name: await measure(lookup, codes, session_maker)
+               for name, lookup in (("orm", orm_lookup), ("core", core_lookup))}
+    await engine.dispose()
+
+    for name, result in results.items():
+        print(f"{name:>5}: {result['cpu_us']:8.1f} us CPU/lookup  {result['wall_us']:8.1f} us wall/lookup")
+    print(f"speedup (CPU): {results['orm']['cpu_us'] / results['core']['cpu_us']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.redirect_lookup")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.lookups))
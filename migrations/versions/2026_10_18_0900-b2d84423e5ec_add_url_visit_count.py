@@ -0,0 +1,47 @@
+"""Add url.visit_count
+
+Revision ID: b2d84423e5ec
+Revises: b8f26a9ee92f
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d84423e5ec'
+down_revision: Union[str, None] = 'b8f26a9ee92f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Number of url ids backfilled per statement, to keep row locks short
+BACKFILL_CHUNK_SIZE = 10_000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.add_column(sa.Column('visit_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counter from the raw visit rows, committing one id range at a time
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text("SELECT MAX(id) FROM url")).scalar()
+    with op.get_context().autocommit_block():
+        for start in range(0, (max_id or 0) + 1, BACKFILL_CHUNK_SIZE):
+            bind.execute(
+                sa.text(
+                    "UPDATE url SET visit_count = ("
+                    "  SELECT COUNT(*) FROM url_visit WHERE url_visit.url_id = url.id"
+                    ") WHERE url.id >= :start AND url.id < :end"
+                ),
+                {"start": start, "end": start + BACKFILL_CHUNK_SIZE},
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.drop_column('visit_count')
@@ -0,0 +1,77 @@
+"""Add url_visit_rollup
+
+Revision ID: 34f13cb3141c
+Revises: b2d84423e5ec
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '34f13cb3141c'
+down_revision: Union[str, None] = 'b2d84423e5ec'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Minute buckets are only backfilled for the default minute-rollup retention
+MINUTE_BACKFILL_DAYS = 2
+
+# Bucket truncation per dialect; SQLite stores datetimes as text in SQLAlchemy's format
+BUCKET_EXPRESSIONS = {
+    "postgresql": {
+        "minute": "date_trunc('minute', timestamp)",
+        "hour": "date_trunc('hour', timestamp)",
+        "day": "date_trunc('day', timestamp)",
+    },
+    "sqlite": {
+        "minute": "strftime('%Y-%m-%d %H:%M:00.000000', timestamp)",
+        "hour": "strftime('%Y-%m-%d %H:00:00.000000', timestamp)",
+        "day": "strftime('%Y-%m-%d 00:00:00.000000', timestamp)",
+    },
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('url_visit_rollup',
+                    sa.Column('url_id', sa.Integer(), nullable=False),
+                    sa.Column('granularity', sqlmodel.sql.sqltypes.AutoString(length=8), nullable=False),
+                    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+                    sa.Column('visits', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['url_id'], ['url.id'], ),
+                    sa.PrimaryKeyConstraint('url_id', 'granularity', 'bucket_start')
+                    )
+    op.create_index('ix_url_visit_rollup_granularity_bucket_start', 'url_visit_rollup',
+                    ['granularity', 'bucket_start'], unique=False)
+
+    # Backfill rollups from the existing raw visits
+    bind = op.get_bind()
+    expressions = BUCKET_EXPRESSIONS.get(bind.dialect.name)
+    if expressions is None:
+        raise NotImplementedError(f"No bucket expressions for dialect {bind.dialect.name!r}")
+
+    for granularity, expression in expressions.items():
+        where = ""
+        if granularity == "minute":
+            cutoff = (
+                f"now() - interval '{MINUTE_BACKFILL_DAYS} days'"
+                if bind.dialect.name == "postgresql"
+                else f"datetime('now', '-{MINUTE_BACKFILL_DAYS} days')"
+            )
+            where = f"WHERE timestamp >= {cutoff}"
+        bind.execute(sa.text(
+            "INSERT INTO url_visit_rollup (url_id, granularity, bucket_start, visits) "
+            f"SELECT url_id, '{granularity}', {expression}, COUNT(*) FROM url_visit {where} "
+            f"GROUP BY url_id, {expression}"
+        ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_url_visit_rollup_granularity_bucket_start', table_name='url_visit_rollup')
+    op.drop_table('url_visit_rollup')
@@ -0,0 +1,41 @@
+"""Add short_code_sequence and short_code_pool
+
+Revision ID: bcef2cf4c45f
+Revises: 34f13cb3141c
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bcef2cf4c45f'
+down_revision: Union[str, None] = '34f13cb3141c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('short_code_sequence',
+                    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+                    sa.Column('next_value', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('name')
+                    )
+    op.create_table('short_code_pool',
+                    sa.Column('code', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+                    sa.Column('reserved_at', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('code')
+                    )
+    op.create_index(op.f('ix_short_code_pool_reserved_at'), 'short_code_pool', ['reserved_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_short_code_pool_reserved_at'), table_name='short_code_pool')
+    op.drop_table('short_code_pool')
+    op.drop_table('short_code_sequence')
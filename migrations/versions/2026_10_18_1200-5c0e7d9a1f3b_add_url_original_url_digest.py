@@ -0,0 +1,68 @@
+"""Add url.original_url_digest
+
+Revision ID: 5c0e7d9a1f3b
+Revises: bcef2cf4c45f
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c0e7d9a1f3b'
+down_revision: Union[str, None] = 'bcef2cf4c45f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Number of url ids backfilled per statement, to keep row locks short
+BACKFILL_CHUNK_SIZE = 10_000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.add_column(sa.Column('original_url_digest', sa.LargeBinary(length=32), nullable=True))
+
+    # Backfill the digest one id range at a time; must match app.db.models.url_digest
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text("SELECT MAX(id) FROM url")).scalar()
+    with op.get_context().autocommit_block():
+        for start in range(0, (max_id or 0) + 1, BACKFILL_CHUNK_SIZE):
+            bounds = {"start": start, "end": start + BACKFILL_CHUNK_SIZE}
+            if bind.dialect.name == "postgresql":
+                bind.execute(
+                    sa.text(
+                        "UPDATE url SET original_url_digest = sha256(convert_to(original_url, 'UTF8')) "
+                        "WHERE id >= :start AND id < :end"
+                    ),
+                    bounds,
+                )
+                continue
+
+            rows = bind.execute(
+                sa.text("SELECT id, original_url FROM url WHERE id >= :start AND id < :end"),
+                bounds,
+            ).all()
+            if rows:
+                bind.execute(
+                    sa.text("UPDATE url SET original_url_digest = :digest WHERE id = :id"),
+                    [{"id": id_, "digest": hashlib.sha256(url.encode("utf-8")).digest()} for id_, url in rows],
+                )
+
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.alter_column('original_url_digest', existing_type=sa.LargeBinary(length=32), nullable=False)
+        batch_op.create_index(batch_op.f('ix_url_original_url_digest'), ['original_url_digest'], unique=True)
+        # The digest index replaces the unique index on the unbounded URL text
+        batch_op.drop_index(batch_op.f('ix_url_original_url'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.create_index(batch_op.f('ix_url_original_url'), ['original_url'], unique=True)
+        batch_op.drop_index(batch_op.f('ix_url_original_url_digest'))
+        batch_op.drop_column('original_url_digest')
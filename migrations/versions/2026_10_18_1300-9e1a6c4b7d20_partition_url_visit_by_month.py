@@ -0,0 +1,121 @@
+"""Partition url_visit by month
+
+Revision ID: 9e1a6c4b7d20
+Revises: 5c0e7d9a1f3b
+Create Date: 2026-10-18 13:00:00.000000
+
+On PostgreSQL, url_visit is rebuilt as a table range-partitioned by timestamp, with
+one partition per month (app/db/partitions.py creates later ones) and a default
+partition. The primary key becomes (id, timestamp), as a partitioned table needs
+the partition key in every unique constraint; ids still come from url_visit_id_seq.
+Existing rows are copied in id chunks. Run it while visit traffic is low: the old
+table stays locked until the migration commits.
+
+Every dialect swaps the url_id index for one on (url_id, timestamp).
+"""
+from datetime import datetime, UTC
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e1a6c4b7d20'
+down_revision: Union[str, None] = '5c0e7d9a1f3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows copied per statement
+COPY_CHUNK_SIZE = 50_000
+
+# Months of partitions created ahead of the current one
+PREMAKE_MONTHS = 3
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _copy_rows(bind, source: str, target: str) -> None:
+    last_id = 0
+    while True:
+        chunk_end = bind.execute(sa.text(
+            f"SELECT MAX(id) FROM (SELECT id FROM {source} WHERE id > :last_id ORDER BY id LIMIT :size) AS chunk"
+        ), {"last_id": last_id, "size": COPY_CHUNK_SIZE}).scalar()
+        if chunk_end is None:
+            return
+        bind.execute(sa.text(
+            f"INSERT INTO {target} SELECT * FROM {source} WHERE id > :last_id AND id <= :chunk_end"
+        ), {"last_id": last_id, "chunk_end": chunk_end})
+        last_id = chunk_end
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        with op.batch_alter_table('url_visit') as batch_op:
+            batch_op.drop_index('ix_url_visit_url_id')
+            batch_op.create_index('ix_url_visit_url_id_timestamp', ['url_id', 'timestamp'], unique=False)
+        return
+
+    # Free the names for the partitioned table
+    op.execute("ALTER TABLE url_visit RENAME TO url_visit_unpartitioned")
+    op.execute("ALTER TABLE url_visit_unpartitioned RENAME CONSTRAINT url_visit_pkey TO url_visit_unpartitioned_pkey")
+    op.execute("ALTER TABLE url_visit_unpartitioned "
+               "RENAME CONSTRAINT url_visit_url_id_fkey TO url_visit_unpartitioned_url_id_fkey")
+    op.execute("ALTER INDEX ix_url_visit_url_id RENAME TO ix_url_visit_unpartitioned_url_id")
+
+    op.execute("""
+        CREATE TABLE url_visit (
+            LIKE url_visit_unpartitioned INCLUDING DEFAULTS,
+            CONSTRAINT url_visit_pkey PRIMARY KEY (id, timestamp),
+            CONSTRAINT url_visit_url_id_fkey FOREIGN KEY (url_id) REFERENCES url (id)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    op.create_index('ix_url_visit_url_id_timestamp', 'url_visit', ['url_id', 'timestamp'], unique=False)
+    op.execute("CREATE TABLE url_visit_default PARTITION OF url_visit DEFAULT")
+
+    # One partition per month from the oldest visit to a few months ahead
+    current = datetime.now(tz=UTC).replace(tzinfo=None, day=1, hour=0, minute=0, second=0, microsecond=0)
+    oldest = bind.execute(sa.text("SELECT date_trunc('month', MIN(timestamp)) FROM url_visit_unpartitioned")).scalar()
+    month = min(oldest or current, current)
+    while month <= _add_months(current, PREMAKE_MONTHS):
+        op.execute(
+            f"CREATE TABLE url_visit_p{month:%Y_%m} PARTITION OF url_visit "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+        )
+        month = _add_months(month, 1)
+
+    _copy_rows(bind, "url_visit_unpartitioned", "url_visit")
+    op.execute("ALTER SEQUENCE url_visit_id_seq OWNED BY url_visit.id")
+    op.execute("DROP TABLE url_visit_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        with op.batch_alter_table('url_visit') as batch_op:
+            batch_op.drop_index('ix_url_visit_url_id_timestamp')
+            batch_op.create_index('ix_url_visit_url_id', ['url_id'], unique=False)
+        return
+
+    op.execute("ALTER TABLE url_visit RENAME TO url_visit_partitioned")
+    op.execute("ALTER TABLE url_visit_partitioned RENAME CONSTRAINT url_visit_pkey TO url_visit_partitioned_pkey")
+    op.execute("ALTER TABLE url_visit_partitioned "
+               "RENAME CONSTRAINT url_visit_url_id_fkey TO url_visit_partitioned_url_id_fkey")
+
+    op.execute("""
+        CREATE TABLE url_visit (
+            LIKE url_visit_partitioned INCLUDING DEFAULTS,
+            CONSTRAINT url_visit_pkey PRIMARY KEY (id),
+            CONSTRAINT url_visit_url_id_fkey FOREIGN KEY (url_id) REFERENCES url (id)
+        )
+    """)
+    _copy_rows(bind, "url_visit_partitioned", "url_visit")
+    op.create_index('ix_url_visit_url_id', 'url_visit', ['url_id'], unique=False)
+    op.execute("ALTER SEQUENCE url_visit_id_seq OWNED BY url_visit.id")
+    op.execute("DROP TABLE url_visit_partitioned")
@@ -0,0 +1,144 @@
+"""Compact url_visit rows
+
+Revision ID: d41f7a2c8b63
+Revises: 9e1a6c4b7d20
+Create Date: 2026-10-18 14:00:00.000000
+
+Stores url_visit.ip_address as 4 or 16 packed bytes instead of text and drops
+created_at, which always equalled timestamp. The IPs are converted into a new
+column one id range at a time, each range committed on its own (in SQL on
+PostgreSQL), so the table is never locked for the whole rewrite. Visits recorded
+meanwhile are converted with writes blocked, in the transaction that swaps the
+columns, which only changes the catalog. Existing IPs are kept in full whatever
+VISIT_IP_MODE is.
+"""
+import ipaddress
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f7a2c8b63'
+down_revision: Union[str, None] = '9e1a6c4b7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Number of url_visit ids converted per transaction
+BACKFILL_CHUNK_SIZE = 10_000
+
+
+# Must match app.db.models.PackedIP
+def _pack(ip: Optional[str]) -> Optional[bytes]:
+    try:
+        return ipaddress.ip_address(ip).packed if ip else None
+    except ValueError:
+        return None
+
+
+def _unpack(value: Optional[bytes]) -> Optional[str]:
+    if value is None or len(value) not in (4, 16):
+        return bytes(value).hex() if value is not None else None
+    return str(ipaddress.ip_address(bytes(value)))
+
+
+# PostgreSQL versions of _pack and _unpack, applied to a whole chunk at once. inet_send
+# gives the address bytes after a 4-byte header; text that isn't a single address is NULL.
+_PACK_FUNCTION = """
+CREATE OR REPLACE FUNCTION pg_temp.pack_ip(value text) RETURNS bytea LANGUAGE plpgsql AS $$
+BEGIN
+    IF value IS NULL OR position('/' IN value) > 0 THEN
+        RETURN NULL;
+    END IF;
+    RETURN substring(inet_send(CAST(value AS inet)) FROM 5);
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$
+"""
+_POSTGRESQL_CONVERSIONS = {
+    _pack: "pg_temp.pack_ip({source})",
+    _unpack: r"""CASE length({source})
+        WHEN 4 THEN host(CAST('0.0.0.0' AS inet) + CAST(CAST('x' || encode({source}, 'hex') AS bit(32)) AS bigint))
+        WHEN 16 THEN host(CAST(regexp_replace(encode({source}, 'hex'), '(.{{4}})(?!$)', '\1:', 'g') AS inet))
+        ELSE encode({source}, 'hex')
+    END""",
+}
+
+
+def _max_visit_id() -> int:
+    return op.get_bind().execute(sa.text("SELECT MAX(id) FROM url_visit")).scalar() or 0
+
+
+# Converts `source` into `target` for the url_visit ids in [first, last], one chunk at a time
+def _convert_ips(source: str, target: str, convert, first: int, last: int) -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        bind.execute(sa.text(_PACK_FUNCTION))
+    for start in range(first, last + 1, BACKFILL_CHUNK_SIZE):
+        bounds = {"start": start, "end": min(start + BACKFILL_CHUNK_SIZE, last + 1)}
+        if bind.dialect.name == "postgresql":
+            expression = _POSTGRESQL_CONVERSIONS[convert].format(source=source)
+            bind.execute(
+                sa.text(f"UPDATE url_visit SET {target} = {expression} "
+                        f"WHERE id >= :start AND id < :end AND {source} IS NOT NULL"),
+                bounds,
+            )
+            continue
+
+        rows = bind.execute(
+            sa.text(f"SELECT id, {source} FROM url_visit "
+                    f"WHERE id >= :start AND id < :end AND {source} IS NOT NULL"),
+            bounds,
+        ).all()
+        if rows:
+            bind.execute(
+                sa.text(f"UPDATE url_visit SET {target} = :value WHERE id = :id"),
+                [{"id": id_, "value": convert(value)} for id_, value in rows],
+            )
+
+
+# Converts the IPs while visits keep being recorded, then the visits recorded meanwhile
+# with writes blocked until the transaction swapping the columns commits
+def _convert_ips_online(source: str, target: str, convert) -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # Waits for inserts in flight, so every later visit gets an id above the snapshot
+        bind.execute(sa.text("LOCK TABLE url_visit IN SHARE MODE"))
+    snapshot = _max_visit_id()
+    with op.get_context().autocommit_block():
+        _convert_ips(source, target, convert, 0, snapshot)
+
+    if bind.dialect.name == "postgresql":
+        bind.execute(sa.text("LOCK TABLE url_visit IN EXCLUSIVE MODE"))
+    _convert_ips(source, target, convert, snapshot + 1, _max_visit_id())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('url_visit', sa.Column('ip_packed', sa.LargeBinary(length=16), nullable=True))
+    _convert_ips_online('ip_address', 'ip_packed', _pack)
+
+    with op.batch_alter_table('url_visit') as batch_op:
+        batch_op.drop_column('ip_address')
+        batch_op.drop_column('created_at')
+    with op.batch_alter_table('url_visit') as batch_op:
+        batch_op.alter_column('ip_packed', new_column_name='ip_address',
+                              existing_type=sa.LargeBinary(length=16), existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('url_visit', sa.Column('ip_text', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('url_visit', sa.Column('created_at', sa.DateTime(), nullable=True))
+    _convert_ips_online('ip_address', 'ip_text', _unpack)
+    op.execute("UPDATE url_visit SET created_at = timestamp")
+
+    with op.batch_alter_table('url_visit') as batch_op:
+        batch_op.drop_column('ip_address')
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+    with op.batch_alter_table('url_visit') as batch_op:
+        batch_op.alter_column('ip_text', new_column_name='ip_address',
+                              existing_type=sa.String(), existing_nullable=True)
@@ -0,0 +1,38 @@
+"""Add url.redirect_status and url.redirect_max_age
+
+Revision ID: 6b3e9f1d2a47
+Revises: d41f7a2c8b63
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b3e9f1d2a47'
+down_revision: Union[str, None] = 'd41f7a2c8b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable without a default, so adding them doesn't rewrite the table; null means
+    # the link follows the global REDIRECT_STATUS / REDIRECT_MAX_AGE
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.add_column(sa.Column('redirect_status', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('redirect_max_age', sa.Integer(), nullable=True))
+        batch_op.create_check_constraint('ck_url_redirect_status', 'redirect_status IN (301, 302, 307, 308)')
+        batch_op.create_check_constraint('ck_url_redirect_max_age', 'redirect_max_age >= 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.drop_constraint('ck_url_redirect_max_age', type_='check')
+        batch_op.drop_constraint('ck_url_redirect_status', type_='check')
+        batch_op.drop_column('redirect_max_age')
+        batch_op.drop_column('redirect_status')
@@ -0,0 +1,49 @@
+"""Add url.expires_at and url.max_clicks
+
+Revision ID: a7c2e5f83b19
+Revises: 6b3e9f1d2a47
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e5f83b19'
+down_revision: Union[str, None] = '6b3e9f1d2a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Links with an expiry or click limit have no digest, so they are never deduplicated
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('max_clicks', sa.Integer(), nullable=True))
+        batch_op.alter_column('original_url_digest', existing_type=sa.LargeBinary(length=32), nullable=True)
+
+    # Lets the sweeper find expired links; every existing row is null, so on PostgreSQL
+    # the index is built without blocking writes
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(op.f('ix_url_expires_at'), 'url', ['expires_at'], unique=False,
+                            postgresql_concurrently=True)
+    else:
+        op.create_index(op.f('ix_url_expires_at'), 'url', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    limited = op.get_bind().execute(sa.text("SELECT COUNT(*) FROM url WHERE original_url_digest IS NULL")).scalar()
+    if limited:
+        raise RuntimeError(f"{limited} link(s) with an expiry or click limit must be deleted before downgrading")
+
+    op.drop_index(op.f('ix_url_expires_at'), table_name='url')
+    with op.batch_alter_table('url') as batch_op:
+        batch_op.alter_column('original_url_digest', existing_type=sa.LargeBinary(length=32), nullable=False)
+        batch_op.drop_column('max_clicks')
+        batch_op.drop_column('expires_at')
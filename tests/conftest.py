@@ -0,0 +1,29 @@
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+
+@pytest_asyncio.fixture
+async def create_database(tmp_path_factory):
+    """Creates SQLite databases with the schema; returns an (engine, session factory) pair per call"""
+    directory = tmp_path_factory.mktemp("db")
+    engines = []
+
+    async def create(name="test"):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory / name}.db")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        engines.append(engine)
+        return engine, async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    yield create
+    for engine in engines:
+        await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session_factory(create_database):
+    """Session factory of a fresh database"""
+    _, factory = await create_database()
+    return factory
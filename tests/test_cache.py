@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import pytest
+
+from app.db.cache import MISSING, CachedURL, RedirectCache, TieredRedirectCache
+from app.db.cache_backends import InMemoryCacheBackend
+from app.db.code_filter import BloomFilter
+
+
+def test_miss_then_hit():
+    """Entries are returned after being set and counted as hits"""
+    cache = RedirectCache(max_size=10, ttl=60, negative_ttl=60)
+    assert cache.get("abc123") is MISSING
+
+    cache.set("abc123", CachedURL(id=1, original_url="https://example.com/"))
+    assert cache.get("abc123") == CachedURL(id=1, original_url="https://example.com/")
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_negative_entries():
+    """Unknown codes are cached as None, distinct from a miss"""
+    cache = RedirectCache(max_size=10, ttl=60, negative_ttl=60)
+    cache.set("nothere", None)
+    assert cache.get("nothere") is None
+
+    disabled = RedirectCache(max_size=10, ttl=60, negative_ttl=0)
+    disabled.set("nothere", None)
+    assert disabled.get("nothere") is MISSING
+
+
+def test_click_limited_links_are_not_kept():
+    """Links with a click limit are always looked up again, so no worker outlives their limit"""
+    cache = RedirectCache(max_size=10, ttl=60, negative_ttl=60)
+    cache.set("limited", CachedURL(id=1, original_url="https://example.com/", max_clicks=5))
+    assert cache.get("limited") is MISSING
+
+
+def test_lru_eviction():
+    """Least recently used entries are evicted once the cache is full"""
+    cache = RedirectCache(max_size=2, ttl=60, negative_ttl=60)
+    cache.set("a", CachedURL(id=1, original_url="https://a.example/"))
+    cache.set("b", CachedURL(id=2, original_url="https://b.example/"))
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", CachedURL(id=3, original_url="https://c.example/"))
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") is not MISSING
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    """Entries expire after their TTL"""
+    cache = RedirectCache(max_size=10, ttl=5, negative_ttl=5)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache.set("abc123", CachedURL(id=1, original_url="https://example.com/"))
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 6)
+    assert cache.get("abc123") is MISSING
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate():
+    """Invalidated codes are looked up again"""
+    cache = RedirectCache(max_size=10, ttl=60, negative_ttl=60)
+    cache.set("abc123", None)
+    cache.invalidate("abc123", None)
+    assert cache.get("abc123") is MISSING
+
+
+def make_tiered(backend=None):
+    return TieredRedirectCache(RedirectCache(max_size=10, ttl=60, negative_ttl=60), backend)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced():
+    """Only one loader call is made for concurrent misses on the same code"""
+    cache = make_tiered()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return CachedURL(id=1, original_url="https://example.com/")
+
+    results = await asyncio.gather(*(cache.get("abc123", loader) for _ in range(5)))
+    assert calls == 1
+    assert all(result.id == 1 for result in results)
+    assert cache.stats()["coalesced"] == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_load_is_retried_by_waiters():
+    """Cancelling the request that loads a code doesn't cancel requests waiting for it"""
+    cache = make_tiered()
+    started = asyncio.Event()
+
+    async def stalled_loader():
+        started.set()
+        await asyncio.sleep(60)
+
+    async def loader():
+        return CachedURL(id=1, original_url="https://example.com/")
+
+    leader = asyncio.create_task(cache.get("abc123", stalled_loader))
+    await started.wait()
+    waiter = asyncio.create_task(cache.get("abc123", loader))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert (await waiter).id == 1
+    assert leader.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_l2_shared_between_workers():
+    """A code loaded by one worker is served to another from L2 without a DB lookup"""
+    backend = InMemoryCacheBackend()
+    worker_a, worker_b = make_tiered(backend), make_tiered(backend)
+
+    async def loader():
+        return CachedURL(id=7, original_url="https://shared.example/")
+
+    async def failing_loader():
+        raise AssertionError("database should not be queried")
+
+    await worker_a.get("shared", loader)
+    assert await worker_b.get("shared", failing_loader) == CachedURL(id=7, original_url="https://shared.example/")
+    assert worker_b.stats()["l2_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_many_uses_single_loader_call():
+    """Batch lookups consult L1 and L2 before loading the remaining codes at once"""
+    backend = InMemoryCacheBackend()
+    cache = make_tiered(backend)
+    cache.local.set("local", CachedURL(id=1, original_url="https://local.example/"))
+    await backend.set_many({"url:code:remote": (CachedURL.to_bytes(CachedURL(id=2, original_url="https://remote.example/")), 60)})
+    loaded = []
+
+    async def loader(codes):
+        loaded.append(list(codes))
+        return {"db": CachedURL(id=3, original_url="https://db.example/")}
+
+    result = await cache.get_many(["local", "remote", "db", "unknown"], loader)
+    assert loaded == [["db", "unknown"]]
+    assert [result[code].id for code in ("local", "remote", "db")] == [1, 2, 3]
+    assert result["unknown"] is None
+
+
+@pytest.mark.asyncio
+async def test_invalidation_reaches_other_workers():
+    """Invalidations are removed from L2 and published to every worker's L1"""
+    backend = InMemoryCacheBackend()
+    worker_a, worker_b = make_tiered(backend), make_tiered(backend)
+    listener = asyncio.create_task(backend.listen_invalidations(worker_b.on_remote_invalidation))
+    await asyncio.sleep(0)
+
+    await worker_a.set("abc123", None)
+    worker_b.local.set("abc123", None)
+    await worker_a.invalidate("abc123")
+    await asyncio.sleep(0)
+
+    assert worker_b.local.peek("abc123") is MISSING
+    assert await backend.get_many(["url:code:abc123"]) == [None]
+    listener.cancel()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Every added code is reported present; unknown codes rarely are"""
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    codes = [f"code{i}" for i in range(10_000)]
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+    assert bloom.count == pytest.approx(10_000, rel=0.01)  # Minus codes that looked present already
+    assert not bloom.add(codes[0])  # Re-adding is not counted
+
+    false_positives = sum(f"other{i}" in bloom for i in range(10_000))
+    assert false_positives < 300
+    assert bloom.size_bytes < 12_000 * 2
@@ -0,0 +1,77 @@
+import pytest
+from pydantic import ValidationError
+from sqlmodel import select
+
+from app.core.setting import Settings
+from app.db.codes import (
+    ALPHABET,
+    PermutedCodeGenerator,
+    PoolCodeGenerator,
+    SequenceCodeGenerator,
+    encode,
+)
+from app.db.maintenance import fill_code_pool
+from app.db.models import ShortCodePool
+
+
+def test_encode():
+    """Numbers are encoded with the code alphabet and padded to a minimum length"""
+    assert encode(0) == "a"
+    assert encode(len(ALPHABET)) == "ba"
+    assert encode(1, length=6) == "aaaaab"
+
+
+def test_permuted_codes_are_unique():
+    """The permutation is a bijection that grows codes once a length is exhausted"""
+    generator = PermutedCodeGenerator(block_size=10, salt="test", min_length=2)
+    space = len(ALPHABET) ** 2
+    codes = [generator.code_for(n) for n in range(space + 100)]
+
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 2 for code in codes[:space])
+    assert all(len(code) == 3 for code in codes[space:])
+    assert codes[:5] != sorted(codes[:5])
+    assert PermutedCodeGenerator(block_size=10, salt="other", min_length=2).code_for(0) != codes[0]
+
+
+def test_permuted_codes_are_unpredictable():
+    """Codes of nearby ids share no structure, and the strategy refuses an empty salt"""
+    generator = PermutedCodeGenerator(block_size=10, salt="test")
+    codes = [generator.code_for(n) for n in range(1100)]
+    same_last = sum(codes[n][-1] == codes[n + len(ALPHABET)][-1] for n in range(1000))
+    assert same_last < 100  # ~1000 / 36 by chance; an affine map shares every one
+
+    with pytest.raises(ValueError):
+        PermutedCodeGenerator(block_size=10, salt="")
+    with pytest.raises(ValidationError, match="SHORT_CODE_SALT"):
+        Settings(SHORT_CODE_STRATEGY="permuted", SHORT_CODE_SALT="")
+
+
+@pytest.mark.asyncio
+async def test_workers_reserve_disjoint_blocks(session_factory):
+    """Generators in different workers never hand out the same code"""
+    workers = [SequenceCodeGenerator(block_size=3), SequenceCodeGenerator(block_size=3)]
+    codes = []
+    async with session_factory() as session:
+        for _ in range(5):
+            for worker in workers:
+                codes.append(await worker.next_code(session))
+
+    assert len(set(codes)) == 10
+    assert all(len(code) >= 6 for code in codes)
+
+
+@pytest.mark.asyncio
+async def test_pool_codes_are_reserved_in_blocks(session_factory):
+    """Pooled codes are reserved per worker and marked as used in the pool"""
+    assert await fill_code_pool(session_factory, size=10, length=7) == 10
+    generator = PoolCodeGenerator(block_size=4)
+    async with session_factory() as session:
+        codes = [await generator.next_code(session) for _ in range(5)]
+        reserved = (await session.exec(
+            select(ShortCodePool.code).where(ShortCodePool.reserved_at.is_not(None))
+        )).all()
+
+    assert len(set(codes)) == 5
+    assert len(reserved) == 8  # Two blocks of four
+    assert set(codes) <= set(reserved)
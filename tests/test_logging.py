@@ -0,0 +1,108 @@
+import logging
+import queue
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.conf.logging import DroppingQueueHandler
+from app.middleware.logging import AccessLogMiddleware
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def records():
+    """Access log records emitted during the test"""
+    handler = ListHandler()
+    access_logger = logging.getLogger("app.middleware.logging")
+    access_logger.addHandler(handler)
+    previous_level = access_logger.level
+    access_logger.setLevel(logging.INFO)
+    yield handler.records
+    access_logger.setLevel(previous_level)
+    access_logger.removeHandler(handler)
+
+
+async def echo_app(scope, receive, send):
+    """Echoes the request body back, with a status taken from the path"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    status = int(scope["path"].rsplit("/", 1)[-1] or 200)
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def post(middleware, path, content):
+    async with AsyncClient(transport=ASGITransport(app=middleware), base_url="http://testserver") as client:
+        return await client.post(path, content=content)
+
+
+@pytest.mark.asyncio
+async def test_access_log_skips_bodies_by_default(records):
+    """Metadata is logged without capturing bodies, which pass through untouched"""
+    response = await post(AccessLogMiddleware(echo_app), "/echo/201", b'{"a": 1}')
+
+    assert response.status_code == 201
+    assert response.content == b'{"a": 1}'
+    fields = records[0].http
+    assert fields["status_code"] == 201
+    assert fields["request_bytes"] == fields["response_bytes"] == 8
+    assert "request_body" not in fields and "headers" not in fields
+
+
+@pytest.mark.asyncio
+async def test_access_log_body_sampling(records):
+    """Bodies are logged, truncated, for matching paths or error statuses only"""
+    middleware = AccessLogMiddleware(echo_app, body_paths=["/debug/"], body_min_status=500, body_max_bytes=4)
+
+    await post(middleware, "/debug/200", b"abcdefgh")
+    await post(middleware, "/other/200", b"abcdefgh")
+    await post(middleware, "/other/503", b"abcdefgh")
+
+    assert records[0].http["request_body"] == "abcd"
+    assert records[0].http["response_body"] == "abcd"
+    assert "request_body" not in records[1].http
+    assert records[2].http["request_body"] == "abcd"
+
+    unsampled = AccessLogMiddleware(echo_app, body_paths=["/debug/"], body_sample_rate=0)
+    await post(unsampled, "/debug/200", b"abcdefgh")
+    assert "request_body" not in records[3].http
+
+
+def test_queue_handler_drops_when_full():
+    """A full log queue drops records instead of blocking, and counts them per level"""
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger("tests.dropping")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.warning("kept %s", "record")
+        logger.warning("dropped")
+        logger.error("dropped")
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.queue.get_nowait().msg == "kept record"
+    assert handler.dropped == {"WARNING": 1, "ERROR": 1}
+
+
+def test_access_log_wraps_redirect_fast_path():
+    """Redirects answered by the fast path are access-logged like any other request"""
+    from app.main import app
+    from app.middleware.redirect import RedirectFastPathMiddleware
+
+    stack = [middleware.cls for middleware in app.user_middleware]  # Outermost first
+    assert stack[0] is AccessLogMiddleware
+    assert RedirectFastPathMiddleware in stack
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.middleware.profiling import ProfilingMiddleware, instrument_db_timings
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    instrument_db_timings(engine)
+    yield engine
+    await engine.dispose()
+
+
+def query_app(engine):
+    """Runs two queries and answers 200"""
+    async def app(scope, receive, send):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+async def get(app, headers=None):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+        return await client.get("/api/v1/abc123/", headers=headers)
+
+
+@pytest.mark.asyncio
+async def test_profile_triggered_by_secret_header(engine, tmp_path):
+    """Only requests with the secret are profiled, with their DB time broken down"""
+    app = ProfilingMiddleware(query_app(engine), secret="s3cret", profile_dir=str(tmp_path))
+
+    plain = await get(app, {"X-Profile": "wrong"})
+    assert "server-timing" not in plain.headers
+    assert list(tmp_path.iterdir()) == []
+
+    profiled = await get(app, {"X-Profile": "s3cret"})
+    assert 'desc="2 queries"' in profiled.headers["server-timing"]
+
+    [summary_path] = tmp_path.glob("*.json")
+    assert summary_path.with_suffix(".prof").exists()
+    summary = json.loads(summary_path.read_text())
+    assert summary["path"] == "/api/v1/abc123/"
+    assert summary["db_queries"] == 2
+    assert {entry["statement"] for entry in summary["statements"]} == {"SELECT 1", "SELECT 2"}
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_sampled_and_pruned(engine, tmp_path):
+    """Sampled profiles are kept up to max_files"""
+    app = ProfilingMiddleware(query_app(engine), sample_rate=1.0, profile_dir=str(tmp_path), max_files=2)
+    for _ in range(3):
+        await get(app)
+    assert len(list(tmp_path.glob("*.prof"))) == 2
+    assert len(list(tmp_path.glob("*.json"))) == 2
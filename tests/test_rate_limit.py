@@ -0,0 +1,65 @@
+import pytest
+
+from app.core.rate_limit import InMemoryRateLimitBackend, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingBackend(InMemoryRateLimitBackend):
+    async def acquire(self, key, rate, burst, cost=1.0):
+        raise ConnectionError("redis down")
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refills_over_time():
+    """A bucket allows `burst` requests at once, then one per 1/rate seconds"""
+    clock = FakeClock()
+    backend = InMemoryRateLimitBackend(clock=clock)
+    for _ in range(3):
+        assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) == 0
+    assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) == pytest.approx(0.5)
+    assert await backend.acquire("shorten:5.6.7.8", rate=2, burst=3) == 0  # Other clients are unaffected
+
+    clock.now += 0.5
+    assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) == 0
+    assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) > 0
+
+    clock.now += 60  # Refilling stops at the burst size
+    for _ in range(3):
+        assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) == 0
+    assert await backend.acquire("shorten:1.2.3.4", rate=2, burst=3) > 0
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_buckets_are_evicted():
+    """The number of buckets kept in memory is bounded"""
+    backend = InMemoryRateLimitBackend(max_keys=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        await backend.acquire(key, rate=1, burst=1)
+    assert list(backend._buckets) == ["b", "c"]
+    assert await backend.acquire("a", rate=1, burst=1) == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_backend_limits_across_workers():
+    """Workers sharing a backend draw from the same buckets"""
+    shared = InMemoryRateLimitBackend(clock=FakeClock())
+    worker_a, worker_b = RateLimiter(backend=shared), RateLimiter(backend=shared)
+    assert await worker_a.acquire("redirect:1.2.3.4", rate=1, burst=2) == 0
+    assert await worker_b.acquire("redirect:1.2.3.4", rate=1, burst=2) == 0
+    assert await worker_a.acquire("redirect:1.2.3.4", rate=1, burst=2) > 0
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_falls_back_to_local_buckets():
+    """If the shared backend fails, the worker still limits on its own"""
+    limiter = RateLimiter(backend=FailingBackend(), local=InMemoryRateLimitBackend(clock=FakeClock()))
+    assert await limiter.acquire("shorten:1.2.3.4", rate=1, burst=1) == 0
+    assert await limiter.acquire("shorten:1.2.3.4", rate=1, burst=1) > 0
+    assert limiter.backend_errors == 2
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import select
+
+from app.db.models import URL
+from app.db.replicas import ReplicaSet
+
+
+@pytest_asyncio.fixture
+async def databases(create_database):
+    """A primary and a replica database, with a URL only the primary has replayed"""
+    (primary, primary_sessions), (replica, replica_sessions) = [
+        await create_database(name) for name in ("primary", "replica")
+    ]
+    async with primary_sessions() as session:
+        session.add(URL(original_url="https://fresh.example/", short_code="fresh1"))
+        session.add(URL(original_url="https://old.example/", short_code="old123"))
+        await session.commit()
+    async with replica_sessions() as session:
+        session.add(URL(original_url="https://replica.example/", short_code="old123"))
+        await session.commit()
+
+    return [primary, replica], [primary_sessions, replica_sessions]
+
+
+async def find(code, session):
+    return (await session.exec(select(URL).where(URL.short_code == code))).first()
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica_and_fall_back_on_miss(databases):
+    """Replica answers are used; rows the replica lacks are read from the primary"""
+    engines, makers = databases
+    replicas = ReplicaSet([engines[1]])
+
+    async with makers[0]() as primary:
+        old = await replicas.read(lambda s: find("old123", s), primary)
+        fresh = await replicas.read(lambda s: find("fresh1", s), primary)
+
+    assert old.original_url == "https://replica.example/"
+    assert fresh.original_url == "https://fresh.example/"
+    assert replicas.stats()["primary_fallbacks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_replica_is_skipped(databases, tmp_path):
+    """Replicas failing their health check get no queries until they recover"""
+    engines, makers = databases
+    broken = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    replicas = ReplicaSet([broken, engines[1]])
+
+    await replicas.check_health()
+    assert replicas.stats()["healthy"] == 1
+
+    async with makers[0]() as primary:
+        for _ in range(3):
+            url = await replicas.read(lambda s: find("old123", s), primary)
+            assert url.original_url == "https://replica.example/"
+    await broken.dispose()
+
+
+@pytest.mark.asyncio
+async def test_slow_replica_falls_back_to_primary(databases):
+    """A replica query exceeding the timeout is answered by the primary instead"""
+    engines, makers = databases
+    replicas = ReplicaSet([engines[1]], query_timeout=0.05)
+
+    async def slow_find(session):
+        if session.bind is engines[1]:
+            await asyncio.sleep(1)
+        return await find("old123", session)
+
+    async with makers[0]() as primary:
+        url = await replicas.read(slow_find, primary)
+
+    assert url.original_url == "https://old.example/"
+    assert replicas.stats() == {"replicas": 1, "healthy": 0, "replica_reads": 0, "primary_fallbacks": 1}
+
+
+@pytest.mark.asyncio
+async def test_batch_reads_query_only_missing_keys_on_primary(databases):
+    """Only the codes the replica lacks are looked up on the primary, and merged"""
+    engines, makers = databases
+    replicas = ReplicaSet([engines[1]])
+    queried = []
+
+    async def find_many(session, codes):
+        queried.append((session.bind is engines[1], codes))
+        rows = await session.exec(select(URL).where(URL.short_code.in_(codes)))
+        return {url.short_code: url.original_url for url in rows}
+
+    async with makers[0]() as primary:
+        found = await replicas.read_many(find_many, ["old123", "fresh1", "nope00"], primary,
+                                         retry_if=lambda code: code != "nope00")
+
+    assert found == {"old123": "https://replica.example/", "fresh1": "https://fresh.example/"}
+    assert queried == [(True, ["old123", "fresh1", "nope00"]), (False, ["fresh1"])]
+    assert replicas.stats()["primary_fallbacks"] == 1
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
@@ -5,7 +7,15 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.db.session import get_session
+from app.api import routes
+from app.core.rate_limit import rate_limiter
+from app.core.setting import settings
+from app.db import crud
+from app.db.cache import redirect_cache
+from app.db.code_filter import short_code_filter
+from app.db.health import ReadinessCheck
+from app.db.models import URL
+from app.db.session import get_session, get_session_factory
 from app.main import app
 
 # In-memory SQLite database for fast, isolated tests
@@ -39,6 +49,9 @@ async def setup_db():
     """Auto-used fixture to reset database state before each test"""
     # Create tables before test
     await init_test_db()
+    redirect_cache.clear()
+    rate_limiter.clear()
+    short_code_filter.clear()
     yield  # Test runs here
     # Clean up tables after test
     async with engine_test.begin() as conn:
@@ -50,6 +63,7 @@ async def client():
     """Test client with dependency overrides and clean headers"""
     # Override database dependency
     app.dependency_overrides[get_session] = override_get_session
+    app.dependency_overrides[get_session_factory] = lambda: async_session_test
 
     # Create test client with optimized settings
     async with AsyncClient(
@@ -108,6 +122,18 @@ async def test_url_shortening(client):
     assert len(data["short_code"]) >= 6  # Ensure reasonable code length
 
 
+@pytest.mark.asyncio
+async def test_long_url_deduplication(client):
+    """Long URLs are deduplicated through the digest column"""
+    long_url = "https://tracking.example/click?" + "&".join(f"utm_{i}=value{i}" for i in range(100))
+    first = await shorten_url(client, long_url)
+    second = await shorten_url(client, long_url)
+    other = await shorten_url(client, long_url + "&utm_extra=1")
+
+    assert first.json()["short_code"] == second.json()["short_code"]
+    assert other.json()["short_code"] != first.json()["short_code"]
+
+
 @pytest.mark.asyncio
 async def test_redirect_functionality(client):
     """Short code redirects to original URL with 307 status"""
@@ -218,4 +244,374 @@ async def test_statistics_accuracy(client):
     # Second visit
     await redirect_url(client, short_code)
     stats_response = await get_url_stats(client, short_code)
-    assert stats_response.json()["visits"] == 2
\ No newline at end of file
+    assert stats_response.json()["visits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_redirect_cache(client):
+    """Redirects populate the cache, including negative entries for unknown codes"""
+    url = "https://cache.example/"
+    create_response = await shorten_url(client, url)
+    short_code = create_response.json()["short_code"]
+
+    await redirect_url(client, short_code)
+    await redirect_url(client, "unknowncode")
+    hits_before = redirect_cache.stats()["hits"]
+
+    assert (await redirect_url(client, short_code)).headers["location"] == url
+    assert (await redirect_url(client, "unknowncode")).status_code == 404
+    assert redirect_cache.stats()["hits"] == hits_before + 2
+
+
+@pytest.mark.asyncio
+async def test_visit_timeseries(client):
+    """Timeseries endpoint buckets visits from the rollup table"""
+    create_response = await shorten_url(client, "https://timeseries.example/")
+    short_code = create_response.json()["short_code"]
+    for _ in range(3):
+        await redirect_url(client, short_code)
+
+    response = await client.get(f"/api/v1/{short_code}/stats/timeseries/", params={"granularity": "hour"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["granularity"] == "hour"
+    assert len(data["buckets"]) in (168, 169)  # Last 7 days of hours
+    assert sum(bucket["visits"] for bucket in data["buckets"]) == 3
+    assert data["buckets"][-1]["visits"] == 3
+
+    day_response = await client.get(f"/api/v1/{short_code}/stats/timeseries/", params={"granularity": "day"})
+    assert day_response.json()["buckets"][-1]["visits"] == 3
+
+
+@pytest.mark.asyncio
+async def test_visit_timeseries_errors(client):
+    """Timeseries endpoint rejects unknown codes and oversized ranges"""
+    response = await client.get("/api/v1/INVALID_CODE/stats/timeseries/")
+    assert response.status_code == 404
+
+    create_response = await shorten_url(client, "https://timeseries-range.example/")
+    short_code = create_response.json()["short_code"]
+    response = await client.get(
+        f"/api/v1/{short_code}/stats/timeseries/",
+        params={"granularity": "minute", "start": "2000-01-01T00:00:00Z"},
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_short_code_collision_retry(client, monkeypatch):
+    """A generated code that is already taken is retried instead of failing the request"""
+    first = (await shorten_url(client, "https://first.example/")).json()["short_code"]
+    codes = iter([first, "freshcode"])
+
+    class FixedCodes:
+        async def next_code(self, session):
+            return next(codes)
+
+    monkeypatch.setattr(crud, "code_generator", FixedCodes())
+    response = await shorten_url(client, "https://second.example/")
+    assert response.status_code == 201
+    assert response.json()["short_code"] == "freshcode"
+
+
+@pytest.mark.asyncio
+async def test_bulk_shorten_json_array(client):
+    """Bulk endpoint dedupes against existing rows and reports invalid entries per index"""
+    existing = (await shorten_url(client, "https://existing.example/")).json()["short_code"]
+    response = await client.post("/api/v1/shorten/bulk/", json=[
+        "https://existing.example/",
+        {"original_url": "https://new.example/"},
+        "not-a-url",
+        "https://new.example/",
+    ])
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+    assert lines[0] == {"index": 0, "original_url": "https://existing.example/",
+                        "short_code": existing, "created": False}
+    assert lines[1]["created"] is True
+    assert "error" in lines[2]
+    assert lines[3]["short_code"] == lines[1]["short_code"]
+    assert redirect_cache.local.peek(lines[1]["short_code"]).original_url == "https://new.example/"
+
+    redirect_response = await redirect_url(client, lines[1]["short_code"])
+    assert redirect_response.headers["location"] == "https://new.example/"
+
+
+@pytest.mark.asyncio
+async def test_bulk_shorten_ndjson_stream(client):
+    """NDJSON uploads are consumed in chunks and a malformed line ends the stream"""
+    async def body():
+        yield b'"https://a.example/"\n{"original_url": "https://b'
+        yield b'.example/"}\n'
+        yield b'{broken\n'
+
+    response = await client.post(
+        "/api/v1/shorten/bulk/",
+        content=body(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("original_url") for line in lines[:2]] == ["https://a.example/", "https://b.example/"]
+    assert lines[2]["index"] == 2
+    assert "Invalid JSON" in lines[2]["error"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_shorten_json_array_chunked(client):
+    """A number cut at a chunk boundary is a per-item error, not a broken stream"""
+    async def body():
+        yield b'["https://a.example/", 12'
+        yield b'34, "https://b.example/"]'
+
+    response = await client.post(
+        "/api/v1/shorten/bulk/",
+        content=body(),
+        headers={"Content-Type": "application/json"},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert "error" in lines[1] and "error" not in lines[2]
+    assert lines[2]["original_url"] == "https://b.example/"
+
+
+@pytest.mark.asyncio
+async def test_pool_stats(client):
+    """Pool statistics endpoint reports the engine's pool"""
+    response = await client.get("/api/v1/stats/pool/")
+    assert response.status_code == 200
+    assert response.json()["pool_class"]
+
+
+@pytest.mark.asyncio
+async def test_health_probes(client, monkeypatch):
+    """Liveness never touches the database; readiness reports 503 when it fails"""
+    monkeypatch.setattr(routes, "readiness_check", ReadinessCheck(ttl=0, timeout=1.0))
+    assert (await client.get("/api/v1/health/live/")).json() == {"status": "ok"}
+    assert (await client.get("/api/v1/health/ready/")).status_code == 200
+
+    def broken_factory():
+        raise ConnectionError("database is down")
+
+    app.dependency_overrides[get_session_factory] = lambda: broken_factory
+    response = await client.get("/api/v1/health/ready/")
+    assert response.status_code == 503
+    assert response.json() == {"status": "unavailable"}
+
+
+@pytest.mark.asyncio
+async def test_cached_redirect_skips_session(client, monkeypatch):
+    """A redirect served from the cache never creates a database session"""
+    short_code = (await shorten_url(client, "https://lazy.example/")).json()["short_code"]
+    await redirect_url(client, short_code)
+
+    async def queued(*args):
+        return True  # As if taken by the background visit writer
+
+    monkeypatch.setattr(crud.visit_recorder, "submit", queued)
+    sessions = []
+
+    def counting_factory():
+        sessions.append(1)
+        return async_session_test()
+
+    app.dependency_overrides[get_session_factory] = lambda: counting_factory
+    response = await redirect_url(client, short_code)
+    assert response.headers["location"] == "https://lazy.example/"
+    assert sessions == []
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client):
+    """Redirect outcomes and per-route latency show up in /metrics"""
+    short_code = (await shorten_url(client, "https://metrics.example/")).json()["short_code"]
+    await redirect_url(client, short_code)
+    await redirect_url(client, "missing-code")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'redirects_total{result="hit"}' in body
+    assert 'redirects_total{result="not_found"}' in body
+    assert 'route="/api/v1/{short_code}/"' in body
+
+
+@pytest.mark.asyncio
+async def test_shorten_rate_limit(client, monkeypatch):
+    """Past its burst, a client gets 429 with Retry-After, without affecting redirects"""
+    monkeypatch.setattr(routes.shorten_rate_limit, "rate", 0.5)
+    monkeypatch.setattr(routes.shorten_rate_limit, "burst", 2)
+    first = await shorten_url(client, "https://limited.example/1")
+    assert (await shorten_url(client, "https://limited.example/2")).status_code == 201
+
+    response = await shorten_url(client, "https://limited.example/3")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+
+    response = await redirect_url(client, first.json()["short_code"])
+    assert response.status_code == 307
+
+
+@pytest.mark.asyncio
+async def test_stats_batch(client):
+    """Batch stats report counts in request order, 404s per code, and enforce the size cap"""
+    first = (await shorten_url(client, "https://batch.example/1")).json()["short_code"]
+    second = (await shorten_url(client, "https://batch.example/2")).json()["short_code"]
+    await redirect_url(client, first)
+    await redirect_url(client, first)
+
+    response = await client.post("/api/v1/stats/batch/", json={"short_codes": [second, "missing", first, second]})
+    assert response.status_code == 200
+    assert response.json() == {"stats": [
+        {"short_code": second, "visits": 0, "status": 200},
+        {"short_code": "missing", "visits": None, "status": 404, "error": "URL not found"},
+        {"short_code": first, "visits": 2, "status": 200},
+    ]}
+
+    too_many = [f"code{i}" for i in range(settings.STATS_BATCH_MAX_CODES + 1)]
+    response = await client.post("/api/v1/stats/batch/", json={"short_codes": too_many})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_short_code_filter_rejects_unknown_codes(client):
+    """Once built, the filter sends unknown codes to the primary once, then serves the cached 404"""
+    known = (await shorten_url(client, "https://filter.example/1")).json()["short_code"]
+    await short_code_filter.build(async_session_test)
+
+    sessions = []
+
+    def counting_factory():
+        sessions.append(1)
+        return async_session_test()
+
+    app.dependency_overrides[get_session_factory] = lambda: counting_factory
+    assert (await redirect_url(client, "no-such-code")).status_code == 404
+    assert (await redirect_url(client, "no-such-code")).status_code == 404
+    assert sessions == [1]
+
+    # Codes created through the API are added right away
+    app.dependency_overrides[get_session_factory] = lambda: async_session_test
+    created = (await shorten_url(client, "https://filter.example/2")).json()["short_code"]
+    assert (await redirect_url(client, created)).status_code == 307
+    assert (await redirect_url(client, known)).status_code == 307
+
+    # Rows written by another process, whose cache write never arrived, resolve before the next sync
+    async with async_session_test() as session:
+        session.add(URL(original_url="https://filter.example/3", short_code="elsewhere"))
+        await session.commit()
+    assert short_code_filter.rejects("elsewhere")
+    assert (await redirect_url(client, "elsewhere")).status_code == 307
+    assert not short_code_filter.rejects("elsewhere")
+
+
+@pytest.mark.asyncio
+async def test_redirect_fast_path(client, monkeypatch):
+    """Cached redirects are answered before the router, with the same response"""
+    short_code = (await shorten_url(client, "https://fast.example/a b")).json()["short_code"]
+    routed = await redirect_url(client, short_code)  # Recorder not running: full app
+
+    submitted = []
+
+    async def queued(url_id, ip, timestamp=None):
+        submitted.append(ip)
+        return True
+
+    async def not_routed(*args):
+        raise AssertionError("The redirect route was called")
+
+    monkeypatch.setattr(crud.visit_recorder, "_running", True)
+    monkeypatch.setattr(crud.visit_recorder, "submit", queued)
+    monkeypatch.setattr(crud, "get_cached_url_by_code", not_routed)
+    response = await redirect_url(client, short_code)
+    assert response.status_code == 307
+    assert response.headers["location"] == routed.headers["location"] == "https://fast.example/a%20b"
+    assert submitted == ["127.0.0.1"]
+
+    # Other routes under the prefix are not taken for short codes
+    assert (await client.get("/api/v1/ping/")).json() == {"status": "ok"}
+
+
+@pytest.mark.asyncio
+async def test_redirect_fast_path_charges_once(client, monkeypatch):
+    """A request the fast path passes on after taking its token isn't rate-limited again"""
+    short_code = (await shorten_url(client, "https://once.example/")).json()["short_code"]
+    await redirect_url(client, short_code)  # Caches the link
+
+    async def stopped(url_id, ip, timestamp=None):
+        return False
+
+    monkeypatch.setattr(routes.redirect_rate_limit, "rate", 0.001)
+    monkeypatch.setattr(routes.redirect_rate_limit, "burst", 1)
+    monkeypatch.setattr(crud.visit_recorder, "_running", True)
+    monkeypatch.setattr(crud.visit_recorder, "submit", stopped)
+    assert (await redirect_url(client, short_code)).status_code == 307
+    assert (await redirect_url(client, short_code)).status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_redirect_modes(client):
+    """Cacheable links send max-age and an ETag; the default mode forbids caching"""
+    counted = (await shorten_url(client, "https://counted.example/")).json()["short_code"]
+    response = await redirect_url(client, counted)
+    assert response.status_code == 307
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
+
+    response = await client.post("/api/v1/shorten/", json={
+        "original_url": "https://cached.example/", "redirect_status": 308, "redirect_max_age": 600,
+    })
+    cached = response.json()["short_code"]
+    response = await redirect_url(client, cached)
+    assert response.status_code == 308
+    assert response.headers["cache-control"] == "public, max-age=600"
+    etag = response.headers["etag"]
+
+    revalidated = await client.get(f"/api/v1/{cached}/", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+    assert (await client.get(f"/api/v1/{cached}/stats/")).json() == {"visits": 2}
+
+    response = await client.post("/api/v1/shorten/", json={
+        "original_url": "https://other.example/", "redirect_status": 303,
+    })
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_expired_links_are_gone(client):
+    """Links past max_clicks answer 410; limited links are never handed out to other requests"""
+    response = await client.post("/api/v1/shorten/", json={
+        "original_url": "https://campaign.example/", "expires_at": "2020-01-01T00:00:00Z",
+    })
+    assert response.status_code == 422
+
+    response = await client.post("/api/v1/shorten/", json={
+        "original_url": "https://once.example/", "max_clicks": 1,
+    })
+    short_code = response.json()["short_code"]
+    assert (await redirect_url(client, short_code)).status_code == 307
+    assert (await redirect_url(client, short_code)).status_code == 410
+
+    # Neither single nor bulk shortens of the same URL return the limited link
+    plain = (await shorten_url(client, "https://once.example/")).json()["short_code"]
+    assert plain != short_code
+    assert (await redirect_url(client, plain)).status_code == 307
+    response = await client.post("/api/v1/shorten/bulk/", json=["https://once.example/"])
+    assert json.loads(response.text)["short_code"] == plain
+
+
+@pytest.mark.asyncio
+async def test_shorten_unavailable_without_free_code(client, monkeypatch):
+    """Running out of code attempts is reported as 503, not as a server error"""
+    taken = (await shorten_url(client, "https://taken.example/")).json()["short_code"]
+
+    async def next_code(session):
+        return taken
+
+    monkeypatch.setattr(crud.code_generator, "next_code", next_code)
+    response = await shorten_url(client, "https://other.example/")
+    assert response.status_code == 503
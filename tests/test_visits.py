@@ -0,0 +1,247 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import event, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.setting import Settings
+from app.db.maintenance import compact_visits, reconcile_visit_counts, sweep_expired_links
+from app.db.models import URL, URLVisit, URLVisitRollup
+from app.db.partitions import add_months, maintain_visit_partitions, month_start, partition_name
+from app.db.visits import IPMode, OverflowPolicy, VisitRecorder, anonymize_ip
+
+
+async def count_visits(session_factory):
+    async with session_factory() as session:
+        return (await session.exec(select(func.count(URLVisit.id)))).one()
+
+
+@pytest.mark.asyncio
+async def test_submit_requires_running_recorder(session_factory):
+    """Visits are refused while the recorder is stopped so callers can fall back"""
+    recorder = VisitRecorder(session_factory=session_factory)
+    assert await recorder.submit(1, "127.0.0.1") is False
+
+
+def test_hashed_ip_mode_requires_key():
+    """The "hashed" IP mode refuses to start without a hash key"""
+    with pytest.raises(ValidationError, match="VISIT_IP_HASH_KEY"):
+        Settings(VISIT_IP_MODE="hashed", VISIT_IP_HASH_KEY="")
+    assert Settings(VISIT_IP_MODE="hashed", VISIT_IP_HASH_KEY="secret").VISIT_IP_HASH_KEY == "secret"
+
+
+@pytest.mark.asyncio
+async def test_visit_ips_stored_packed(session_factory):
+    """IPs are stored as packed bytes and read back as text, in every IP mode"""
+    url_id = await create_url(session_factory, "packed")
+    ips = [
+        anonymize_ip("203.0.113.77", IPMode.full),
+        anonymize_ip("2001:db8:abcd:12::1", IPMode.truncated),
+        anonymize_ip("203.0.113.77", IPMode.hashed, key="secret"),
+        anonymize_ip("testclient", IPMode.full),
+        anonymize_ip("203.0.113.77", IPMode.none),
+    ]
+    assert ips[1] == "2001:db8:abcd::"
+    assert len(ips[2]) == 16 and ips[2] != anonymize_ip("203.0.113.77", IPMode.hashed, key="other")
+    assert ips[3:] == [None, None]
+
+    recorder = VisitRecorder(session_factory=session_factory)
+    await recorder.start()
+    for ip in ips:
+        await recorder.submit(url_id, ip)
+    await recorder.stop()
+
+    async with session_factory() as session:
+        stored = (await session.exec(select(URLVisit.ip_address).order_by(URLVisit.id))).all()
+        raw = (await session.exec(select(func.length(URLVisit.ip_address)).order_by(URLVisit.id))).all()
+    assert stored == ips
+    assert raw == [4, 16, 8, None, None]
+
+
+@pytest.mark.asyncio
+async def test_visits_flushed_in_batches_and_on_stop(session_factory):
+    """Queued visits are written in multi-row batches and flushed on shutdown"""
+    recorder = VisitRecorder(session_factory=session_factory, batch_size=10, flush_interval=60)
+    await recorder.start()
+    for _ in range(25):
+        assert await recorder.submit(1, "127.0.0.1")
+    await recorder.stop()
+
+    assert await count_visits(session_factory) == 25
+    stats = recorder.stats()
+    assert stats["flushed"] == 25
+    assert stats["flush_count"] == 3
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_drop_policy_counts_overflow(session_factory):
+    """With the drop policy, visits beyond the queue size are discarded and counted"""
+    recorder = VisitRecorder(session_factory=session_factory, max_queue_size=5,
+                             overflow_policy=OverflowPolicy.drop)
+    await recorder.start()
+    for _ in range(8):  # The writer task doesn't get to run between these submits
+        await recorder.submit(1, None)
+    await recorder.stop()
+
+    assert recorder.dropped == 3
+    assert await count_visits(session_factory) == 5
+
+
+@pytest.mark.asyncio
+async def test_spill_policy_replays_on_start(session_factory, tmp_path):
+    """With the spill policy, overflow goes to disk and is written on the next start"""
+    spill_path = str(tmp_path / "visits.ndjson")
+    recorder = VisitRecorder(session_factory=session_factory, max_queue_size=5,
+                             overflow_policy=OverflowPolicy.spill, spill_path=spill_path)
+    await recorder.start()
+    for _ in range(8):
+        await recorder.submit(1, None)
+    await recorder.stop()
+    # Spilling yields to the writer, which makes room in the queue again
+    assert recorder.spilled > 0
+    assert await count_visits(session_factory) == 8 - recorder.spilled
+
+    # Left behind by a worker that crashed while replaying
+    (tmp_path / "visits.ndjson.replay").write_text(
+        json.dumps({"url_id": 1, "ip_address": None, "timestamp": "2026-01-01T00:00:00"}) + "\n"
+    )
+    await recorder.start()
+    await recorder.stop()
+    assert await count_visits(session_factory) == 9
+    assert list(tmp_path.iterdir()) == []
+
+
+async def create_url(session_factory, code):
+    async with session_factory() as session:
+        url = URL(original_url=f"https://{code}.example/", short_code=code)
+        session.add(url)
+        await session.commit()
+        return url.id
+
+
+async def get_visit_count(session_factory, url_id):
+    async with session_factory() as session:
+        return (await session.exec(select(URL.visit_count).where(URL.id == url_id))).one()
+
+
+@pytest.mark.asyncio
+async def test_batches_increment_visit_counters(session_factory):
+    """Each flushed batch bumps url.visit_count by the visits recorded per URL"""
+    first, second = await create_url(session_factory, "first1"), await create_url(session_factory, "second")
+    recorder = VisitRecorder(session_factory=session_factory, batch_size=4, flush_interval=60)
+    await recorder.start()
+    for url_id in (first, second, first, first, second):
+        await recorder.submit(url_id, None)
+    await recorder.stop()
+
+    assert await get_visit_count(session_factory, first) == 3
+    assert await get_visit_count(session_factory, second) == 2
+
+
+@pytest.mark.asyncio
+async def test_reconcile_visit_counts(session_factory):
+    """Reconciliation reports counters that drifted from url_visit and fixes them"""
+    url_id = await create_url(session_factory, "drift1")
+    async with session_factory() as session:
+        session.add_all([URLVisit(url_id=url_id), URLVisit(url_id=url_id)])
+        await session.commit()
+
+    assert await reconcile_visit_counts(session_factory) == {url_id: (0, 2)}
+    assert await reconcile_visit_counts(session_factory, fix=True, chunk_size=1) == {url_id: (0, 2)}
+    assert await get_visit_count(session_factory, url_id) == 2
+    assert await reconcile_visit_counts(session_factory) == {}
+
+
+@pytest.mark.asyncio
+async def test_compact_visits(session_factory):
+    """Compaction drops expired fine-grained rollups and raw visits in batches"""
+    url_id = await create_url(session_factory, "compact")
+    now = datetime(2026, 1, 31, 12, 0)
+    old, recent = now - timedelta(days=10), now - timedelta(hours=1)
+    recorder = VisitRecorder(session_factory=session_factory)
+    await recorder.start()
+    for ts in (old, old, recent):
+        await recorder.submit(url_id, None, timestamp=ts)
+    await recorder.stop()
+
+    deleted = await compact_visits(session_factory, minute_retention_days=2, hour_retention_days=5,
+                                   raw_retention_days=7, batch_size=1, now=now)
+    assert deleted == {"minute_rollups": 1, "hour_rollups": 1, "raw_visits": 2}
+
+    async with session_factory() as session:
+        rollups = (await session.exec(select(URLVisitRollup.granularity, URLVisitRollup.visits))).all()
+    assert sorted(rollups) == [("day", 1), ("day", 2), ("hour", 1), ("minute", 1)]
+    assert await count_visits(session_factory) == 1
+    assert await reconcile_visit_counts(session_factory, source="rollup") == {}
+
+
+@pytest.mark.asyncio
+async def test_visit_partition_helpers(session_factory):
+    """Monthly partitions are named by month; maintenance is a no-op without partitioning"""
+    month = month_start(datetime(2026, 11, 17, 8, 30))
+    assert month == datetime(2026, 11, 1)
+    assert [partition_name(add_months(month, n)) for n in range(3)] == [
+        "url_visit_p2026_11", "url_visit_p2026_12", "url_visit_p2027_01",
+    ]
+    assert add_months(month, -11) == datetime(2025, 12, 1)
+    assert await maintain_visit_partitions(session_factory, months_ahead=3, retention_days=30) == {
+        "created": [], "expired": [],
+    }
+
+
+@pytest.mark.asyncio
+async def test_max_clicks_and_sweep_expired_links(session_factory):
+    """Links expire once their visits reach max_clicks; the sweeper deletes them with their visits"""
+    limited, kept = await create_url(session_factory, "limited"), await create_url(session_factory, "kept01")
+    async with session_factory() as session:
+        url = await session.get(URL, limited)
+        url.max_clicks = 2
+        await session.commit()
+
+    recorder = VisitRecorder(session_factory=session_factory, batch_size=2, flush_interval=60)
+    await recorder.start()
+    for url_id in (limited, kept, limited):
+        await recorder.submit(url_id, None)
+    await recorder.stop()
+
+    async with session_factory() as session:
+        expires_at = (await session.exec(select(URL.expires_at).where(URL.id == limited))).one()
+    assert expires_at is not None
+
+    # Still within the retention of expired links
+    assert await sweep_expired_links(session_factory, retention_days=1) == {"urls": 0, "visits": 0, "rollups": 0}
+
+    deleted = await sweep_expired_links(session_factory, retention_days=1, batch_size=1,
+                                        now=expires_at + timedelta(days=2))
+    assert deleted == {"urls": 1, "visits": 2, "rollups": 3}
+    async with session_factory() as session:
+        assert (await session.exec(select(URL.short_code))).all() == ["kept01"]
+    assert await count_visits(session_factory) == 1
+
+
+@pytest.mark.asyncio
+async def test_visits_of_deleted_links_are_dropped():
+    """A visit of a link deleted while it was queued doesn't fail the rest of its batch"""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    event.listen(engine.sync_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    async with session_factory() as session:
+        session.add(URL(id=1, original_url="https://kept.example/", short_code="kept01"))
+        await session.commit()
+
+    recorder = VisitRecorder(session_factory=session_factory)
+    await recorder._flush([
+        {"url_id": 1, "ip_address": None, "timestamp": datetime(2026, 1, 1)},
+        {"url_id": 2, "ip_address": None, "timestamp": datetime(2026, 1, 1)},
+    ])
+    assert (recorder.flushed, recorder.failed, recorder.dropped) == (1, 0, 1)
+    async with session_factory() as session:
+        assert (await session.exec(select(URLVisit.url_id))).all() == [1]
+    await engine.dispose()